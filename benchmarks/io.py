@@ -0,0 +1,36 @@
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import os, shutil, tempfile
+import numpy
+
+import condor.utils.cxiwriter
+
+
+class CXIWrite:
+    """
+    Writing of n x n diffraction patterns (data, complex amplitudes and mask) to a CXI file
+    """
+    params = ([256, 1024], [False, True])
+    param_names = ["n", "gzip_compression"]
+
+    def setup(self, n, gzip_compression):
+        self.tmpdir = tempfile.mkdtemp()
+        self.W = condor.utils.cxiwriter.CXIWriter(os.path.join(self.tmpdir, "bench.cxi"), gzip_compression=gzip_compression)
+        self.D = {
+            "entry_1": {
+                "data_1": {
+                    "data"         : numpy.random.poisson(10., (n, n)).astype(numpy.float64),
+                    "data_fourier" : numpy.random.rand(n, n) + 1.j*numpy.random.rand(n, n),
+                    "mask"         : numpy.zeros((n, n), dtype=numpy.uint16),
+                    "full_period_resolution" : 1E-9,
+                },
+            },
+        }
+        # First write creates the datasets
+        self.W.write(self.D)
+
+    def teardown(self, n, gzip_compression):
+        self.W.close()
+        shutil.rmtree(self.tmpdir)
+
+    def time_write(self, n, gzip_compression):
+        self.W.write(self.D)
@@ -0,0 +1,248 @@
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logging.getLogger('condor').setLevel("WARNING")
+
+import condor
+import condor.utils.sphere_diffraction
+import condor.utils.spheroid_diffraction
+import condor.utils.bodies
+import condor.utils.resample
+import condor.utils.fourier_volume
+import condor.utils.projection
+import condor.utils.sphere_fit
+from condor.utils.rotation import Rotation
+
+WAVELENGTH = 1E-9
+
+
+def _make_detector(n, **kwargs):
+    return condor.Detector(distance=0.74, pixel_size=75E-6*1024/n, nx=n, ny=n, **kwargs)
+
+
+class SphereDiffraction:
+    """
+    Analytical sphere form factor evaluated on an n x n detector
+    """
+    params = [128, 512, 1024]
+    param_names = ["n"]
+
+    def setup(self, n):
+        det = _make_detector(n)
+        self.q = numpy.sqrt((det.generate_qmap(WAVELENGTH)**2).sum(axis=-1))
+        self.table = condor.utils.sphere_diffraction.get_sphere_form_factor_table(1E-8)
+
+    def time_F_sphere_diffraction(self, n):
+        condor.utils.sphere_diffraction.F_sphere_diffraction(1., self.q, 100E-9)
+
+    def time_F_sphere_diffraction_table(self, n):
+        condor.utils.sphere_diffraction.F_sphere_diffraction(1., self.q, 100E-9, table=self.table)
+
+    def peakmem_F_sphere_diffraction(self, n):
+        condor.utils.sphere_diffraction.F_sphere_diffraction(1., self.q, 100E-9)
+
+
+class SpheroidDiffraction:
+    """
+    Analytical spheroid form factor evaluated on an n x n detector
+    """
+    params = [128, 512, 1024]
+    param_names = ["n"]
+
+    def setup(self, n):
+        det = _make_detector(n)
+        qmap = det.generate_qmap(WAVELENGTH)
+        self.qx = qmap[:,:,0]
+        self.qy = qmap[:,:,1]
+
+    def time_F_spheroid_diffraction(self, n):
+        condor.utils.spheroid_diffraction.F_spheroid_diffraction(1., self.qx, self.qy, 60E-9, 120E-9, 0.3, 1.1)
+
+    def peakmem_F_spheroid_diffraction(self, n):
+        condor.utils.spheroid_diffraction.F_spheroid_diffraction(1., self.qx, self.qy, 60E-9, 120E-9, 0.3, 1.1)
+
+
+class Qmap:
+    """
+    Generation of 2D and 3D maps of scattering vectors
+    """
+    params = [128, 512, 1024]
+    param_names = ["n"]
+
+    def setup(self, n):
+        self.det = _make_detector(n)
+        self.rotation = Rotation(formalism="quaternion", values=numpy.array([0.5, 0.5, 0.5, 0.5]))
+
+    def time_generate_qmap(self, n):
+        self.det.generate_qmap(WAVELENGTH)
+
+    def time_generate_qmap_rotated(self, n):
+        self.det.generate_qmap(WAVELENGTH, extrinsic_rotation=self.rotation)
+
+    def peakmem_generate_qmap(self, n):
+        self.det.generate_qmap(WAVELENGTH)
+
+
+class Qmap3d:
+    """
+    Generation of 3D maps of scattering vectors on a qn^3 grid
+    """
+    params = [32, 64, 128]
+    param_names = ["qn"]
+
+    def setup(self, qn):
+        self.det = _make_detector(128)
+        self.qmax = numpy.sqrt((self.det.get_q_max(WAVELENGTH, pos="edge")**2).sum())
+
+    def time_generate_qmap_3d(self, qn):
+        self.det.generate_qmap_3d(WAVELENGTH, qn=qn, qmax=self.qmax)
+
+    def peakmem_generate_qmap_3d(self, qn):
+        self.det.generate_qmap_3d(WAVELENGTH, qn=qn, qmax=self.qmax)
+
+
+class RotateVectors:
+    """
+    Rotation of an array of N 3D vectors
+    """
+    params = [1000, 100000, 1000000]
+    param_names = ["N"]
+
+    def setup(self, N):
+        self.rotation = Rotation(formalism="quaternion", values=numpy.array([0.5, 0.5, 0.5, 0.5]))
+        self.vectors = numpy.random.rand(N, 3)
+
+    def time_rotate_vectors(self, N):
+        self.rotation.rotate_vectors(self.vectors)
+
+    def time_rotate_vectors_zyx(self, N):
+        self.rotation.rotate_vectors(self.vectors, order="zyx")
+
+
+class Bodies:
+    """
+    Voxelisation of geometrical bodies on an N^3 grid
+    """
+    params = [32, 64, 128]
+    param_names = ["N"]
+
+    def time_make_sphere_map(self, N):
+        condor.utils.bodies.make_sphere_map(N, N/2.5)
+
+    def time_make_icosahedron_map(self, N):
+        condor.utils.bodies.make_icosahedron_map(N, N/2.5)
+
+    def time_make_icosahedron_map_supersampled(self, N):
+        condor.utils.bodies.make_icosahedron_map(N, N/2.5, supersampling=4)
+
+    def time_make_spheroid_map(self, N):
+        condor.utils.bodies.make_spheroid_map(N, N/3., N/2.5)
+
+    def time_make_cube_map(self, N):
+        condor.utils.bodies.make_cube_map(N, N/2.5)
+
+    def peakmem_make_sphere_map(self, N):
+        condor.utils.bodies.make_sphere_map(N, N/2.5)
+
+    def peakmem_make_sphere_map_float32(self, N):
+        condor.utils.bodies.make_sphere_map(N, N/2.5, dtype="float32")
+
+    def peakmem_make_spheroid_map(self, N):
+        condor.utils.bodies.make_spheroid_map(N, N/3., N/2.5)
+
+    def peakmem_make_cube_map(self, N):
+        condor.utils.bodies.make_cube_map(N, N/2.5)
+
+    def peakmem_make_icosahedron_map(self, N):
+        condor.utils.bodies.make_icosahedron_map(N, N/2.5)
+
+
+class Downsample:
+    """
+    Integrating downsampling of an n x n pattern with mask
+    """
+    params = ([256, 1024], [2, 4])
+    param_names = ["n", "binning"]
+
+    def setup(self, n, binning):
+        self.I = numpy.random.rand(n, n)
+        self.M = numpy.zeros((n, n), dtype="uint16")
+
+    def time_downsample_integrate(self, n, binning):
+        condor.utils.resample.downsample(self.I, binning, mode="integrate")
+
+    def time_downsample_integrate_masked(self, n, binning):
+        condor.utils.resample.downsample(self.I, binning, mode="integrate", mask2d0=self.M,
+                                         bad_bits=condor.utils.pixelmask.PixelMask.PIXEL_IS_IN_MASK, min_N_pixels=1)
+
+
+class FourierVolume:
+    """
+    Fourier volume of a map of N x N x N voxels interpolated at the scattering vectors of a rotated 512 x 512 detector
+    """
+    params = [32, 64]
+    param_names = ["N"]
+
+    def setup(self, N):
+        self.m = condor.utils.bodies.make_sphere_map(N, N/3.)
+        self.V = condor.utils.fourier_volume.FourierVolume(self.m)
+        rot = Rotation(formalism="quaternion", values=condor.utils.rotation.quat(0.7, 0.3, 0.5, 0.8))
+        qmap = _make_detector(512).generate_qmap(WAVELENGTH, extrinsic_rotation=rot, order="zyx")
+        self.c = (qmap * 0.9 / abs(qmap).max() / 2.).reshape(-1, 3)
+
+    def time_fourier_volume(self, N):
+        condor.utils.fourier_volume.FourierVolume(self.m)
+
+    def time_interpolate(self, N):
+        self.V.interpolate(self.c)
+
+
+class Projection:
+    """
+    Rotated map of N x N x N voxels propagated in the projection approximation (curvature corrections up to order 4) to a 512 x 512 detector
+    """
+    params = [64, 128, 256]
+    param_names = ["N"]
+
+    def setup(self, N):
+        self.m = condor.utils.bodies.make_sphere_map(N, N/3.)
+        self.rot = Rotation(formalism="quaternion", values=condor.utils.rotation.quat(0.7, 0.3, 0.5, 0.8))
+        self.qmap = _make_detector(512).generate_qmap(WAVELENGTH)
+        self.dx = 0.9 * numpy.pi / abs(self.qmap).max()
+
+    def time_F_projection(self, N):
+        condor.utils.projection.F_projection(self.m, self.dx, self.qmap, rotation=self.rot, curvature_order=4)
+
+
+class DetectPhotons:
+    """
+    Photon detection (Poisson noise, saturation and mask) on an n x n detector
+    """
+    params = ([256, 1024], ["none", "poisson"])
+    param_names = ["n", "noise"]
+
+    def setup(self, n, noise):
+        self.det = _make_detector(n, noise=(None if noise == "none" else noise), saturation_level=1E6)
+        self.I = 100. * numpy.random.rand(n, n)
+
+    def time_detect_photons(self, n, noise):
+        self.det.detect_photons(self.I)
+
+
+class SphereFit:
+    """
+    Sphere fit of a batch of 100 frames recorded on an n x n detector
+    """
+    params = [128, 256]
+    param_names = ["n"]
+
+    def setup(self, n):
+        det = _make_detector(n, hole_diameter_in_pixel=6)
+        q = numpy.sqrt((det.generate_qmap(WAVELENGTH)**2).sum(axis=-1))
+        I = condor.utils.sphere_diffraction.I_sphere_diffraction(1E6, q, 50E-9)
+        self.frames = numpy.random.poisson(numpy.array([I]*100)).astype(numpy.float64)
+        self.fitter = condor.utils.sphere_fit.SphereFitter(det, WAVELENGTH, 20E-9, 300E-9)
+
+    def time_fit_batch(self, n):
+        self.fitter.fit_batch(self.frames)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+End-to-end scenario benchmarks
+
+Every scenario sets up a canonical experiment and measures the wall time of ``Experiment.propagate`` (best of several repetitions after one warm-up shot) and the peak memory allocation of one shot. The results are compared against the baseline stored in ``benchmarks/baseline.json``; the run fails if a scenario is slower or needs more memory than the baseline by more than the configured threshold, or if the baseline has no entry for a scenario that was named explicitly (unless ``--allow-missing`` is given).
+
+Run all scenarios with an entry in the baseline and compare against the baseline::
+
+  python -m benchmarks.scenarios
+
+Run selected scenarios with a custom threshold (here: fail if more than 50% slower)::
+
+  python -m benchmarks.scenarios sphere_1k spheroid_random --threshold 1.5
+
+Update the baseline after an intended change of performance (or on a new reference machine; without scenario names all scenarios are recorded)::
+
+  python -m benchmarks.scenarios --update-baseline
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import argparse, json, os, sys
+import numpy
+
+import logging
+logging.getLogger('condor').setLevel("WARNING")
+
+import condor
+import condor.utils.metrics
+import condor.utils.backend
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+BASELINE_LOCATION = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+# Default regression threshold (ratio of measured value and baseline value)
+THRESHOLD_TIME = 1.25
+THRESHOLD_MEMORY = 1.25
+
+
+def _make_source():
+    return condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+
+def _make_detector(n, **kwargs):
+    return condor.Detector(distance=0.74, pixel_size=75E-6*1024/n, nx=n, ny=n, **kwargs)
+
+def sphere_1k():
+    """Sphere (100 nm) on a 1024 x 1024 detector"""
+    par = condor.ParticleSphere(diameter=100E-9, material_type="water")
+    return condor.Experiment(_make_source(), {"particle_sphere" : par}, _make_detector(1024))
+
+def spheroid_random():
+    """Spheroid (100 nm, flattening 0.6) with random orientation on a 512 x 512 detector"""
+    par = condor.ParticleSpheroid(diameter=100E-9, flattening=0.6, material_type="water", rotation_formalism="random")
+    return condor.Experiment(_make_source(), {"particle_spheroid" : par}, _make_detector(512))
+
+def icosahedron_map():
+    """Icosahedron map (100 nm) with random orientation on a 256 x 256 detector"""
+    par = condor.ParticleMap(geometry="icosahedron", diameter=100E-9, material_type="poliovirus", rotation_formalism="random")
+    return condor.Experiment(_make_source(), {"particle_map" : par}, _make_detector(256))
+
+def custom_map_multi_material():
+    """Custom two-material map (protein shell, water core; 64^3) on a 256 x 256 detector"""
+    N = 64
+    Z, Y, X = numpy.indices((N, N, N)) - (N-1)/2.
+    R = numpy.sqrt(X**2 + Y**2 + Z**2)
+    core = numpy.float64(R < N/4.)
+    shell = numpy.float64(R < N/2.5) - core
+    par = condor.ParticleMap(geometry="custom", map3d=numpy.array([shell, core]), dx=1E-9,
+                             material_type=["protein", "water"], rotation_formalism="random")
+    return condor.Experiment(_make_source(), {"particle_map" : par}, _make_detector(256))
+
+def binned_noisy():
+    """Sphere (100 nm) on a 1024 x 1024 detector with Poisson noise, saturation and 4 x 4 binning"""
+    par = condor.ParticleSphere(diameter=100E-9, material_type="water")
+    det = _make_detector(1024, noise="poisson", saturation_level=1E5, binning=4)
+    return condor.Experiment(_make_source(), {"particle_sphere" : par}, det)
+
+def _propagate3d_icosahedron(E):
+    # The size of the 3D grid follows the detector (256^3)
+    return E.propagate3d()
+
+SCENARIOS = [
+    # (name, setup function, propagation function)
+    ("sphere_1k",                 sphere_1k,                 None),
+    ("spheroid_random",           spheroid_random,           None),
+    ("icosahedron_map",           icosahedron_map,           None),
+    ("custom_map_multi_material", custom_map_multi_material, None),
+    ("propagate3d",               icosahedron_map,           _propagate3d_icosahedron),
+    ("binned_noisy",              binned_noisy,              None),
+]
+
+
+def run_scenario(name, repeat=5):
+    """
+    Run a scenario and return the measurements in form of a dictionary with the keys ``'time'`` (best wall time of one shot in unit seconds) and ``'peakmem'`` (peak allocation of one shot in unit bytes)
+
+    Args:
+      :name (str): Name of the scenario
+
+    Kwargs:
+      :repeat (int): Number of timed shots (default ``5``)
+    """
+    scenarios = dict([(n, (s, p)) for n, s, p in SCENARIOS])
+    if name not in scenarios:
+        raise ValueError("Unknown scenario %s. Valid names are: %s" % (name, ", ".join(scenarios.keys())))
+    setup, propagate = scenarios[name]
+    if propagate is None:
+        propagate = lambda E: E.propagate()
+    numpy.random.seed(0)
+    E = setup()
+    # Warm-up shot (fills caches)
+    propagate(E)
+    t = []
+    for i in range(repeat):
+        t0 = condor.utils.metrics._clock()
+        propagate(E)
+        t.append(condor.utils.metrics._clock() - t0)
+    # Peak memory of one shot (separately because tracing slows down the computation)
+    E.reset_metrics()
+    E.enable_memory_tracking()
+    propagate(E)
+    E.disable_memory_tracking()
+    m = E.metrics.get_memory("propagate")
+    return {
+        "time"    : min(t),
+        "peakmem" : m.max if m is not None else None,
+    }
+
+def compare(results, baseline, threshold_time=THRESHOLD_TIME, threshold_memory=THRESHOLD_MEMORY):
+    """
+    Compare measurements with baseline and return the list of regressions (tuples of scenario name, quantity, measured value and baseline value)
+
+    Scenarios and quantities that are not included in the baseline are reported with the baseline value ``None``.
+
+    Args:
+      :results (dict): Measurements as returned by :func:`run_scenario` for every scenario name
+
+      :baseline (dict): Baseline measurements in the same format
+
+    Kwargs:
+      :threshold_time (float): Maximum tolerated ratio of measured and baseline wall time (default ``THRESHOLD_TIME``)
+
+      :threshold_memory (float): Maximum tolerated ratio of measured and baseline peak memory (default ``THRESHOLD_MEMORY``)
+    """
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name, {})
+        for key, threshold in [("time", threshold_time), ("peakmem", threshold_memory)]:
+            if r.get(key) is None:
+                continue
+            if b.get(key) is None or r[key] > threshold * b[key]:
+                regressions.append((name, key, r[key], b.get(key)))
+    return regressions
+
+def read_baseline(filename=BASELINE_LOCATION):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as f:
+        return json.load(f)["scenarios"]
+
+def write_baseline(results, filename=BASELINE_LOCATION):
+    workers = condor.utils.metrics.get_workers()
+    D = {
+        "machine"   : {"platform" : workers["platform"], "cpu_count" : workers["cpu_count"], "omp_num_threads" : workers["omp_num_threads"], "backend" : condor.utils.backend.get_backend()},
+        "versions"  : condor.utils.metrics.get_backend_versions(),
+        "scenarios" : results,
+    }
+    with open(filename, "w") as f:
+        json.dump(D, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Condor - end-to-end scenario benchmarks')
+    parser.add_argument('scenarios', metavar='scenario', type=str, nargs='*', help="names of the scenarios to run (default: all scenarios with baseline, all scenarios with --update-baseline)")
+    parser.add_argument('-r', '--repeat', type=int, help="number of timed shots per scenario", default=5)
+    parser.add_argument('-t', '--threshold', type=float, help="maximum tolerated ratio of measured and baseline wall time", default=THRESHOLD_TIME)
+    parser.add_argument('-m', '--threshold-memory', type=float, help="maximum tolerated ratio of measured and baseline peak memory", default=THRESHOLD_MEMORY)
+    parser.add_argument('-b', '--baseline', type=str, help="location of the baseline file", default=BASELINE_LOCATION)
+    parser.add_argument('-u', '--update-baseline', action='store_true', help="write measurements to the baseline file instead of comparing", default=False)
+    parser.add_argument('-a', '--allow-missing', action='store_true', help="do not fail for scenarios without baseline", default=False)
+    parser.add_argument('-o', '--output', type=str, help="write measurements in JSON format to the given file", default=None)
+    args = parser.parse_args()
+
+    baseline = read_baseline(args.baseline)
+    if len(args.scenarios) > 0:
+        names = args.scenarios
+    elif args.update_baseline:
+        names = [n for n, s, p in SCENARIOS]
+    else:
+        # Scenarios are part of the default run once their baseline has been recorded
+        names = [n for n, s, p in SCENARIOS if n in baseline]
+        skipped = [n for n, s, p in SCENARIOS if n not in baseline]
+        if len(skipped) > 0:
+            print("Skipping scenarios without baseline: %s" % ", ".join(skipped))
+
+    results = {}
+    print("%-28s %10s %10s %12s %12s" % ("scenario", "time [s]", "baseline", "peak [MB]", "baseline"))
+    for name in names:
+        r = run_scenario(name, repeat=args.repeat)
+        results[name] = r
+        b = baseline.get(name, {})
+        fmt = lambda v, s: ("%10.4f" if s == 1. else "%12.1f") % (v / s) if v is not None else ("%10s" if s == 1. else "%12s") % "-"
+        print("%-28s %s %s %s %s" % (name, fmt(r["time"], 1.), fmt(b.get("time"), 1.), fmt(r["peakmem"], 1E6), fmt(b.get("peakmem"), 1E6)))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline.update(results)
+        write_baseline(baseline, args.baseline)
+        print("Baseline written to %s" % args.baseline)
+        return 0
+
+    regressions = compare(results, baseline, threshold_time=args.threshold, threshold_memory=args.threshold_memory)
+    failed = False
+    for name, key, value, value_baseline in regressions:
+        if value_baseline is None:
+            print("%s: %s %s %g has no baseline" % ("WARNING" if args.allow_missing else "MISSING BASELINE", name, key, value))
+            failed = failed or not args.allow_missing
+        else:
+            print("REGRESSION: %s %s %g exceeds baseline %g by factor %.2f" % (name, key, value, value_baseline, value / value_baseline))
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
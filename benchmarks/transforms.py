@@ -0,0 +1,24 @@
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import condor.utils.nfft
+
+
+class Nfft:
+    """
+    Non-uniform FFT of an N^3 complex map evaluated at M random points
+    """
+    params = ([32, 64, 128], [10000, 100000, 1000000])
+    param_names = ["N", "M"]
+    timeout = 300
+
+    def setup(self, N, M):
+        numpy.random.seed(0)
+        self.map3d = (numpy.random.rand(N, N, N) + 1.j*numpy.random.rand(N, N, N)).astype(numpy.complex128)
+        self.coords = numpy.random.rand(M, 3) - 0.5
+
+    def time_nfft(self, N, M):
+        condor.utils.nfft.nfft(self.map3d, self.coords)
+
+    def peakmem_nfft(self, N, M):
+        condor.utils.nfft.nfft(self.map3d, self.coords)
@@ -32,7 +32,7 @@
 
 from .experiment import Experiment
 from .source import Source
-from .particle import ParticleSphere, ParticleSpheroid, ParticleMap, ParticleAtoms
+from .particle import ParticleSphere, ParticleSpheroid, ParticleMap, ParticlePolyhedron, ParticleAtoms
 from .detector import Detector
 #import tests.test_all
 
@@ -40,14 +40,19 @@ import numpy, os, sys, copy
 import logging
 logger = logging.getLogger(__name__)
 
-from condor.utils.log import log,log_execution_time
+from condor.utils.log import log
 from condor.utils.log import log_and_raise_error,log_warning,log_info,log_debug
 import condor.utils.config
 from condor.utils.pixelmask import PixelMask
 import condor.utils.sphere_diffraction
 import condor.utils.spheroid_diffraction
+import condor.utils.polyhedron_diffraction
 import condor.utils.scattering_vector
 import condor.utils.resample
+import condor.utils.metrics
+import condor.utils.backend
+import condor.utils.cache
+import condor.utils.projection
 from condor.utils.rotation import Rotation
 import condor.particle
 import condor.utils.nfft
@@ -92,6 +97,8 @@ def experiment_from_configdict(configdict):
             particles[k] = condor.ParticleSpheroid(**configdict[k])
         elif k.startswith("particle_map"):
             particles[k] = condor.ParticleMap(**configdict[k])
+        elif k.startswith("particle_polyhedron"):
+            particles[k] = condor.ParticlePolyhedron(**configdict[k])
         elif k.startswith("particle_atoms"):
             particles[k] = condor.ParticleAtoms(**configdict[k])
         else:
@@ -101,6 +108,13 @@ def experiment_from_configdict(configdict):
     experiment = Experiment(source, particles, detector)
     return experiment
 
+def _count_cache_delta(metrics, stats_before, stats_after, prefix):
+    # Increment the counters <prefix>_hit, <prefix>_miss and <prefix>_eviction by the changes of the cache statistics
+    for name, suffix in [("hits", "hit"), ("misses", "miss"), ("evictions", "eviction")]:
+        n = stats_after.get(name, 0) - stats_before.get(name, 0)
+        if n > 0:
+            metrics.increment("%s_%s" % (prefix, suffix), n)
+
 
 
 class Experiment:
@@ -114,8 +128,11 @@ class Experiment:
       :particles: Dictionary of particle instances
 
       :detector: Detector instance
+
+    Kwargs:
+      :analytic_tolerance (float): If not ``None`` the analytical form factors of spheres and spheroids may be evaluated approximately by interpolation with the given maximum absolute error of the normalised form factor (:math:`f(0) = 1`), see :class:`condor.utils.sphere_diffraction.SphereFormFactorTable` (default ``None``)
     """
-    def __init__(self, source, particles, detector):
+    def __init__(self, source, particles, detector, analytic_tolerance=None):
         self.source    = source
         for n,p in particles.items():
             if n.startswith("particle_sphere"):
@@ -127,14 +144,20 @@ class Experiment:
             elif n.startswith("particle_map"):
                 if not isinstance(p, condor.particle.ParticleMap):
                     log_and_raise_error(logger, "Particle %s is not a condor.particle.ParticleMap instance." % n)
+            elif n.startswith("particle_polyhedron"):
+                if not isinstance(p, condor.particle.ParticlePolyhedron):
+                    log_and_raise_error(logger, "Particle %s is not a condor.particle.ParticlePolyhedron instance." % n)
             elif n.startswith("particle_atoms"):
                 if not isinstance(p, condor.particle.ParticleAtoms):
                     log_and_raise_error(logger, "Particle %s is not a condor.particle.ParticleAtoms instance." % n)
             else:
-                log_and_raise_error(logger, "The particle model name %s is invalid. The name has to start with either particle_sphere, particle_spheroid, particle_map or particle_atoms.")
+                log_and_raise_error(logger, "The particle model name %s is invalid. The name has to start with either particle_sphere, particle_spheroid, particle_map, particle_polyhedron or particle_atoms." % n)
         self.particles = particles
         self.detector  = detector
         self._qmap_cache = {}
+        self._qmap_radial_cache = {}
+        self.analytic_tolerance = analytic_tolerance
+        self.metrics   = condor.utils.metrics.Metrics()
 
     def get_conf(self):
         """
@@ -168,13 +191,185 @@ class Experiment:
                 log_debug(logger, "%i particles" % N)
         return D_particles
 
-    @log_execution_time(logger)
+    def get_metrics(self):
+        """
+        Return the timing measurements of the simulation stages and the counters (e.g. cache hits) in form of a dictionary
+
+        The timed stages are ``'propagate'`` (total), ``'ensemble'`` (see :meth:`propagate_ensemble`), ``'qmap'`` (generation of scattering vectors), ``'qmap_scale'`` (scaling and validity check of the scattering vectors of maps), ``'map'`` (map generation), ``'nfft'``, ``'fourier_volume'`` and ``'interpolation'`` (only for maps with ``propagation='fourier_volume'``), ``'projection'`` (only for maps with ``propagation='projection'``), ``'phase'``, ``'noise'``, ``'binning'`` and ``'write'`` (only if the :class:`condor.utils.cxiwriter.CXIWriter` instance was initialised with ``metrics=E.metrics``). For more details see :class:`condor.utils.metrics.Metrics`.
+
+        If memory tracking is switched on (see :meth:`enable_memory_tracking`) the entry ``'memory'`` holds the peak allocation in unit bytes per stage invocation (for the stage ``'propagate'`` per shot).
+        """
+        return self.metrics.get()
+
+    def get_run_report(self, wall_time=None, processes=None):
+        """
+        Return a machine-readable summary of all simulations since the last call of :meth:`reset_metrics` in form of a dictionary that can be written to a JSON file
+
+        The report contains the number of shots, the throughput in shots per second, timing percentiles per stage, the number of bytes written (if a :class:`condor.utils.cxiwriter.CXIWriter` instance was initialised with ``metrics=E.metrics``), cache hit rates, worker information and the versions of the used libraries. For more details see :meth:`condor.utils.metrics.Metrics.get_report`.
+
+        Kwargs:
+          :wall_time (float): Total wall-clock time of the run in unit seconds. If ``None`` the throughput is calculated from the accumulated propagation time (default ``None``)
+
+          :processes (int): Number of processes that contribute to the run (default ``None``, then only detected under MPI)
+        """
+        return self.metrics.get_report(wall_time=wall_time, processes=processes)
+
+    def enable_memory_tracking(self):
+        """
+        Record the peak memory allocation of every simulation stage (slows down the simulation, see :meth:`condor.utils.metrics.Metrics.enable_memory_tracking`)
+        """
+        self.metrics.enable_memory_tracking()
+
+    def disable_memory_tracking(self):
+        """
+        Stop recording the peak memory allocation of the simulation stages
+        """
+        self.metrics.disable_memory_tracking()
+
+    def reset_metrics(self):
+        """
+        Discard all recorded timing measurements and counters
+        """
+        self.metrics.reset()
+        
     def propagate(self, save_map3d=False, save_qmap=False):
-        return self._propagate(save_map3d=save_map3d, save_qmap=save_qmap, ndim=2)
+        with self.metrics.stage("propagate"):
+            return self._propagate(save_map3d=save_map3d, save_qmap=save_qmap, ndim=2)
 
     def propagate3d(self, qn=None, qmax=None):
-        return self._propagate(ndim=3, qn=qn, qmax=qmax)
+        with self.metrics.stage("propagate"):
+            return self._propagate(ndim=3, qn=qn, qmax=qmax)
     
+    def propagate_ensemble(self, order=None, orientation_order=None):
+        """
+        Return the expectation value of the diffraction pattern averaged over the statistical distributions of the particle parameters
+
+        Instead of averaging the patterns of many randomly drawn shots the intensity is integrated deterministically by Gauss quadrature over the analytical form factor. For every particle model the average is taken over the distribution of diameters (``diameter_variation``), for spheroids also over the distribution of flattenings (``flattening_variation``) and, if the rotation formalism is random, over the orientations (see :meth:`condor.particle.particle_spheroid.ParticleSpheroid.get_orientation_quadrature`). The intensities of the particle models are added incoherently and weighted by the expected number of particles. The illumination is evaluated at the mean particle position.
+
+        The output has the same structure as the output of :meth:`propagate`. The entry ``'data'`` holds the expected number of photons without noise and ``'data_fourier'`` is not included. For every particle model the quadrature nodes and weights are listed under ``'particles'``.
+
+        .. note:: Only :class:`condor.particle.particle_sphere.ParticleSphere` and :class:`condor.particle.particle_spheroid.ParticleSpheroid` instances are supported.
+
+        Kwargs:
+          :order (int): Number of quadrature nodes for the distributions of diameter and flattening. If ``None`` the number is chosen such that the fringes up to the largest scattering vector on the detector are resolved (see :meth:`condor.utils.variation.Variation.get_quadrature_order`) (default ``None``)
+
+          :orientation_order (int): Number of quadrature nodes per angle for the distribution of orientations. If ``None`` the number is chosen such that the fringes up to the largest scattering vector on the detector are resolved (default ``None``)
+        """
+        with self.metrics.stage("ensemble"):
+            return self._propagate_ensemble(order=order, orientation_order=orientation_order)
+
+    def _propagate_ensemble(self, order, orientation_order):
+        D_source    = self.source.get_next()
+        D_detector  = self.detector.get_next()
+        
+        nx                  = D_detector["nx"]
+        ny                  = D_detector["ny"]
+        cx                  = D_detector["cx"]
+        cy                  = D_detector["cy"]
+        pixel_size          = D_detector["pixel_size"]
+        detector_distance   = D_detector["distance"]
+        wavelength          = D_source["wavelength"]
+
+        if self.detector.solid_angle_correction:
+            Omega_p = self.detector.get_all_pixel_solid_angles(cx, cy)
+        else:
+            Omega_p = pixel_size**2 / detector_distance**2
+        table = None if self.analytic_tolerance is None else condor.utils.sphere_diffraction.get_sphere_form_factor_table(self.analytic_tolerance)
+
+        C = self.get_qmap_radial(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength)
+        q_max = C["q"].max()
+        
+        I_tot = numpy.zeros(shape=(ny, nx), dtype=numpy.float64)
+        D_particles = {}
+        for particle_key, p in self.particles.items():
+            if not (isinstance(p, condor.particle.ParticleSphere) or isinstance(p, condor.particle.ParticleSpheroid)):
+                log_and_raise_error(logger, "Ensemble averaging is not supported for particle %s. Only ParticleSphere and ParticleSpheroid instances are supported." % particle_key)
+                return
+            I_0 = self.source.get_intensity(p.position_mean, "ph/m2", pulse_energy=D_source["pulse_energy"])
+            F0 = numpy.sqrt(I_0)*2*numpy.pi/wavelength**2
+            dn = p.get_dn(wavelength)
+            # The squared form factor oscillates with angular frequency q with respect to the diameter
+            d, w = p.get_diameter_quadrature(order if order is not None else p._diameter_variation.get_quadrature_order(q_max))
+            D_particles[particle_key] = {"diameter" : d, "diameter_weights" : w, "intensity" : I_0, "F0" : F0}
+            V = 4/3.*numpy.pi*(d/2.)**3
+            K = (F0*V*abs(dn))**2
+            if isinstance(p, condor.particle.ParticleSphere):
+                if C["inverse"] is not None:
+                    q = C["q_unique"]
+                else:
+                    q = C["q"]
+                I = 0.
+                for i0, I_chunk in condor.utils.sphere_diffraction.iter_I_sphere_diffraction_stack(K, q, d/2., table=table):
+                    I = I + numpy.tensordot(w[i0:i0+len(I_chunk)], I_chunk, axes=1)
+                if C["inverse"] is not None:
+                    I = I[C["inverse"]].reshape(C["q"].shape)
+            else:
+                qmap = self.get_qmap(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength, extrinsic_rotation=None, order="xyz")
+                qx = qmap[:,:,0]
+                qy = qmap[:,:,1]
+                f0 = p.flattening_mean
+                d_max = d.max()
+                if order is None:
+                    # Maximum rate of change of the semi-diameters with respect to the flattening
+                    dH_df = d_max/2. * max(f0**(-2/3.)/3., 2*f0**(-5/3.)/3.)
+                    f, w_f = p.get_flattening_quadrature(p._flattening_variation.get_quadrature_order(2*q_max*dH_df))
+                else:
+                    f, w_f = p.get_flattening_quadrature(order)
+                if orientation_order is None:
+                    # Range of the semi-diameter along the scattering vector when the spheroid axis is tilted
+                    H_range = abs(condor.utils.spheroid_diffraction.to_spheroid_semi_diameter_c(d_max, f0) - condor.utils.spheroid_diffraction.to_spheroid_semi_diameter_a(d_max, f0))
+                    orientation_order_p = int(numpy.ceil(q_max*H_range + 8))
+                else:
+                    orientation_order_p = orientation_order
+                orientations = p.get_orientation_quadrature(orientation_order_p)
+                radial = False
+                if orientations is not None and p._rotations.get_formalism() in ["random", "random_z"] and C["inverse"] is not None:
+                    # The average over rotations around the beam axis is radially symmetric
+                    radial = True
+                    qx = qx.ravel()[C["index"]]
+                    qy = qy.ravel()[C["index"]]
+                if orientations is None:
+                    # Fixed orientation of the next shot
+                    extrinsic_rotation = p._get_next_extrinsic_rotation()
+                    v1 = extrinsic_rotation.rotate_vector(numpy.array([0.,1.,0.]))
+                    orientations = (numpy.array([numpy.arcsin(v1[2])]), numpy.array([numpy.arctan2(-v1[0],v1[1])]), numpy.ones(1))
+                theta, phi, w_o = orientations
+                D_particles[particle_key].update({"flattening" : f, "flattening_weights" : w_f, "theta" : theta, "phi" : phi, "orientation_weights" : w_o})
+                # Parameter grid (diameter x flattening x orientation)
+                i_d, i_f, i_o = [i.ravel() for i in numpy.indices((len(d), len(f), len(theta)))]
+                a = condor.utils.spheroid_diffraction.to_spheroid_semi_diameter_a(d[i_d], f[i_f])
+                c = condor.utils.spheroid_diffraction.to_spheroid_semi_diameter_c(d[i_d], f[i_f])
+                w = w[i_d] * w_f[i_f] * w_o[i_o]
+                I = 0.
+                for i0, I_chunk in condor.utils.spheroid_diffraction.iter_I_spheroid_diffraction_stack(K[i_d], qx, qy, a, c, theta[i_o], phi[i_o], table=table):
+                    I = I + numpy.tensordot(w[i0:i0+len(I_chunk)], I_chunk, axes=1)
+                if radial:
+                    I = I[C["inverse"]].reshape(C["q"].shape)
+            I_tot += p.number * I * Omega_p
+            
+        # Polarization correction
+        I_tot *= self.detector.calculate_polarization_factors(cx=cx, cy=cy, polarization=self.source.polarization)
+        if self.detector.saturation_level is not None:
+            I_tot = numpy.clip(I_tot, -numpy.inf, self.detector.saturation_level)
+        M_tot = self.detector.get_mask(I_tot)
+
+        O = {}
+        O["source"]            = D_source
+        O["particles"]         = D_particles
+        O["detector"]          = D_detector
+        O["entry_1"] = {}
+        data_1 = {}
+        data_1["data"]         = I_tot
+        data_1["mask"]         = M_tot
+        data_1["full_period_resolution"] = 2 * self.detector.get_max_resolution(wavelength)
+        O["entry_1"]["data_1"] = data_1
+        if self.detector.binning is not None:
+            data_2 = {}
+            data_2["data"], data_2["mask"] = self.detector.bin_photons(I_tot, M_tot)
+            O["entry_1"]["data_2"] = data_2
+        O = remove_from_dict(O, "_")
+        return O
+            
     def _propagate(self, save_map3d=False, save_qmap=False, ndim=2, qn=None, qmax=None):
 
         if ndim not in [2,3]:
@@ -196,19 +391,30 @@ class Experiment:
         detector_distance   = D_detector["distance"]
         wavelength          = D_source["wavelength"]
 
-        # Qmap without rotation
-        if ndim == 2:
-            qmap0 = self.detector.generate_qmap(wavelength, cx=cx, cy=cy, extrinsic_rotation=None)
-        else:
+        metrics = self.metrics
+        
+        if ndim == 3:
             qmax = numpy.sqrt((self.detector.get_q_max(wavelength, pos="edge")**2).sum())
             qn = max([nx, ny])
-            qmap0 = self.detector.generate_qmap_3d(wavelength, qn=qn, qmax=qmax, extrinsic_rotation=None, order='xyz')
             if self.detector.solid_angle_correction:
                 log_and_raise_error(logger, "Carrying out solid angle correction for a simulation of a 3D Fourier volume does not make sense. Please set solid_angle_correction=False for your Detector and try again.")
                 return
+
+        # Qmap without rotation (generated on first use, patterns of spheres in 2D do not need it)
+        qmap0_list = []
+        def get_qmap0():
+            if len(qmap0_list) == 0:
+                with metrics.stage("qmap"):
+                    if ndim == 2:
+                        qmap0_list.append(self.detector.generate_qmap(wavelength, cx=cx, cy=cy, extrinsic_rotation=None))
+                    else:
+                        qmap0_list.append(self.detector.generate_qmap_3d(wavelength, qn=qn, qmax=qmax, extrinsic_rotation=None, order='xyz'))
+            return qmap0_list[0]
             
         qmap_singles = {}
         F_tot        = 0.
+        # Lookup table for approximate evaluation of analytical form factors
+        table = None if self.analytic_tolerance is None else condor.utils.sphere_diffraction.get_sphere_form_factor_table(self.analytic_tolerance)
         # Calculate patterns of all single particles individually
         for particle_key, D_particle in D_particles.items():
             p  = D_particle["_class_instance"]
@@ -223,7 +429,7 @@ class Experiment:
             # 3D Orientation
             extrinsic_rotation = Rotation(values=D_particle["extrinsic_quaternion"], formalism="quaternion")
 
-            if isinstance(p, condor.particle.ParticleSphere) or isinstance(p, condor.particle.ParticleSpheroid) or isinstance(p, condor.particle.ParticleMap):
+            if isinstance(p, condor.particle.ParticleSphere) or isinstance(p, condor.particle.ParticleSpheroid) or isinstance(p, condor.particle.ParticleMap) or isinstance(p, condor.particle.ParticlePolyhedron):
                 # Solid angles
                 if self.detector.solid_angle_correction:
                     Omega_p = self.detector.get_all_pixel_solid_angles(cx, cy)
@@ -234,31 +440,28 @@ class Experiment:
             if isinstance(p, condor.particle.ParticleSphere):
                 # Refractive index
                 dn = p.get_dn(wavelength)
-                # Scattering vectors
-                if ndim == 2:
-                    qmap = self.get_qmap(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength, extrinsic_rotation=None)
-                else:
-                    qmap = qmap0
-                q = numpy.sqrt((qmap**2).sum(axis=ndim))
                 # Intensity scaling factor
                 R = D_particle["diameter"]/2.
                 V = 4/3.*numpy.pi*R**3
                 K = (F0*V*dn)**2
                 # Pattern
-                F = condor.utils.sphere_diffraction.F_sphere_diffraction(K, q, R) * numpy.sqrt(Omega_p)
+                if ndim == 2:
+                    # The pattern depends only on |q|
+                    C = self.get_qmap_radial(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength)
+                    if C["inverse"] is not None:
+                        # Evaluate only once for every distinct value of |q| and gather
+                        F = condor.utils.sphere_diffraction.F_sphere_diffraction(K, C["q_unique"], R)[C["inverse"]].reshape(C["q"].shape)
+                    else:
+                        F = condor.utils.sphere_diffraction.F_sphere_diffraction(K, C["q"], R, table=table)
+                else:
+                    q = numpy.sqrt((get_qmap0()**2).sum(axis=ndim))
+                    F = condor.utils.sphere_diffraction.F_sphere_diffraction(K, q, R, table=table)
+                F = F * numpy.sqrt(Omega_p)
 
             # UNIFORM SPHEROID
             elif isinstance(p, condor.particle.ParticleSpheroid):
-                if ndim == 3:
-                    log_and_raise_error(logger, "Spheroid simulation with ndim = 3 is not supported.")
-                    return
-                
                 # Refractive index
                 dn = p.get_dn(wavelength)
-                # Scattering vectors
-                qmap = self.get_qmap(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength, extrinsic_rotation=None, order="xyz")
-                qx = qmap[:,:,0]
-                qy = qmap[:,:,1]
                 # Intensity scaling factor
                 R = D_particle["diameter"]/2.
                 V = 4/3.*numpy.pi*R**3
@@ -270,9 +473,39 @@ class Experiment:
                 # Spheroid axis before rotation
                 v0 = numpy.array([0.,1.,0.])
                 v1 = extrinsic_rotation.rotate_vector(v0)
-                theta = numpy.arcsin(v1[2])
-                phi   = numpy.arctan2(-v1[0],v1[1])
-                F = condor.utils.spheroid_diffraction.F_spheroid_diffraction(K, qx, qy, a, c, theta, phi) * numpy.sqrt(Omega_p)
+                if ndim == 2:
+                    # Scattering vectors
+                    qmap = self.get_qmap(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength, extrinsic_rotation=None, order="xyz")
+                    qx = qmap[:,:,0]
+                    qy = qmap[:,:,1]
+                    theta = numpy.arcsin(v1[2])
+                    phi   = numpy.arctan2(-v1[0],v1[1])
+                    F = condor.utils.spheroid_diffraction.F_spheroid_diffraction(K, qx, qy, a, c, theta, phi, table=table)
+                else:
+                    # Analytical form factor evaluated directly on the grid of the Fourier volume
+                    qmap = get_qmap0()
+                    F = condor.utils.spheroid_diffraction.F_spheroid_diffraction_3d(K, qmap, a, c, v1, table=table)
+                F = F * numpy.sqrt(Omega_p)
+
+            # UNIFORM POLYHEDRON
+            elif isinstance(p, condor.particle.ParticlePolyhedron):
+                # Refractive index
+                dn = p.get_dn(wavelength)
+                # Mesh
+                vertices, faces = p.get_mesh(D_particle["diameter"])
+                V = condor.utils.polyhedron_diffraction.get_mesh_volume(vertices, faces)
+                # Intensity scaling factor
+                K = (F0*V*abs(dn))**2
+                # Rotate the mesh instead of the scattering vectors
+                vertices = extrinsic_rotation.rotate_vectors(vertices)
+                if ndim == 2:
+                    qmap = self.get_qmap(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength, extrinsic_rotation=None, order="xyz")
+                else:
+                    qmap = get_qmap0()
+                # Analytical form factor
+                with metrics.stage("polyhedron"):
+                    F = condor.utils.polyhedron_diffraction.F_polyhedron_diffraction(K, qmap, vertices, faces)
+                F = F * numpy.sqrt(Omega_p)
 
             # MAP
             elif isinstance(p, condor.particle.ParticleMap):
@@ -283,34 +516,66 @@ class Experiment:
                 if ndim == 2:
                     qmap = self.get_qmap(nx=nx, ny=ny, cx=cx, cy=cy, pixel_size=pixel_size, detector_distance=detector_distance, wavelength=wavelength, extrinsic_rotation=extrinsic_rotation, order="zyx")
                 else:
-                    qmap = self.detector.generate_qmap_3d(wavelength=wavelength, qn=qn, qmax=qmax, extrinsic_rotation=extrinsic_rotation, order="zyx")
+                    with metrics.stage("qmap"):
+                        qmap = self.detector.generate_qmap_3d(wavelength=wavelength, qn=qn, qmax=qmax, extrinsic_rotation=extrinsic_rotation, order="zyx")
                 # Generate map
-                map3d_dn, dx = p.get_new_dn_map(D_particle, dx_required, dx_suggested, wavelength)
+                S_map = p.get_map_cache_stats()
+                S_dn = p.get_dn_map_cache_stats()
+                S_disk = condor.utils.cache.get_disk_cache().get_stats()
+                with metrics.stage("map"):
+                    if save_map3d:
+                        # Keep the full map for the output
+                        map3d_dn, dx = p.get_new_dn_map(D_particle, dx_required, dx_suggested, wavelength)
+                        map3d_shift = None
+                    else:
+                        # Propagate only the bounding box of the non-zero voxels
+                        map3d_dn, dx, map3d_shift = p.get_new_cropped_dn_map(D_particle, dx_required, dx_suggested, wavelength)
+                _count_cache_delta(metrics, S_map, p.get_map_cache_stats(), "map_cache")
+                _count_cache_delta(metrics, S_dn, p.get_dn_map_cache_stats(), "dn_map_cache")
                 log_debug(logger, "Sampling of map: dx_required = %e m, dx_suggested = %e m, dx = %e m" % (dx_required, dx_suggested, dx))
                 if save_map3d:
                     D_particle["map3d_dn"] = map3d_dn
                     D_particle["dx"] = dx
                 # Rescale and shape qmap for nfft
-                qmap_scaled = dx * qmap / (2. * numpy.pi)
-                qmap_shaped = qmap_scaled.reshape(int(qmap_scaled.size/3), 3)
-                # Check inputs
-                invalid_mask = ~((qmap_shaped>=-0.5) * (qmap_shaped<0.5))
+                with metrics.stage("qmap_scale"):
+                    qmap_scaled = dx * qmap / (2. * numpy.pi)
+                    qmap_shaped = qmap_scaled.reshape(int(qmap_scaled.size/3), 3)
+                    # Check inputs
+                    invalid_mask = ~((qmap_shaped>=-0.5) * (qmap_shaped<0.5))
                 if numpy.any(invalid_mask):
                     qmap_shaped[invalid_mask] = 0.
                     log_warning(logger, "%i invalid pixel positions." % invalid_mask.sum())
-                log_debug(logger, "Map3d input shape: (%i,%i,%i), number of dimensions: %i, sum %f" % (map3d_dn.shape[0], map3d_dn.shape[1], map3d_dn.shape[2], len(list(map3d_dn.shape)), abs(map3d_dn).sum()))
+                if logger.isEnabledFor(logging.DEBUG):
+                    log_debug(logger, "Map3d input shape: (%i,%i,%i), number of dimensions: %i, sum %f" % (map3d_dn.shape[0], map3d_dn.shape[1], map3d_dn.shape[2], len(list(map3d_dn.shape)), abs(map3d_dn).sum()))
                 if (numpy.isfinite(abs(map3d_dn))==False).sum() > 0:
                     log_warning(logger, "There are infinite values in the dn map of the object.")
                 log_debug(logger, "Scattering vectors shape: (%i,%i); Number of dimensions: %i" % (qmap_shaped.shape[0], qmap_shaped.shape[1], len(list(qmap_shaped.shape))))
                 if (numpy.isfinite(qmap_shaped)==False).sum() > 0:
                     log_warning(logger, "There are infinite values in the scattering vectors.")
-                # NFFT
-                fourier_pattern = log_execution_time(logger)(condor.utils.nfft.nfft)(map3d_dn, qmap_shaped)
+                if p.propagation == "fourier_volume":
+                    S_v = p.get_fourier_volume_cache_stats()
+                    with metrics.stage("fourier_volume"):
+                        V = p.get_fourier_volume(map3d_dn)
+                    _count_cache_delta(metrics, S_v, p.get_fourier_volume_cache_stats(), "fourier_volume_cache")
+                    with metrics.stage("interpolation"):
+                        fourier_pattern = V.interpolate(qmap_shaped)
+                elif p.propagation == "projection" and ndim == 2:
+                    with metrics.stage("projection"):
+                        fourier_pattern = condor.utils.projection.F_projection(map3d_dn, dx, get_qmap0(), rotation=extrinsic_rotation, curvature_order=p.curvature_order).ravel()
+                else:
+                    # NFFT
+                    with metrics.stage("nfft"):
+                        fourier_pattern = condor.utils.nfft.nfft(map3d_dn, qmap_shaped)
+                _count_cache_delta(metrics, S_disk, condor.utils.cache.get_disk_cache().get_stats(), "disk_cache")
                 # Check output - masking in case of invalid values
                 if numpy.any(invalid_mask):
                     fourier_pattern[invalid_mask.any(axis=1)] = numpy.nan
                 # reshaping
                 fourier_pattern = numpy.reshape(fourier_pattern, tuple(list(qmap_scaled.shape)[:-1]))
+                # Compensate the shift of the origin of the cropped map
+                if map3d_shift is not None and numpy.any(map3d_shift != 0):
+                    with metrics.stage("phase"):
+                        fourier_pattern = condor.utils.backend.phase_factor(fourier_pattern, qmap, numpy.asarray(map3d_shift, dtype=numpy.float64) * dx)
                 log_debug(logger, "Generated pattern of shape %s." % str(fourier_pattern.shape))
                 F = F0 * fourier_pattern * dx**3 * numpy.sqrt(Omega_p)
 
@@ -375,10 +640,8 @@ class Experiment:
             v = D_particle["position"]
             # Calculate phase factors if needed
             if not numpy.allclose(v, numpy.zeros_like(v), atol=1E-12):
-                if ndim == 2:
-                    F = F * numpy.exp(-1.j*(v[0]*qmap0[:,:,0]+v[1]*qmap0[:,:,1]+v[2]*qmap0[:,:,2]))
-                else:
-                    F = F * numpy.exp(-1.j*(v[0]*qmap0[:,:,:,0]+v[1]*qmap0[:,:,:,1]+v[2]*qmap0[:,:,:,2]))
+                with metrics.stage("phase"):
+                    F = condor.utils.backend.phase_factor(F, get_qmap0(), v)
             # Superimpose patterns
             F_tot = F_tot + F
 
@@ -393,14 +656,16 @@ class Experiment:
         F_tot = numpy.sqrt(P) * F_tot
 
         # Photon detection
-        I_tot, M_tot = self.detector.detect_photons(abs(F_tot)**2)
+        with metrics.stage("noise"):
+            I_tot, M_tot = self.detector.detect_photons(abs(F_tot)**2)
         
         if ndim == 2:
             M_tot_binary = M_tot == 0        
             if self.detector.binning is not None:
-                IXxX_tot, MXxX_tot = self.detector.bin_photons(I_tot, M_tot)
-                FXxX_tot, MXxX_tot = condor.utils.resample.downsample(F_tot, self.detector.binning, mode="integrate", 
-                                                                      mask2d0=M_tot, bad_bits=PixelMask.PIXEL_IS_IN_MASK, min_N_pixels=1)
+                with metrics.stage("binning"):
+                    IXxX_tot, MXxX_tot = self.detector.bin_photons(I_tot, M_tot)
+                    FXxX_tot, MXxX_tot = condor.utils.resample.downsample(F_tot, self.detector.binning, mode="integrate", 
+                                                                          mask2d0=M_tot, bad_bits=PixelMask.PIXEL_IS_IN_MASK, min_N_pixels=1)
                 MXxX_tot_binary = None if MXxX_tot is None else (MXxX_tot == 0)
         else:
             M_tot_binary = None
@@ -436,7 +701,6 @@ class Experiment:
 
     
 
-    @log_execution_time(logger)
     def get_qmap(self, nx, ny, cx, cy, pixel_size, detector_distance, wavelength, extrinsic_rotation=None, order="xyz"):
         calculate = False
         if self._qmap_cache == {}:
@@ -454,8 +718,11 @@ class Experiment:
                 calculate = calculate or not extrinsic_rotation.is_similar(self._qmap_cache["extrinsic_rotation"])
         if calculate:
             log_debug(logger,  "Calculating qmap")
+            self.metrics.increment("qmap_cache_miss")
+            with self.metrics.stage("qmap"):
+                qmap = self.detector.generate_qmap(wavelength, cx=cx, cy=cy, extrinsic_rotation=extrinsic_rotation, order=order)
             self._qmap_cache = {
-                "qmap"              : self.detector.generate_qmap(wavelength, cx=cx, cy=cy, extrinsic_rotation=extrinsic_rotation, order=order),
+                "qmap"              : qmap,
                 "nx"                : nx,
                 "ny"                : ny,
                 "cx"                : cx,
@@ -466,8 +733,45 @@ class Experiment:
                 "extrinsic_rotation": copy.deepcopy(extrinsic_rotation),
                 "order"             : order,
             }            
+        else:
+            self.metrics.increment("qmap_cache_hit")
         return self._qmap_cache["qmap"]
 
+    def get_qmap_radial(self, nx, ny, cx, cy, pixel_size, detector_distance, wavelength):
+        r"""
+        Return dictionary with the map of the lengths of the (unrotated) scattering vectors (``'q'``) and, if the center lies on an integer or half-integer pixel position, the sorted distinct values (``'q_unique'``), the flat indices of one pixel for every distinct value (``'index'``) and the indices that reconstruct the full map from them (``'inverse'``, ``None`` otherwise)
+
+        For an integer or half-integer center the squared doubled pixel distance :math:`(2\Delta x)^2 + (2\Delta y)^2` is an integer. Pixels with equal values have equal :math:`|q|` (mirror and quadrant symmetry of the pixel grid, as well as accidental degeneracies), so a radially symmetric pattern needs to be evaluated only once per distinct value. The result is cached for subsequent calls with the same detector geometry.
+        """
+        key = (nx, ny, cx, cy, pixel_size, detector_distance, wavelength)
+        if self._qmap_radial_cache.get("key") == key:
+            self.metrics.increment("qmap_radial_cache_hit")
+            return self._qmap_radial_cache
+        self.metrics.increment("qmap_radial_cache_miss")
+        with self.metrics.stage("qmap"):
+            qmap = self.detector.generate_qmap(wavelength, cx=cx, cy=cy, extrinsic_rotation=None)
+            q = numpy.sqrt((qmap**2).sum(axis=2))
+            q_unique = None
+            inverse = None
+            index = None
+            # Exact test, a relative tolerance would snap centres of large detectors that are only close to a half-integer position
+            if abs(2*cx - round(2*cx)) < 1E-9 and abs(2*cy - round(2*cy)) < 1E-9:
+                X, Y = self.detector.generate_xypix(cx=cx, cy=cy)
+                X2 = numpy.int64(numpy.round(2*X))
+                Y2 = numpy.int64(numpy.round(2*Y))
+                r2 = (X2**2 + Y2**2).ravel()
+                r2_unique, index, inverse = numpy.unique(r2, return_index=True, return_inverse=True)
+                q_unique = q.ravel()[index]
+                inverse = inverse.ravel()
+        self._qmap_radial_cache = {
+            "key"      : key,
+            "q"        : q,
+            "q_unique" : q_unique,
+            "inverse"  : inverse,
+            "index"    : index,
+        }
+        return self._qmap_radial_cache
+        
     def get_qmap_from_cache(self):
         if self._qmap_cache == {} or not "qmap" in self._qmap_cache:
             log_and_raise_error(logger, "Cache empty!")
@@ -1,4 +1,5 @@
 from .particle_sphere import ParticleSphere
 from .particle_spheroid import ParticleSpheroid
 from .particle_map import ParticleMap
+from .particle_polyhedron import ParticlePolyhedron
 from .particle_atoms import ParticleAtoms
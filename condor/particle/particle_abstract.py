@@ -114,7 +114,7 @@ class AbstractParticle:
         """
         return self._rotations.get_current_rotation()
 
-    def set_alignment(self, rotation_values, rotation_formalism, rotation_mode):
+    def set_alignment(self, rotation_values, rotation_formalism, rotation_mode, point_group=None):
         """
         Set rotation scheme of the partice
 
@@ -123,13 +123,15 @@ class AbstractParticle:
 
           :rotation_mode (str): If the rotation shall be assigned to the particle choose ``\'extrinsic\'``. Choose ``\'intrinsic\'`` if the coordinate system shall be rotated (default ``\'extrinsic\'``)
 
+        Kwargs:
+          :point_group (str): Point group of the particle. If not ``None`` only orientations in the asymmetric unit are used (see :class:`condor.utils.rotation.Rotations`) (default ``None``)
         """
         # Check input
         if rotation_mode not in ["extrinsic","intrinsic"]:
             log_and_raise_error(logger, "%s is not a valid rotation mode for alignment." % rotation_mode)
             sys.exit(1)
         self._rotation_mode = rotation_mode
-        self._rotations = condor.utils.rotation.Rotations(values=rotation_values, formalism=rotation_formalism)
+        self._rotations = condor.utils.rotation.Rotations(values=rotation_values, formalism=rotation_formalism, point_group=point_group, rotation_mode=rotation_mode)
 
     def set_position_variation(self, position_variation, position_spread, position_variation_n):
         r"""
@@ -197,6 +199,18 @@ class AbstractParticle:
         return A
         
 
+def _get_positive_quadrature(variation, v0, order, name):
+    x, w = variation.get_quadrature(v0, order)
+    valid = x > 0.
+    if not valid.all():
+        if not valid.any():
+            log_and_raise_error(logger, "All quadrature nodes of the %s distribution are smaller-equals zero. Change your configuration." % name)
+            return
+        log_warning(logger, "Discarding %i quadrature nodes of the %s distribution that are smaller-equals zero." % ((~valid).sum(), name))
+        x = x[valid]
+        w = w[valid] / w[valid].sum()
+    return x, w
+    
 class AbstractContinuousParticle(AbstractParticle):
     """
     Base class for derived particle classes that make use of the continuum approximation (density instead of discrete atoms)
@@ -319,6 +333,17 @@ class AbstractContinuousParticle(AbstractParticle):
             else:
                 return d
 
+    def get_diameter_quadrature(self, order):
+        """
+        Return nodes and weights of a quadrature rule for averaging over the distribution of particle diameters (see :meth:`condor.utils.variation.Variation.get_quadrature`)
+
+        Nodes with non-positive diameter are discarded and the remaining weights are renormalised (in line with the rejection of non-positive diameters in random sampling).
+
+        Args:
+          :order (int): Number of quadrature nodes
+        """
+        return _get_positive_quadrature(self._diameter_variation, self.diameter_mean, order, "diameter")
+
     def set_material(self, material_type, massdensity, atomic_composition, electron_density):
         """
         Initialise and set the AtomDensityMaterial / ElectronDensityMaterial class instance of the particle
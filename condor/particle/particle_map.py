@@ -32,6 +32,7 @@
 
 from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
 import sys
+import weakref
 import numpy
 #from scipy.interpolate import RegularGridInterpolator
 
@@ -46,12 +47,30 @@ from condor.utils.variation import Variation
 import condor.utils.spheroid_diffraction
 import condor.utils.diffraction
 import condor.utils.bodies
+import condor.utils.cache
+import condor.utils.resample
+import condor.utils.fourier_volume
+import condor.utils.symmetry
 
 import condor.utils.emdio
 
 from .particle_abstract import AbstractContinuousParticle
 
-ENABLE_MAP_INTERPOLATION = False
+# Resample custom maps that are much finer sampled than needed (see ParticleMap.get_new_map)
+ENABLE_MAP_INTERPOLATION = True
+# Resample only if the number of voxels is reduced at least by this factor
+MAP_INTERPOLATION_MIN_REDUCTION = 2.
+# Relative step of the band limits of resampled custom maps (resampled maps can be reused for diameter variations within one step)
+MAP_INTERPOLATION_BAND_STEP = 0.05
+# Crop maps to the bounding box of their non-zero voxels before propagation (see ParticleMap.get_new_cropped_dn_map)
+ENABLE_MAP_CROPPING = True
+
+# Methods for the propagation of the map to the Fourier domain (see ParticleMap)
+PROPAGATIONS = ["nfft", "fourier_volume", "projection"]
+
+# Default limits of the cache of generated maps (see ParticleMap.set_map_cache)
+MAP_CACHE_MAX_ENTRIES = 8
+MAP_CACHE_MAX_BYTES   = 2*1024**3
 
 class ParticleMap(AbstractContinuousParticle):
     r"""
@@ -120,6 +139,24 @@ class ParticleMap(AbstractContinuousParticle):
       :atomic_composition (dict): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_material` (default ``None``)          
 
       :electron_density (float): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_material` (default ``None``)
+
+      :propagation (str): Method for the calculation of the Fourier transform of the map at the scattering vectors of the detector pixels
+
+        *Choose one of the following options:*
+
+          - ``'nfft'`` - evaluate the transform of the map at every shot with the non-equispaced FFT
+
+          - ``'fourier_volume'`` - calculate the transform of the map once on an oversampled grid and interpolate it at every shot (see :meth:`get_fourier_volume`). Recommended for many shots of the same map in different orientations
+
+          - ``'projection'`` - project the rotated map along the beam axis and evaluate the transform with a 2D non-equispaced FFT, optionally with corrections for the curvature of the Ewald sphere (see :mod:`condor.utils.projection`). Recommended for large particles at small scattering angles. Patterns in 3D Fourier space are calculated with the NFFT
+
+        (default ``'nfft'``)
+
+      :oversampling (float): Oversampling factor of the Fourier volume, takes only effect if ``propagation='fourier_volume'``. Larger values reduce the interpolation error at the cost of memory (see :mod:`condor.utils.fourier_volume`) (default ``condor.utils.fourier_volume.OVERSAMPLING``)
+
+      :curvature_order (int): Order of the curvature corrections, takes only effect if ``propagation='projection'``. If ``None`` the lowest order that meets the tolerance ``condor.utils.projection.PROJECTION_TOLERANCE`` for the given detector and particle size is chosen at every shot. A warning is issued if the projection approximation is not valid (see :func:`condor.utils.projection.F_projection`) (default ``None``)
+
+      :point_group (str): Point group of the map (e.g. ``'I'`` for ``geometry='icosahedron'``, see :mod:`condor.utils.symmetry`). If not ``None`` the orientations are restricted to the asymmetric unit (see :meth:`condor.particle.particle_abstract.AbstractParticle.set_alignment`) and only the asymmetric unit of the Fourier volume is calculated if ``propagation='fourier_volume'`` (default ``None``)
     """
     def __init__(self,
                  geometry, diameter = None,
@@ -132,7 +169,9 @@ class ParticleMap(AbstractContinuousParticle):
                  flattening = 0.75,
                  number = 1., arrival = "synchronised",
                  position = None, position_variation = None, position_spread = None, position_variation_n = None,
-                 material_type = None, massdensity = None, atomic_composition = None, electron_density = None):
+                 material_type = None, massdensity = None, atomic_composition = None, electron_density = None,
+                 propagation = "nfft", oversampling = condor.utils.fourier_volume.OVERSAMPLING, curvature_order = None,
+                 point_group = None):
         # Initialise base class
         AbstractContinuousParticle.__init__(self,
                                             diameter=diameter, diameter_variation=diameter_variation, diameter_spread=diameter_spread, diameter_variation_n=diameter_variation_n,
@@ -150,8 +189,24 @@ class ParticleMap(AbstractContinuousParticle):
         # Has effect only for spheroids
         self.flattening = flattening
 
-        # Init chache
-        self._cache = {}
+        if propagation not in PROPAGATIONS:
+            log_and_raise_error(logger, "Propagation %s is invalid. Choose one of the following: %s." % (propagation, ", ".join(PROPAGATIONS)))
+            sys.exit(1)
+        self.propagation = propagation
+        self.oversampling = oversampling
+        self.curvature_order = curvature_order
+
+        # Restrict orientations to the asymmetric unit
+        self.point_group = point_group
+        if point_group is not None:
+            condor.utils.symmetry.get_point_group(point_group)
+            self.set_alignment(rotation_values=rotation_values, rotation_formalism=rotation_formalism, rotation_mode=rotation_mode, point_group=point_group)
+
+        # Init cache of generated maps and of the refractive index maps derived from them
+        self._cache = condor.utils.cache.LRUCache(max_entries=MAP_CACHE_MAX_ENTRIES, max_bytes=MAP_CACHE_MAX_BYTES)
+        self._dn_cache = condor.utils.cache.LRUCache(max_entries=MAP_CACHE_MAX_ENTRIES, max_bytes=MAP_CACHE_MAX_BYTES)
+        self._support_cache = condor.utils.cache.LRUCache(max_entries=MAP_CACHE_MAX_ENTRIES)
+        self._volume_cache = condor.utils.cache.LRUCache(max_entries=MAP_CACHE_MAX_ENTRIES, max_bytes=MAP_CACHE_MAX_BYTES)
         self._dx_orig                = None
         self._map3d_orig             = None
 
@@ -211,6 +266,10 @@ class ParticleMap(AbstractContinuousParticle):
             conf["dx"]    = dx
         if self.geometry == "spheroid":
             conf["flattening"] = self.flattening
+        conf["propagation"] = self.propagation
+        conf["oversampling"] = self.oversampling
+        conf["curvature_order"] = self.curvature_order
+        conf["point_group"] = self.point_group
         return conf
 
     def get_next(self):
@@ -255,9 +314,9 @@ class ParticleMap(AbstractContinuousParticle):
                 return
             # Load map(s)
             if len(s) == 3:
+                # All materials share one physical copy of the map
                 n_mat = len(self.materials)
-                s = numpy.array([n_mat] + list(s))
-                _map3d = numpy.array(n_mat*[map3d], dtype=numpy.float64)
+                _map3d = numpy.broadcast_to(numpy.asarray(map3d, dtype=numpy.float64), tuple([n_mat] + list(s)))
             else:
                 if s[0] != len(self.materials):
                     log_and_raise_error(logger, "The first dimension of the map (%i) does not equal the number of specified materials (%i)." % (s[0], len(self.materials)))
@@ -265,7 +324,11 @@ class ParticleMap(AbstractContinuousParticle):
                 _map3d = numpy.asarray(map3d, dtype=numpy.float64)
         self._map3d_orig = _map3d
         self._dx_orig    = dx
-        self._set_cache(_map3d, dx, geometry="custom")
+        # Discard maps that were resampled from the previous map
+        self._cache.clear()
+        self._dn_cache.clear()
+        self._support_cache.clear()
+        self._volume_cache.clear()
 
     def set_custom_geometry_by_h5file(self, map3d_filename, map3d_dataset, dx):
         """
@@ -367,14 +430,135 @@ class ParticleMap(AbstractContinuousParticle):
           :photon_wavelength (float): Photon wavelength in unit meter 
         """
         m,dx = self.get_new_map(O=O, dx_required=dx_required, dx_suggested=dx_suggested)
+        dn = self._get_dn_map(m, photon_wavelength)
+        return dn,dx
+
+    def _get_map_key(self, m):
+        # Maps returned by get_new_map are new views of cached arrays, hence the map is identified by the array that owns the memory and the layout of the view
+        base = m
+        while isinstance(base.base, numpy.ndarray):
+            base = base.base
+        return base, (id(base), m.__array_interface__["data"][0], m.shape, m.strides)
+
+    def _get_derived(self, cache, base, key):
+        # Cached value derived from the map with the given base array (None if not cached)
+        cached = cache.get(key)
+        # The identity is only valid as long as the cached entry refers to the same object
+        if cached is not None and cached[0]() is base:
+            return cached[1]
+        return None
+
+    def _put_derived(self, cache, base, key, value, nbytes):
+        # Entries hold only a weak reference to the base array, the map is freed once discarded from the map cache and the entry is discarded with it
+        def discard(ref):
+            cached = cache.peek(key)
+            if cached is not None and cached[0] is ref:
+                cache.pop(key)
+        cache.put(key, (weakref.ref(base, discard), value), nbytes=nbytes)
+
+    def _get_dn_map(self, m, photon_wavelength):
         if self.materials is not None:
-            dn = numpy.zeros(shape=(m.shape[1], m.shape[2], m.shape[3]), dtype=numpy.complex128)
-            for mat_i, m_i in zip(self.materials, m):
-                dn_i = mat_i.get_dn(photon_wavelength=photon_wavelength)
-                dn += m_i * dn_i
+            base, key = self._get_map_key(m)
+            key = key + (photon_wavelength, self._get_materials_key())
+            dn = self._get_derived(self._dn_cache, base, key)
+            if dn is not None:
+                log_debug(logger, "No need for calculating a new refractive index map. Reading map from cache.")
+            else:
+                dn_mat = numpy.array([mat_i.get_dn(photon_wavelength=photon_wavelength) for mat_i in self.materials], dtype=numpy.complex128)
+                if m.strides[0] == 0:
+                    # All materials share one physical copy of the map
+                    dn = m[0] * dn_mat.sum()
+                else:
+                    dn = numpy.tensordot(dn_mat, m, axes=1)
+                # The cached map is shared and must not be modified
+                dn.flags.writeable = False
+                self._put_derived(self._dn_cache, base, key, dn, nbytes=dn.nbytes)
         else:
             dn = m[0]    
-        return dn,dx
+        return dn
+
+    def get_new_cropped_dn_map(self, O, dx_required, dx_suggested, photon_wavelength):
+        r"""
+        Return a new refractive index map that is cropped to the bounding box of its non-zero voxels, the grid spacing and the shift of the origin
+
+        The cropped map is cubic. The origin of the Fourier transform (centre voxel with index ``N//2`` along every axis) of the cropped map is shifted with respect to the one of the full map by the returned vector (*z*, *y*, *x*) in unit voxels. The Fourier transform of the full map equals the one of the cropped map multiplied by the phase factors :math:`\exp(-i \vec{q} \cdot \vec{s}\,dx)`. The bounding box is determined only once for every map and cached. Cropping can be switched off by setting ``condor.particle.particle_map.ENABLE_MAP_CROPPING = False``.
+
+        Args:
+
+          :O (dict): Parameter dictionary as returned from :meth:`condor.particle.particle_map.get_next`
+
+          :dx_required (float): Required resolution (grid spacing) of the map. An error is raised if the resolution of the map has too low resolution
+
+          :dx_suggested (float): Suggested resolution (grid spacing) of the map. If the map has a very high resolution it will be interpolated to a the suggested resolution value
+
+          :photon_wavelength (float): Photon wavelength in unit meter 
+        """
+        m,dx = self.get_new_map(O=O, dx_required=dx_required, dx_suggested=dx_suggested)
+        if ENABLE_MAP_CROPPING:
+            m, shift = self._crop_map_to_support(m)
+        else:
+            shift = numpy.zeros(3, dtype=int)
+        dn = self._get_dn_map(m, photon_wavelength)
+        return dn, dx, shift
+
+    def get_fourier_volume(self, dn):
+        """
+        Return the oversampled Fourier volume (:class:`condor.utils.fourier_volume.FourierVolume`) of a refractive index map as returned by :meth:`get_new_dn_map` or :meth:`get_new_cropped_dn_map`
+
+        The Fourier volume is calculated only once for every map and cached. The size of the cache is controlled by :meth:`set_map_cache`. If a disk cache is configured (see :func:`condor.utils.cache.get_disk_cache`) volumes are also shared between processes and runs.
+
+        Args:
+          :dn (array): Refractive index map
+        """
+        base, key = self._get_map_key(dn)
+        key = key + (self.oversampling, self.point_group)
+        V = self._get_derived(self._volume_cache, base, key)
+        if V is not None:
+            log_debug(logger, "No need for calculating a new Fourier volume. Reading volume from cache.")
+            return V
+        V = condor.utils.fourier_volume.FourierVolume(dn, oversampling=self.oversampling, disk_cache=condor.utils.cache.get_disk_cache(), point_group=self.point_group)
+        self._put_derived(self._volume_cache, base, key, V, nbytes=V.get_nbytes())
+        return V
+
+    def _crop_map_to_support(self, m):
+        base, key = self._get_map_key(m)
+        box = self._get_derived(self._support_cache, base, key)
+        if box is None:
+            box = self._get_support_box(m)
+            self._put_derived(self._support_cache, base, key, box, nbytes=0)
+        start, N_c = box
+        N = m.shape[-1]
+        if N_c >= N:
+            return m, numpy.zeros(3, dtype=int)
+        z0, y0, x0 = start
+        m_c = m[..., z0:z0+N_c, y0:y0+N_c, x0:x0+N_c]
+        shift = numpy.array(start) + N_c//2 - N//2
+        return m_c, shift
+
+    def _get_support_box(self, m):
+        # Smallest cube (start indices and edge length) that contains all non-zero voxels of the map
+        N = m.shape[-1]
+        m0 = m[0] if m.strides[0] == 0 else m
+        support = (m0 != 0)
+        if support.ndim == 4:
+            support = support.any(axis=0)
+        lo = []
+        ext = []
+        for axis in range(3):
+            i = numpy.where(support.any(axis=tuple([a for a in range(3) if a != axis])))[0]
+            if len(i) == 0:
+                # Empty map
+                return (0, 0, 0), N
+            lo.append(i[0])
+            ext.append(i[-1] + 1 - i[0])
+        N_c = max(ext)
+        # Keep the parity of the edge length (NFFT prefers even grids)
+        N_c += (N - N_c) % 2
+        if N_c >= N:
+            return (0, 0, 0), N
+        start = tuple([int(min(max(l - (N_c - e)//2, 0), N - N_c)) for l, e in zip(lo, ext)])
+        log_debug(logger, "Support of map fits in %i x %i x %i voxels (map has %i x %i x %i voxels)." % (N_c, N_c, N_c, N, N, N))
+        return start, N_c
 
     def get_current_map(self):
         """
@@ -396,38 +580,113 @@ class ParticleMap(AbstractContinuousParticle):
             m,dx = self.get_current_map()
         return m, dx
 
-    def _set_cache(self, map3d, dx, geometry, diameter=None, flattening=None):
-        self._cache = {
-            "map3d"      : map3d,
-            "dx"         : dx,
-            "geometry"   : geometry,
-            "diameter"   : diameter,
-            "flattening" : flattening,
-        }
-    
-    def _is_map_in_cache(self, O, dx_required):
-        # Empty cache?
-        if not self._cache:
-            return False
-        # Custom map?
-        elif O["geometry"] == "custom":
-            return False
-        # Correct geometry?
-        elif self._cache["geometry"] != O["geometry"]:
-            return False
-        # Correct size?
-        elif abs(self._cache["diameter"] - O["diameter"]) > 1E-10:
-            return False
-        # Correct spheroid flattening?
-        elif O["geometry"] == "spheroid":
-            if abs(self._cache["flattening"] - O["flattening"]) > 1E-10:
+    def set_map_cache(self, max_entries=MAP_CACHE_MAX_ENTRIES, max_bytes=MAP_CACHE_MAX_BYTES):
+        """
+        Set the limits of the cache of generated maps (geometries ``'icosahedron'``, ``'sphere'``, ``'spheroid'`` and ``'cube'``)
+
+        The cache holds the maps of the most recently used combinations of geometry, diameter, flattening and grid spacing. Variations of the diameter among a few values therefore do not require to generate the map again at every shot. The same limits apply to the caches of data derived from the maps (refractive index maps, bounding boxes of the support and Fourier volumes), whose entries are discarded together with the map they were derived from.
+
+        Kwargs:
+          :max_entries (int): Maximum number of cached maps. If ``0`` maps are not cached (default ``MAP_CACHE_MAX_ENTRIES``)
+
+          :max_bytes (int): Maximum total size of the cached maps in unit bytes. If ``None`` the size is not limited (default ``MAP_CACHE_MAX_BYTES``)
+        """
+        self._cache.set_limits(max_entries=max_entries, max_bytes=max_bytes)
+        self._dn_cache.set_limits(max_entries=max_entries, max_bytes=max_bytes)
+        self._support_cache.set_limits(max_entries=max_entries)
+        self._volume_cache.set_limits(max_entries=max_entries, max_bytes=max_bytes)
+
+    def get_map_cache_stats(self):
+        """
+        Return the statistics of the cache of generated maps (see :meth:`condor.utils.cache.LRUCache.get_stats`)
+        """
+        return self._cache.get_stats()
+
+    def get_dn_map_cache_stats(self):
+        """
+        Return the statistics of the cache of refractive index maps (see :meth:`condor.utils.cache.LRUCache.get_stats`)
+        """
+        return self._dn_cache.get_stats()
+
+    def get_fourier_volume_cache_stats(self):
+        """
+        Return the statistics of the cache of Fourier volumes (see :meth:`condor.utils.cache.LRUCache.get_stats`)
+        """
+        return self._volume_cache.get_stats()
+
+    def _get_materials_key(self):
+        # Hashable summary of the material configurations
+        key = []
+        for mat in self.materials:
+            conf = mat.get_conf()
+            key.append((mat.__class__.__name__,) + tuple([(k, tuple(sorted(v.items())) if isinstance(v, dict) else v) for k, v in sorted(conf.items())]))
+        return tuple(key)
+
+    def _get_map_cache_match(self, O, dx_required):
+        def match(key):
+            geometry, diameter, flattening, dx = key
+            # Correct geometry?
+            if geometry != O["geometry"]:
+                return False
+            # Correct size?
+            elif abs(diameter - O["diameter"]) > 1E-10:
                 return False
-        # Sufficient resolution?
-        elif self._cache["dx"] > dx_required:
-            return False
+            # Correct spheroid flattening?
+            elif geometry == "spheroid" and abs(flattening - O["flattening"]) > 1E-10:
+                return False
+            # Sufficient resolution?
+            elif dx > dx_required:
+                return False
+            else:
+                return True
+        return match
+
+    def _get_custom_map_grid(self, rescale_factor, dx_suggested):
+        # Band limit in units of the original map, rounded up to a multiple of MAP_INTERPOLATION_BAND_STEP
+        q_band = numpy.pi / dx_suggested * rescale_factor
+        q_orig = numpy.pi / self._dx_orig
+        if q_band >= q_orig:
+            return None
+        step = numpy.log(1. + MAP_INTERPOLATION_BAND_STEP)
+        q_band = q_orig * numpy.exp(step * numpy.ceil(numpy.log(q_band / q_orig) / step - 1E-9))
+        N = self._map3d_orig.shape[-1]
+        N_padded, N_band, N_new, dx_new = condor.utils.resample.get_fourier_resampling_grid(N, self._dx_orig, q_band)
+        # Worth it?
+        if float(N)**3 / float(N_new)**3 < MAP_INTERPOLATION_MIN_REDUCTION:
+            return None
+        return q_band, dx_new
+
+    def _get_custom_map_resampled(self, grid):
+        q_band, dx_new = grid
+        match = lambda key: key[0] == "custom" and abs(key[3] - dx_new) <= 1E-9 * dx_new
+        key, m = self._cache.find(match)
+        if m is not None:
+            log_debug(logger, "No need for resampling the custom map. Reading map from cache.")
+            return m, key[3]
+        m0 = self._map3d_orig
+        log_info(logger, "Resampling custom map of shape %s from grid spacing %e m to %e m." % (str(m0.shape[1:]), self._dx_orig, dx_new))
+        if m0.strides[0] == 0:
+            # All materials share one physical copy of the map
+            m_i = self._resample_map(m0[0], q_band)
+            m = numpy.broadcast_to(m_i, tuple([m0.shape[0]] + list(m_i.shape)))
         else:
-            return True
-        
+            m = numpy.array([self._resample_map(m_i, q_band) for m_i in m0])
+        # The cached map is shared and must not be modified
+        if m.flags.writeable:
+            m.flags.writeable = False
+        self._cache.put(("custom", self.diameter_mean, None, dx_new), m)
+        return m, dx_new
+
+    def _resample_map(self, m, q_band):
+        disk_cache = condor.utils.cache.get_disk_cache()
+        if disk_cache.is_enabled():
+            key = condor.utils.cache.get_content_key("resampled_map", m, self._dx_orig, q_band, condor.utils.resample.FOURIER_RESAMPLING_MARGIN, condor.utils.resample.FOURIER_RESAMPLING_PADDING)
+            m_new = disk_cache.get(key)
+            if m_new is None:
+                m_new = disk_cache.put(key, condor.utils.resample.resample_map_fourier(m, self._dx_orig, q_band)[0])
+            return m_new
+        return condor.utils.resample.resample_map_fourier(m, self._dx_orig, q_band)[0]
+
     def get_new_map(self, O, dx_required, dx_suggested):
         """
         Return new map with given parameters
@@ -439,14 +698,17 @@ class ParticleMap(AbstractContinuousParticle):
           :dx_required (float): Required resolution (grid spacing) of the map. An error is raised if the resolution of the map has too low resolution
 
           :dx_suggested (float): Suggested resolution (grid spacing) of the map. If the map has a very high resolution it will be interpolated to a the suggested resolution value
+
+        Custom maps that are sampled much finer than suggested are resampled with :func:`condor.utils.resample.resample_map_fourier` to a coarser grid, which reproduces the Fourier transform of the original map up to the scattering vectors that correspond to ``dx_suggested``. Resampled maps are cached like generated maps. Resampling can be switched off by setting ``condor.particle.particle_map.ENABLE_MAP_INTERPOLATION = False``.
         """
         
         if O["geometry"] in ["icosahedron", "sphere", "spheroid", "cube"]:
             
-            if not self._is_map_in_cache(O, dx_required):
+            key, m_tmp = self._cache.find(self._get_map_cache_match(O, dx_required))
+
+            if m_tmp is None:
 
                 dx = dx_suggested
-                n_mat = len(self.materials)
                 
                 if O["geometry"] == "icosahedron":
                     m_tmp = self._get_map_icosahedron(O["diameter"]/2., dx)
@@ -466,61 +728,40 @@ class ParticleMap(AbstractContinuousParticle):
                     log_and_raise_error(logger, "Particle map geometry \"%s\" is not implemented. Change your configuration and try again." % O["geometry"])
                     sys.exit(1)
 
-                m = numpy.array(n_mat * [m_tmp])
-                    
-                self._set_cache(map3d=m,
-                                dx=dx,
-                                geometry=O["geometry"],
-                                diameter=O["diameter"],
-                                flattening=(None if O["geometry"] != "spheroid" else O["flattening"]))
+                # The cached map is shared and must not be modified
+                m_tmp.flags.writeable = False
+                self._cache.put((O["geometry"], O["diameter"], (None if O["geometry"] != "spheroid" else O["flattening"]), dx), m_tmp)
 
             else:
 
                 log_debug(logger, "No need for calculating a new map. Reading map from cache.")
-                m  = self._cache["map3d"]
-                dx = self._cache["dx"]
+                dx = key[3]
+
+            # All materials share one physical copy of the map
+            m = numpy.broadcast_to(m_tmp, tuple([len(self.materials)] + list(m_tmp.shape)))
 
         elif O["geometry"] == "custom":
 
             rescale_factor = O["diameter"] / self.diameter_mean
-            dx_rescaled = self._cache["dx"] * rescale_factor
+            dx_rescaled = self._dx_orig * rescale_factor
             
             # Current map too coarsely sampled?
             if (dx_rescaled/dx_required > 1.) and not numpy.isclose(dx_rescaled/dx_required, 1.):
 
-                # Cached map (original) also too coarsely sampled? 
+                # Original map also too coarsely sampled?
                 if self._dx_orig/dx_required > 1. and not numpy.isclose(self._dx_orig/dx_required, 1.):
                     # Not fine enough -> exit
                     log_and_raise_error(logger, "Resolution of given custom map is insufficient for simulation. Required is at most %e m vs. provided %e m." % (dx_required, self._dx_orig))
                     sys.exit(1)
-                else:
-                    # Change back to original fine map
-                    self._set_cache(map3d=self._map3d_orig,
-                                    dx=self._dx_orig,
-                                    geometry="custom")
                     
             # Can we downsample current map?
-            # MAX: We would do this only for performance reasons but have not found a good way of downsampling without introducing artifacts
-            #if (dx_suggested/dx_rescaled >= 2.) and (dx_suggested/self._dx_orig >= 2.) and ENABLE_MAP_INTERPOLATION:
-            #    print("ENABLE_MAP_INTERPOLATION=%i" % ENABLE_MAP_INTERPOLATION)
-            #    N1 = self._map3d_orig.shape[0]
-            #    m1 = numpy.zeros(shape=(N1,N1,N1), dtype=numpy.float64)
-            #    m1[:self._map3d_orig.shape[0],:self._map3d_orig.shape[0],:self._map3d_orig.shape[0]] = self._map3d_orig[:,:,:]
-            #    fm1 = numpy.fft.fftshift(numpy.fft.ifftn(m1))
-            #    N1 = m1.shape[0]
-            #    N2 = int(numpy.ceil(N1 * self._dx_orig / dx_suggested))
-            #    x1 = numpy.linspace(-0.5,0.5,N2)*(1-0.5/N2)
-            #    Z,Y,X = numpy.meshgrid(x1,x1,x1,indexing="ij")
-            #    coords = numpy.array([[z,y,x] for z,y,x in zip(Z.ravel(),Y.ravel(),X.ravel())])
-            #    m2 = abs(numpy.fft.fftshift(condor.utils.nfft.nfft(fm1,coords).reshape((N2,N2,N2))))
-            #    #from pylab import *
-            #    #imsave("m1.png", m1.sum(0))
-            #    #imsave("m2.png", m2.sum(0))
-            #    self._dx    = self._dx_orig * float(N1)/float(N2)
-            #    self._map3d = m2 / m2.sum() * m1.sum()
-
-            m  = self._cache["map3d"]
-            dx = rescale_factor * self._cache["dx"]
+            grid = self._get_custom_map_grid(rescale_factor, dx_suggested) if ENABLE_MAP_INTERPOLATION else None
+            if grid is not None:
+                m, dx = self._get_custom_map_resampled(grid)
+                return m, dx * rescale_factor
+
+            m  = self._map3d_orig
+            dx = dx_rescaled
             
         return m,dx
                 
@@ -561,19 +802,5 @@ class ParticleMap(AbstractContinuousParticle):
         nel = a/dx 
         # leaving a bit of free space around
         N = int(numpy.ceil(2.3*nel))
-        # make map
-        X,Y,Z = 1.0*numpy.mgrid[0:N,0:N,0:N]
-        X = X - (N-1)/2.
-        Y = Y - (N-1)/2.
-        Z = Z - (N-1)/2.
-        DX = abs(X)-nel/2.
-        DY = abs(Y)-nel/2.
-        DZ = abs(Z)-nel/2.
-        D = numpy.array([DZ,DY,DX])
-        m = numpy.zeros(shape=(N,N,N))
-        Dmax = D.max(0)
-        m[Dmax<-0.5] = 1.
-        temp = (Dmax<0.5)*(m==0.)
-        d = Dmax[temp]
-        m[temp] = 0.5-d
+        m = condor.utils.bodies.make_cube_map(N,nel)
         return numpy.asarray(m, dtype=numpy.float64)
@@ -0,0 +1,191 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+import condor
+import condor.utils.log
+from condor.utils.log import log_and_raise_error,log_warning,log_info,log_debug
+
+import condor.utils.polyhedron_diffraction
+
+from .particle_abstract import AbstractContinuousParticle
+
+
+class ParticlePolyhedron(AbstractContinuousParticle):
+    """
+    Class for a particle model
+
+    *Model:* Uniformly filled polyhedron with a triangulated surface (continuum approximation). The scattering amplitudes are calculated analytically (see :mod:`condor.utils.polyhedron_diffraction`), i.e. without sampling the particle on a grid.
+
+    Args:
+      :geometry (str): Geometry type
+
+        *Choose one of the following options:*
+
+          - ``'icosahedron'`` - regular icosahedron, ``diameter`` is the diameter of the sphere of equal volume (same orientation and size as the icosahedron of :class:`condor.particle.particle_map.ParticleMap`)
+
+          - ``'cube'`` - cube, ``diameter`` is the edge length (same as for :class:`condor.particle.particle_map.ParticleMap`)
+
+          - ``'custom'`` - provide the triangulated surface with ``vertices`` and ``faces``, ``diameter`` is the diameter of the sphere of equal volume
+
+    Kwargs:
+      :diameter (float): (Mean) particle diameter in unit meter. For ``geometry='custom'`` the mesh is rescaled accordingly. If ``None`` the mesh is used with its original size (default ``None``)
+
+      :diameter_variation (str): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_diameter_variation` (default ``None``)
+
+      :diameter_spread (float): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_diameter_variation` (default ``None``)
+
+      :diameter_variation_n (int): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_diameter_variation` (default ``None``)
+
+      :vertices (array): Vertex coordinates (:math:`x`, :math:`y`, :math:`z`) in unit meter of shape (:math:`N_v`, 3), only for ``geometry='custom'``. The mesh is translated such that its centre of mass lies in the origin. (default ``None``)
+
+      :faces (array): Vertex indices of the triangular faces of shape (:math:`N_f`, 3), only for ``geometry='custom'``. The surface must be closed and the faces must be oriented consistently (see :func:`condor.utils.polyhedron_diffraction.orient_mesh`). (default ``None``)
+
+      :rotation_values (array): See :meth:`condor.particle.particle_abstract.AbstractParticle.set_alignment` (default ``None``)
+
+      :rotation_formalism (str): See :meth:`condor.particle.particle_abstract.AbstractParticle.set_alignment` (default ``None``)
+
+      :rotation_mode (str): See :meth:`condor.particle.particle_abstract.AbstractParticle.set_alignment` (default ``None``)
+
+      :number (float): Expectation value for the number of particles in the interaction volume. (defaukt ``1.``)
+
+      :arrival (str): Arrival of particles at the interaction volume can be either ``'random'`` or ``'synchronised'``. If ``sync`` at every event the number of particles in the interaction volume equals the rounded value of ``number``. If ``'random'`` the number of particles is Poissonian and ``number`` is the expectation value. (default ``'synchronised'``)
+
+      :position (array): See :class:`condor.particle.particle_abstract.AbstractParticle` (default ``None``)
+
+      :position_variation (str): See :meth:`condor.particle.particle_abstract.AbstractParticle.set_position_variation` (default ``None``)
+
+      :position_spread (float): See :meth:`condor.particle.particle_abstract.AbstractParticle.set_position_variation` (default ``None``)
+
+      :position_variation_n (int): See :meth:`condor.particle.particle_abstract.AbstractParticle.set_position_variation` (default ``None``)
+
+      :material_type (str): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_material` (default ``\'water\'``)
+
+      :massdensity (float): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_material` (default ``None``)
+
+      :atomic_composition (dict): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_material` (default ``None``)
+
+      :electron_density (float): See :meth:`condor.particle.particle_abstract.AbstractContinuousParticle.set_material` (default ``None``)
+    """
+    def __init__(self,
+                 geometry, diameter = None,
+                 diameter_variation = None, diameter_spread = None, diameter_variation_n = None,
+                 vertices = None, faces = None,
+                 rotation_values = None, rotation_formalism = None, rotation_mode = "extrinsic",
+                 number = 1., arrival = "synchronised",
+                 position = None, position_variation = None, position_spread = None, position_variation_n = None,
+                 material_type = 'water', massdensity = None, atomic_composition = None, electron_density = None):
+
+        # Check for valid geometry
+        if geometry not in ["icosahedron", "cube", "custom"]:
+            log_and_raise_error(logger, "Cannot initialize %s because \'%s\' is not a valid argument for \'geometry\'." % (self.__class__.__name__, geometry))
+            return
+        if (geometry == "custom") != (vertices is not None and faces is not None):
+            log_and_raise_error(logger, "Cannot initialize %s. The arguments \'vertices\' and \'faces\' are required for geometry=\'custom\' and invalid otherwise." % self.__class__.__name__)
+            return
+        self.geometry = geometry
+
+        # Mesh of unit size (unit volume for icosahedron and custom mesh, unit edge length for cube)
+        if geometry == "icosahedron":
+            self._vertices, self._faces = condor.utils.polyhedron_diffraction.get_icosahedron_mesh()
+        elif geometry == "cube":
+            self._vertices, self._faces = condor.utils.polyhedron_diffraction.get_cube_mesh()
+        else:
+            self._vertices_orig, self._faces = condor.utils.polyhedron_diffraction.orient_mesh(vertices, faces)
+            V = condor.utils.polyhedron_diffraction.get_mesh_volume(self._vertices_orig, self._faces)
+            c = condor.utils.polyhedron_diffraction.get_mesh_centroid(self._vertices_orig, self._faces)
+            self._vertices = (self._vertices_orig - c) / V**(1/3.)
+            if diameter is None:
+                diameter = 2 * (3 * V / (4 * numpy.pi))**(1/3.)
+        if diameter is None:
+            log_and_raise_error(logger, "Cannot initialize %s without \'diameter\' for geometry=\'%s\'." % (self.__class__.__name__, geometry))
+            return
+
+        # Initialise base class
+        AbstractContinuousParticle.__init__(self,
+                                            diameter=diameter, diameter_variation=diameter_variation, diameter_spread=diameter_spread, diameter_variation_n=diameter_variation_n,
+                                            rotation_values=rotation_values, rotation_formalism=rotation_formalism, rotation_mode=rotation_mode,
+                                            number=number, arrival=arrival,
+                                            position=position, position_variation=position_variation, position_spread=position_spread, position_variation_n=position_variation_n,
+                                            material_type=material_type, massdensity=massdensity, atomic_composition=atomic_composition, electron_density=electron_density)
+
+    def get_conf(self):
+        """
+        Get configuration in form of a dictionary. Another identically configured ParticlePolyhedron instance can be initialised by:
+
+        .. code-block:: python
+
+          conf = P0.get_conf()                   # P0: already existing ParticlePolyhedron instance
+          P1 = condor.ParticlePolyhedron(**conf) # P1: new ParticlePolyhedron instance with the same configuration as P0
+        """
+        conf = {}
+        conf.update(AbstractContinuousParticle.get_conf(self))
+        conf["geometry"] = self.geometry
+        if self.geometry == "custom":
+            conf["vertices"] = self._vertices_orig
+            conf["faces"]    = self._faces
+        return conf
+
+    def get_next(self):
+        """
+        Iterate the parameters and return them as a dictionary
+        """
+        O = AbstractContinuousParticle.get_next(self)
+        O["particle_model"] = "polyhedron"
+        O["geometry"]       = self.geometry
+        return O
+
+    def get_mesh(self, diameter):
+        """
+        Return the tuple of vertices (:math:`x`, :math:`y`, :math:`z`) in unit meter and faces (vertex indices, counter clockwise seen from outside) of the polyhedron with given diameter (before rotation)
+
+        Args:
+          :diameter (float): Particle diameter in unit meter (see :class:`condor.particle.particle_polyhedron.ParticlePolyhedron`)
+        """
+        if self.geometry == "cube":
+            s = diameter
+        else:
+            # Edge length of the cube of equal volume
+            s = (numpy.pi / 6.)**(1/3.) * diameter
+        return self._vertices * s, self._faces
+
+    def get_dn(self, photon_wavelength):
+        if self.materials is None:
+            dn = 0.
+        else:
+            dn = numpy.array([m.get_dn(photon_wavelength) for m in self.materials]).sum()
+        return dn
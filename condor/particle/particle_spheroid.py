@@ -40,7 +40,7 @@ import condor
 import condor.utils.log
 from condor.utils.log import log_and_raise_error,log_warning,log_info,log_debug
 
-from .particle_abstract import AbstractContinuousParticle
+from .particle_abstract import AbstractContinuousParticle, _get_positive_quadrature
 
 from condor.utils.variation import Variation
 
@@ -187,6 +187,48 @@ class ParticleSpheroid(AbstractContinuousParticle):
             else:
                 return f
 
+    def get_flattening_quadrature(self, order):
+        """
+        Return nodes and weights of a quadrature rule for averaging over the distribution of flattenings (see :meth:`condor.utils.variation.Variation.get_quadrature`)
+
+        Args:
+          :order (int): Number of quadrature nodes
+        """
+        return _get_positive_quadrature(self._flattening_variation, self.flattening_mean, order, "flattening")
+
+    def get_orientation_quadrature(self, order):
+        r"""
+        Return the spheroid axis angles :math:`\theta` and :math:`\phi` (see :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`) and the weights of a quadrature rule for averaging over the distribution of random orientations
+
+        The diffraction pattern depends on the axis only through :math:`\cos^2\theta` and periodically on :math:`\phi` with period :math:`\pi`. For ``rotation_formalism='random'`` the axis is distributed uniformly on the unit sphere. Hence :math:`\sin\theta` is sampled by the Gauss-Legendre rule on :math:`[0,1]` and :math:`\phi` by ``2*order`` equispaced nodes on :math:`[0,\pi)`, which is spectrally accurate for periodic functions. For ``'random_x'`` (rotation in the *y*-*z* plane) and ``'random_z'`` (rotation in the *x*-*y* plane) only one angle varies. For all other rotation formalisms ``None`` is returned.
+
+        Args:
+          :order (int): Number of quadrature nodes per angle
+        """
+        formalism = self._rotations.get_formalism()
+        if formalism == "random":
+            s, w_s = numpy.polynomial.legendre.leggauss(order)
+            # Map from [-1,1] to [0,1]
+            s = (s + 1.) / 2.
+            w_s = w_s / 2.
+            phi = numpy.arange(2*order) * numpy.pi / (2*order)
+            theta, phi = numpy.meshgrid(numpy.arcsin(s), phi, indexing="ij")
+            w = numpy.multiply.outer(w_s, numpy.ones(2*order) / (2*order))
+            return theta.ravel(), phi.ravel(), w.ravel()
+        elif formalism in ["random_x", "random_z"]:
+            alpha = numpy.arange(2*order) * numpy.pi / (2*order)
+            w = numpy.ones(2*order) / (2*order)
+            zero = numpy.zeros(2*order)
+            if formalism == "random_x":
+                return alpha, zero, w
+            else:
+                return zero, alpha, w
+        elif formalism == "random_y":
+            # Rotation about the spheroid axis does not change the pattern
+            return numpy.zeros(1), numpy.zeros(1), numpy.ones(1)
+        else:
+            return None
+
     def get_dn(self, photon_wavelength):
         if self.materials is None:
             dn = 0.
@@ -7,7 +7,7 @@ import condor.utils.cxiwriter
 from condor.utils.log import log_info
 import logging
 logger = logging.getLogger("condor")
-import time, numpy
+import time, numpy, json
 
 
 def main():
@@ -17,7 +17,9 @@ def main():
     parser.add_argument('-v', '--verbose', dest='verbose',  action='store_true', help='verbose mode', default=False)
     parser.add_argument('-d', '--debug', dest='debug',  action='store_true', help='debugging mode (even more output than in verbose mode)', default=False)
     parser.add_argument('-t', '--measure-time', dest='measure_time',  action='store_true', help='Measure execution time', default=False)
+    parser.add_argument('-m', '--measure-memory', dest='measure_memory',  action='store_true', help='Measure peak memory allocation of the simulation stages (slow)', default=False)
     parser.add_argument('-r', '--number-of-repetitions', metavar='number_of_repetitions', type=int, help="number of repetitions (for time measurements)", default=1)
+    parser.add_argument('--report', metavar='report_filename', type=str, help="write run report (throughput, timing percentiles, cache hit rates, library versions) in JSON format to the given file", default=None)
     args = parser.parse_args()
     if not os.path.exists("./condor.conf"):
         parser.error("Cannot find configuration file \"condor.conf\" in current directory.")
@@ -26,14 +28,20 @@ def main():
     if args.debug:
         logger.setLevel("DEBUG")
 
-    t_exec = []
-    t_write = []    
-
     t0 = time.time()
+
+    metrics = None
     
     for i in range(args.number_of_repetitions):
 
         E = condor.experiment.experiment_from_configfile("./condor.conf")
+        if metrics is None:
+            metrics = E.metrics
+            if args.measure_memory:
+                metrics.enable_memory_tracking()
+        else:
+            # Accumulate measurements of all repetitions
+            E.metrics = metrics
     
         # FOR BENCHMARKING
         #from pycallgraph import PyCallGraph
@@ -47,26 +55,37 @@ def main():
         #])
         #with PyCallGraph(output=GraphvizOutput(),config=config):
         
-        W = condor.utils.cxiwriter.CXIWriter("./condor.cxi")
+        W = condor.utils.cxiwriter.CXIWriter("./condor.cxi", metrics=metrics)
         for i in range(args.number_of_patterns):
-            t1 = time.time()
             res = E.propagate()
-            t2 = time.time()
             W.write(res)
-            t3 = time.time()
-            t_exec.append(t2 - t1)
-            t_write.append(t3 - t2)
         W.close()
 
     t4 = time.time()
     
     if args.measure_time:
-        t_exec = numpy.array(t_exec)
-        t_write = numpy.array(t_write)
+        M = metrics.get()
         print("TIME MEASUREMENT RESULTS IN SECONDS")
         print("Total time: %.3f" % numpy.round(t4 - t0, 3))
-        print("Computation time per image: %.3f" % numpy.round(t_exec.mean(), 3))
-        print("( Individual computation times: ", numpy.round(t_exec, 3), " )")
-        print("Writing time per image: %.3f" % numpy.round(t_write.mean(), 3))
-        print("( Individual writing times: ", numpy.round(t_write, 3), " )")
-        
+        print("%-12s %8s %10s %10s %10s %10s %10s" % ("stage", "count", "total", "mean", "p50", "p95", "max"))
+        for name in sorted(M["timers"].keys()):
+            t = metrics.get_timer(name)
+            print("%-12s %8i %10.4f %10.4f %10.4f %10.4f %10.4f" % (name, t.count, t.total, t.total/t.count,
+                                                                   t.get_percentile(50), t.get_percentile(95), t.max))
+        for name in sorted(M["counters"].keys()):
+            print("%-12s %8i" % (name, M["counters"][name]))
+    
+    if args.measure_memory:
+        M = metrics.get()
+        print("PEAK MEMORY PER STAGE INVOCATION IN MEGABYTES")
+        print("%-12s %8s %10s %10s" % ("stage", "count", "mean", "max"))
+        for name in sorted(M["memory"].keys()):
+            m = M["memory"][name]
+            print("%-12s %8i %10.2f %10.2f" % (name, m["count"], m["peak_mean"]/1E6, m["peak_max"]/1E6))
+
+    if args.report is not None:
+        report = metrics.get_report(wall_time=t4 - t0)
+        report["number_of_repetitions"] = args.number_of_repetitions
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        log_info(logger, "Run report written to %s" % args.report)
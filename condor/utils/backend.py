@@ -0,0 +1,500 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+"""
+Selection of the computational backend for the elementwise kernels (form factors of spheres, spheroids and polyhedra, polarization factors and phase factors of translated particles) and the grid kernels (spreading and interpolation of the propagations with ``propagation='fourier_volume'`` and ``propagation='projection'``)
+
+With the ``'numpy'`` backend the kernels are evaluated as chains of NumPy expressions. With the ``'numba'`` backend they are compiled (on first use) to parallel loops that do not create full-size temporary arrays. The default backend ``'auto'`` uses Numba if it can be imported and falls back to NumPy otherwise. The default can be set by the environment variable ``CONDOR_BACKEND``.
+
+.. code-block:: python
+
+  import condor.utils.backend
+  condor.utils.backend.set_backend("numpy")
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import os
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ["numpy", "numba", "auto"]
+
+_backend = None
+_kernels = None
+
+def set_backend(backend):
+    """
+    Set the computational backend for all subsequent simulations
+
+    Args:
+      :backend (str): Either ``'numpy'``, ``'numba'`` or ``'auto'`` (Numba if available, otherwise NumPy). If ``'numba'`` is requested but Numba cannot be imported a warning is issued and NumPy is used.
+    """
+    global _backend
+    if backend not in BACKENDS:
+        log_and_raise_error(logger, "Invalid backend %s. Valid backends are: %s" % (backend, ", ".join(BACKENDS)))
+        return
+    if backend == "numba" and numba is None:
+        log_warning(logger, "Numba backend requested but Numba cannot be imported. Falling back to the NumPy backend.")
+    _backend = backend
+
+def get_backend():
+    """
+    Return the name of the backend that is actually used (either ``'numpy'`` or ``'numba'``)
+    """
+    if _backend is None:
+        set_backend(os.environ.get("CONDOR_BACKEND", "auto"))
+    if _backend in ["numba", "auto"] and numba is not None:
+        return "numba"
+    return "numpy"
+
+def get_kernels():
+    """
+    Return the compiled Numba kernels if the Numba backend is active, otherwise ``None``
+    """
+    global _kernels
+    if get_backend() != "numba":
+        return None
+    if _kernels is None:
+        _kernels = _compile()
+    return _kernels
+
+def sphere_form_factor(x, out=None):
+    """
+    Evaluate the sphere form factor (see :func:`condor.utils.sphere_diffraction.sphere_form_factor`) with the Numba backend
+
+    Args:
+      :x (array): Non-negative arguments :math:`x = qr`
+
+    Kwargs:
+      :out (array): If not ``None`` the result is written to this array (default ``None``)
+    """
+    return _elementwise(get_kernels().sphere_form_factor, [x], out)
+
+def spheroid_form_factor(q_x, q_y, a, c, theta, phi, out=None):
+    """
+    Evaluate the normalised spheroid form factor (see :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`) in a single loop with the Numba backend
+
+    Args:
+      :q_x (array): :math:`x`-coordinates of the scattering vectors
+
+      :q_y (array): :math:`y`-coordinates of the scattering vectors
+
+      :a (float): Semi-diameter perpendicular to the rotation axis
+
+      :c (float): Semi-diameter along the rotation axis
+
+      :theta (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :phi (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+    Kwargs:
+      :out (array): If not ``None`` the result is written to this array (default ``None``)
+    """
+    n_x = -numpy.cos(theta)*numpy.sin(phi)
+    n_y = numpy.cos(theta)*numpy.cos(phi)
+    return _elementwise(get_kernels().spheroid_form_factor, [q_x, q_y], out, float(a), float(c), float(n_x), float(n_y))
+
+def polyhedron_form_factor(qmap, vertices, faces, out=None):
+    """
+    Evaluate the Fourier transform of a polyhedron (see :func:`condor.utils.polyhedron_diffraction.polyhedron_form_factor`) in a single loop with the Numba backend
+
+    Args:
+      :qmap (array): Scattering vectors with the components (:math:`q_x`, :math:`q_y`, :math:`q_z`) along the last dimension
+
+      :vertices (array): Vertex coordinates of shape (:math:`N_v`, 3)
+
+      :faces (array): Vertex indices of the triangular faces of shape (:math:`N_f`, 3), counter clockwise seen from outside
+
+    Kwargs:
+      :out (array): If not ``None`` the result is written to this complex array of the shape ``qmap.shape[:-1]`` (default ``None``)
+    """
+    from .polyhedron_diffraction import get_mesh_volume, get_mesh_centroid, _EPS_PHASE, _EPS_QR
+    qmap = numpy.ascontiguousarray(qmap, dtype=numpy.float64)
+    vertices = numpy.ascontiguousarray(vertices, dtype=numpy.float64)
+    faces = numpy.ascontiguousarray(faces, dtype=numpy.int64)
+    a, b, c = [vertices[faces[:,i]] for i in range(3)]
+    N = numpy.ascontiguousarray(numpy.cross(b - a, c - a))
+    V = get_mesh_volume(vertices, faces)
+    centroid = get_mesh_centroid(vertices, faces)
+    R = numpy.sqrt(((vertices - centroid)**2).sum(axis=1)).max()
+    res = numpy.empty(shape=qmap.shape[:-1], dtype=numpy.complex128)
+    get_kernels().polyhedron_form_factor(qmap.reshape(-1, 3), vertices, faces, N, float(V), centroid, float(R), _EPS_PHASE, _EPS_QR, res.reshape(-1))
+    if out is not None:
+        out[...] = res
+        return out
+    return res
+
+_POLARIZATIONS = {"vertical" : 0, "horizontal" : 1, "unpolarized" : 2}
+
+def polarization_factor(x, y, detector_distance, polarization):
+    """
+    Evaluate the polarization factor (see :func:`condor.utils.diffraction.polarization_factor`) with the Numba backend
+
+    Args:
+      :x (array): Horizontal pixel coordinates in unit meter
+
+      :y (array): Vertical pixel coordinates in unit meter
+
+      :detector_distance (float): Detector distance in unit meter
+
+      :polarization (str): Either ``'vertical'``, ``'horizontal'`` or ``'unpolarized'``
+    """
+    return _elementwise(get_kernels().polarization_factor, [x, y], None, float(detector_distance), _POLARIZATIONS[polarization])
+
+def phase_factor(F, qmap, v):
+    r"""
+    Return the amplitudes multiplied by the phase factors :math:`\exp(-i \vec{v} \cdot \vec{q})` of a particle translated by :math:`\vec{v}` (evaluated with the backend that is currently selected)
+
+    Args:
+      :F (array): Amplitudes
+
+      :qmap (array): Scattering vectors with the components (:math:`q_x`, :math:`q_y`, :math:`q_z`) along the last dimension and otherwise of the same shape as ``F``
+
+      :v (array): Translation vector (:math:`x`, :math:`y`, :math:`z`) in unit meter
+    """
+    kernels = get_kernels()
+    if kernels is None:
+        return F * numpy.exp(-1.j*numpy.dot(qmap, numpy.asarray(v, dtype=numpy.float64)))
+    F = numpy.ascontiguousarray(numpy.broadcast_to(F, qmap.shape[:-1]), dtype=numpy.complex128)
+    qmap = numpy.ascontiguousarray(qmap, dtype=numpy.float64)
+    out = numpy.empty(shape=F.shape, dtype=numpy.complex128)
+    kernels.phase_factor(F.reshape(-1), qmap.reshape(-1, 3), float(v[0]), float(v[1]), float(v[2]), out.reshape(-1))
+    return out
+
+def interpolate_volume(volume, i_start, weights, out):
+    """
+    Interpolate a periodic complex volume with separable stencils (evaluated with the backend that is currently selected)
+
+    Args:
+      :volume (array): Complex 3D volume, periodically continued along every axis
+
+      :i_start (array): Integer array of shape (:math:`M`, 3) with the first index of the stencil of every position along every axis
+
+      :weights (array): Array of shape (:math:`M`, 3, :math:`W`) with the stencil weights of every position along every axis
+
+      :out (array): Complex array of length :math:`M` to which the result is written
+    """
+    kernels = get_kernels()
+    W = weights.shape[-1]
+    if kernels is not None:
+        kernels.interpolate_volume(volume, numpy.ascontiguousarray(i_start, dtype=numpy.int64), numpy.ascontiguousarray(weights, dtype=numpy.float64), out)
+        return out
+    idx = [(i_start[:,a,numpy.newaxis] + numpy.arange(W)) % volume.shape[a] for a in range(3)]
+    out[:] = 0.
+    for jz in range(W):
+        for jy in range(W):
+            w_zy = weights[:,0,jz] * weights[:,1,jy]
+            for jx in range(W):
+                # One sample per position
+                out += volume[idx[0][:,jz], idx[1][:,jy], idx[2][:,jx]] * (w_zy * weights[:,2,jx])
+    return out
+
+def spread_moments(w, zeta, order, i_start, weights, G):
+    r"""
+    Return the moments :math:`w \, \zeta^k/k!` (:math:`k = 0, \ldots, K`) of weighted points spread onto a 2D grid with separable stencils as complex array of shape (:math:`K+1`, :math:`G`, :math:`G`) with the axes in the order (*k*, *y*, *x*) (evaluated with the backend that is currently selected)
+
+    Args:
+      :w (array): Complex weights of the :math:`M` points
+
+      :zeta (array): Coordinates of the points along the axis of the moments
+
+      :order (int): Highest order :math:`K` of the moments
+
+      :i_start (array): Integer array of shape (:math:`M`, 2) with the first index of the stencil of every point along *x* and *y*, the stencils have to lie within the grid
+
+      :weights (array): Array of shape (:math:`M`, 2, :math:`W`) with the stencil weights of every point along *x* and *y*
+
+      :G (int): Number of grid points along every axis
+    """
+    kernels = get_kernels()
+    W = weights.shape[-1]
+    if kernels is not None:
+        i_start = numpy.ascontiguousarray(i_start, dtype=numpy.int64)
+        # Points sorted by the first row of their stencils
+        perm = numpy.empty(i_start.shape[0], dtype=numpy.int64)
+        offsets = numpy.empty(G + 1, dtype=numpy.int64)
+        kernels.sort_rows(i_start[:,1].copy(), perm, offsets)
+        # Moments along the last axis (contiguous updates)
+        P = numpy.zeros(shape=(G, G, order + 1), dtype=numpy.complex128)
+        kernels.spread_moments(numpy.ascontiguousarray(w, dtype=numpy.complex128), numpy.ascontiguousarray(zeta, dtype=numpy.float64),
+                               i_start, numpy.ascontiguousarray(weights, dtype=numpy.float64), perm, offsets, P)
+        return numpy.ascontiguousarray(P.transpose(2, 0, 1))
+    w_k = [w]
+    for k in range(1, order + 1):
+        w_k.append(w_k[-1] * zeta / k)
+    P = numpy.zeros(shape=(order + 1, G*G), dtype=numpy.complex128)
+    for jy in range(W):
+        for jx in range(W):
+            idx = (i_start[:,1] + jy) * G + (i_start[:,0] + jx)
+            s = weights[:,1,jy] * weights[:,0,jx]
+            for k in range(order + 1):
+                P[k] += numpy.bincount(idx, weights=(w_k[k].real * s), minlength=G*G)
+                P[k] += 1j * numpy.bincount(idx, weights=(w_k[k].imag * s), minlength=G*G)
+    return P.reshape((order + 1, G, G))
+
+def interpolate_grids(grids, i_start, weights, out):
+    """
+    Interpolate a stack of periodic complex 2D grids with separable stencils (evaluated with the backend that is currently selected)
+
+    Args:
+      :grids (array): Complex array of shape (:math:`L`, :math:`G_y`, :math:`G_x`), every grid periodically continued along both axes
+
+      :i_start (array): Integer array of shape (:math:`M`, 2) with the first index of the stencil of every position along *x* and *y*
+
+      :weights (array): Array of shape (:math:`M`, 2, :math:`W`) with the stencil weights of every position along *x* and *y*
+
+      :out (array): Complex array of shape (:math:`L`, :math:`M`) to which the result is written
+    """
+    kernels = get_kernels()
+    W = weights.shape[-1]
+    if kernels is not None:
+        kernels.interpolate_grids(numpy.ascontiguousarray(grids, dtype=numpy.complex128), numpy.ascontiguousarray(i_start, dtype=numpy.int64), numpy.ascontiguousarray(weights, dtype=numpy.float64), out)
+        return out
+    out[:] = 0.
+    for jy in range(W):
+        iy = (i_start[:,1] + jy) % grids.shape[1]
+        for jx in range(W):
+            ix = (i_start[:,0] + jx) % grids.shape[2]
+            out += grids[:, iy, ix] * (weights[:,1,jy] * weights[:,0,jx])
+    return out
+
+def _elementwise(kernel, arrays, out, *args):
+    arrays = numpy.broadcast_arrays(*[numpy.asarray(a, dtype=numpy.float64) for a in arrays])
+    shape = arrays[0].shape
+    arrays = [numpy.ascontiguousarray(a).reshape(-1) for a in arrays]
+    if out is not None and out.flags.c_contiguous and out.dtype == numpy.float64:
+        kernel(*(arrays + list(args) + [out.reshape(-1)]))
+        return out
+    res = numpy.empty(shape=shape, dtype=numpy.float64)
+    kernel(*(arrays + list(args) + [res.reshape(-1)]))
+    if out is not None:
+        out[...] = res
+        return out
+    return res
+
+def _compile():
+    log_debug(logger, "Compiling Numba kernels.")
+    
+    class Kernels:
+        pass
+    K = Kernels()
+
+    @numba.njit(inline="always")
+    def _f(x):
+        if x < 0.1:
+            # Taylor series (the closed form suffers from cancellation)
+            x2 = x*x
+            return 1. + x2*(-1./10. + x2*(1./280. + x2*(-1./15120. + x2*(1./1330560.))))
+        return 3. * (numpy.sin(x) - x*numpy.cos(x)) / (x*x*x)
+
+    @numba.njit(parallel=True)
+    def sphere_form_factor(x, out):
+        for i in numba.prange(x.size):
+            out[i] = _f(abs(x[i]))
+    K.sphere_form_factor = sphere_form_factor
+
+    @numba.njit(parallel=True)
+    def spheroid_form_factor(q_x, q_y, a, c, n_x, n_y, out):
+        a2 = a*a
+        d2 = c*c - a2
+        for i in numba.prange(q_x.size):
+            u = q_x[i]*n_x + q_y[i]*n_y
+            qH2 = a2*(q_x[i]*q_x[i] + q_y[i]*q_y[i]) + d2*u*u
+            out[i] = _f(numpy.sqrt(max(qH2, 0.)))
+    K.spheroid_form_factor = spheroid_form_factor
+
+    @numba.njit(inline="always")
+    def _phi1(w):
+        return 1. + w*(1/2. + w*(1/6. + w*(1/24. + w/120.)))
+
+    @numba.njit(inline="always")
+    def _dd1(E_a, E_b, p_a, p_b, eps):
+        # First divided difference of exp at z = -i p (p_b >= p_a)
+        d = p_b - p_a
+        if d < eps:
+            return E_a * _phi1(-1j * d)
+        return 1j * (E_b - E_a) / d
+
+    @numba.njit(inline="always")
+    def _dd2(E0, E1, E2, p0, p1, p2, eps):
+        # Second divided difference of exp at z = -i p
+        d01 = p1 - p0
+        d12 = p2 - p1
+        d20 = p0 - p2
+        if min(abs(d01), abs(d12), abs(d20)) >= eps:
+            return (E0*d12 + E1*d20 + E2*d01) / (d01 * d12 * d20)
+        # Sort nodes by phase
+        if p0 > p1:
+            p0, p1 = p1, p0
+            E0, E1 = E1, E0
+        if p1 > p2:
+            p1, p2 = p2, p1
+            E1, E2 = E2, E1
+        if p0 > p1:
+            p0, p1 = p1, p0
+            E0, E1 = E1, E0
+        d = p2 - p0
+        if d >= eps:
+            return 1j * (_dd1(E1, E2, p1, p2, eps) - _dd1(E0, E1, p0, p1, eps)) / d
+        p_m = (p0 + p1 + p2) / 3.
+        w0 = -1j * (p0 - p_m)
+        w1 = -1j * (p1 - p_m)
+        w2 = -1j * (p2 - p_m)
+        s2 = w0*w0 + w1*w1 + w2*w2
+        s3 = w0*w0*w0 + w1*w1*w1 + w2*w2*w2
+        s4 = w0**4 + w1**4 + w2**4
+        return complex(numpy.cos(p_m), -numpy.sin(p_m)) * (1/2. + s2/48. + s3/360. + (s2*s2/8. + s4/4.)/720.)
+
+    @numba.njit(parallel=True)
+    def polyhedron_form_factor(qmap, vertices, faces, N, V, centroid, R, eps_phase, eps_qR, out):
+        n_v = vertices.shape[0]
+        n_q = qmap.shape[0]
+        # Blocks of scattering vectors share the buffers of the vertex phases
+        n_block = 256
+        for i_block in numba.prange((n_q + n_block - 1) // n_block):
+            p_v = numpy.empty(n_v)
+            E_v = numpy.empty(n_v, dtype=numpy.complex128)
+            for i in range(i_block*n_block, min((i_block+1)*n_block, n_q)):
+                q_x = qmap[i,0]
+                q_y = qmap[i,1]
+                q_z = qmap[i,2]
+                q_sq = q_x*q_x + q_y*q_y + q_z*q_z
+                if q_sq * R * R < eps_qR * eps_qR:
+                    p = q_x*centroid[0] + q_y*centroid[1] + q_z*centroid[2]
+                    out[i] = V * complex(numpy.cos(p), -numpy.sin(p))
+                    continue
+                for j in range(n_v):
+                    p_v[j] = q_x*vertices[j,0] + q_y*vertices[j,1] + q_z*vertices[j,2]
+                    E_v[j] = complex(numpy.cos(p_v[j]), -numpy.sin(p_v[j]))
+                A = 0j
+                for f in range(faces.shape[0]):
+                    a = faces[f,0]
+                    b = faces[f,1]
+                    c = faces[f,2]
+                    qN = q_x*N[f,0] + q_y*N[f,1] + q_z*N[f,2]
+                    A += qN * _dd2(E_v[a], E_v[b], E_v[c], p_v[a], p_v[b], p_v[c], eps_phase)
+                out[i] = 1j * A / q_sq
+    K.polyhedron_form_factor = polyhedron_form_factor
+
+    @numba.njit(parallel=True)
+    def polarization_factor(x, y, D, mode, out):
+        for i in numba.prange(x.size):
+            r2 = x[i]*x[i] + y[i]*y[i] + D*D
+            # cos^2(arcsin(s/r)) = 1 - s^2/r^2
+            if mode == 0:
+                out[i] = 1. - y[i]*y[i]/r2
+            elif mode == 1:
+                out[i] = 1. - x[i]*x[i]/r2
+            else:
+                out[i] = 0.5*(2. - (x[i]*x[i] + y[i]*y[i])/r2)
+    K.polarization_factor = polarization_factor
+
+    @numba.njit(parallel=True)
+    def phase_factor(F, qmap, v_x, v_y, v_z, out):
+        for i in numba.prange(F.size):
+            p = v_x*qmap[i,0] + v_y*qmap[i,1] + v_z*qmap[i,2]
+            out[i] = F[i] * complex(numpy.cos(p), -numpy.sin(p))
+    K.phase_factor = phase_factor
+
+    @numba.njit(parallel=True)
+    def interpolate_volume(volume, i_start, weights, out):
+        N_z, N_y, N_x = volume.shape
+        W = weights.shape[2]
+        for i in numba.prange(i_start.shape[0]):
+            F = 0.j
+            for jz in range(W):
+                iz = (i_start[i,0] + jz) % N_z
+                for jy in range(W):
+                    iy = (i_start[i,1] + jy) % N_y
+                    w_zy = weights[i,0,jz] * weights[i,1,jy]
+                    for jx in range(W):
+                        F += volume[iz, iy, (i_start[i,2] + jx) % N_x] * (w_zy * weights[i,2,jx])
+            out[i] = F
+    K.interpolate_volume = interpolate_volume
+
+    @numba.njit
+    def sort_rows(rows, perm, offsets):
+        # Counting sort, offsets[g] is the position in perm of the first point in row g
+        offsets[:] = 0
+        for i in range(rows.size):
+            offsets[rows[i] + 1] += 1
+        for g in range(offsets.size - 1):
+            offsets[g + 1] += offsets[g]
+        pos = offsets[:-1].copy()
+        for i in range(rows.size):
+            perm[pos[rows[i]]] = i
+            pos[rows[i]] += 1
+    K.sort_rows = sort_rows
+
+    @numba.njit(parallel=True)
+    def spread_moments(w, zeta, i_start, weights, perm, offsets, P):
+        G, _, n_k = P.shape
+        W = weights.shape[2]
+        # Stencils of points whose first rows are W rows apart do not overlap and are spread in parallel
+        for c in range(W):
+            for b in numba.prange((G - c + W - 1) // W):
+                g0 = c + b * W
+                w_k = numpy.empty(n_k, dtype=numpy.complex128)
+                for n in range(offsets[g0], offsets[g0 + 1]):
+                    i = perm[n]
+                    w_k[0] = w[i]
+                    for k in range(1, n_k):
+                        w_k[k] = w_k[k-1] * zeta[i] / k
+                    for jy in range(W):
+                        for jx in range(W):
+                            s = weights[i,1,jy] * weights[i,0,jx]
+                            for k in range(n_k):
+                                P[g0 + jy, i_start[i,0] + jx, k] += w_k[k] * s
+    K.spread_moments = spread_moments
+
+    @numba.njit(parallel=True)
+    def interpolate_grids(grids, i_start, weights, out):
+        n_l, G_y, G_x = grids.shape
+        W = weights.shape[2]
+        for i in numba.prange(i_start.shape[0]):
+            for l in range(n_l):
+                F = 0.j
+                for jy in range(W):
+                    iy = (i_start[i,1] + jy) % G_y
+                    for jx in range(W):
+                        F += grids[l, iy, (i_start[i,0] + jx) % G_x] * (weights[i,1,jy] * weights[i,0,jx])
+                out[l, i] = F
+    K.interpolate_grids = interpolate_grids
+
+    return K
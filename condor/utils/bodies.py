@@ -31,7 +31,7 @@
 # -----------------------------------------------------------------------------------------------------
 
 from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
-import numpy, sys, numpy, types, pickle, time, math
+import numpy, sys, numpy, types, pickle, time, math, os, threading, multiprocessing
 import condor.utils.icosahedron as icosahedron
 import condor.utils.linalg as linalg
  
@@ -40,37 +40,81 @@ logger = logging.getLogger(__name__)
 from .log import log_and_raise_error,log_warning,log_info,log_debug
 
 
-def make_sphere_map(N,nR):
+# Maximum number of voxels that are evaluated at once when a map is generated slab by slab
+SLAB_VOXELS = 2**20
+
+def _get_grid_coordinates(N):
+    # Voxel coordinates along one axis relative to the centre of the grid
+    return numpy.arange(N, dtype=numpy.float64) - (N-1)/2.
+
+def _get_bounding_range(c, r):
+    # Index range [i0, i1) of coordinates with |c| < r
+    i = numpy.where(abs(c) < r)[0]
+    if len(i) == 0:
+        return 0, 0
+    return i[0], i[-1]+1
+
+def _iter_slabs(i0, i1, n_per_slice, slab_voxels=None):
+    # Split the index range [i0, i1) of the first axis into slabs of at most slab_voxels voxels
+    if slab_voxels is None:
+        slab_voxels = SLAB_VOXELS
+    n = max(1, int(slab_voxels) // max(1, n_per_slice))
+    for j0 in range(i0, i1, n):
+        yield j0, min(j0+n, i1)
+
+def make_sphere_map(N,nR,dtype="float64",slab_voxels=None):
     """
     Generate a 3D map of a sphere particle on a regular grid (values between 0 and 1)
 
     The result is quite rough (i.e. linear interpolation)
 
+    The map is generated slab by slab from 1D coordinate vectors and only voxels within the bounding box of the sphere are evaluated. The peak memory consumption is therefore close to the size of the output map.
+
     Args:
       :N (int): Edge length of the grid in unit pixels
 
       :nR (float): Radius in unit pixels
 
+    Kwargs:
+      :dtype: Data type of the output map, e.g. ``'float32'`` for halving the memory footprint (default ``'float64'``)
+
+      :slab_voxels (int): Maximum number of voxels evaluated at once. If ``None`` the module default ``SLAB_VOXELS`` is used (default ``None``)
+
     .. note:: This function was written for testing purposes and generates a map with rough edges. Use :class:`condor.particle.particle_sphere.ParticleSphere` for more accurate uniform sphere diffraction simulations.
     """
-    X,Y,Z = 1.0*numpy.mgrid[0:N,0:N,0:N]
-    X = X-(N-1)/2.
-    Y = Y-(N-1)/2.
-    Z = Z-(N-1)/2.
-    R = numpy.sqrt(X**2+Y**2+Z**2)
-    spheremap = numpy.zeros(shape=R.shape,dtype="float64")
-    spheremap[R<=nR] = 1
-    # Linear interpolation at the transition
-    spheremap[abs(nR-R)<0.5] = 0.5+0.5*(nR-R[abs(nR-R)<0.5])
+    c = _get_grid_coordinates(N)
+    spheremap = numpy.zeros(shape=(N,N,N), dtype=dtype)
+    i0, i1 = _get_bounding_range(c, nR+0.5)
+    if i1 <= i0:
+        return spheremap
+    cb = c[i0:i1]
+    R_sq_yz = cb[:,numpy.newaxis]**2 + cb[numpy.newaxis,:]**2
+    # Squared radii (with a safety margin for rounding) below / above which voxels are fully inside / outside
+    R_sq_in = (nR-0.5)**2 * (1-1E-12) if nR > 0.5 else -1.
+    R_sq_out = (nR+0.5)**2 * (1+1E-12)
+    for j0, j1 in _iter_slabs(i0, i1, R_sq_yz.size, slab_voxels):
+        R_sq = c[j0:j1,numpy.newaxis,numpy.newaxis]**2 + R_sq_yz[numpy.newaxis,:,:]
+        s = spheremap[j0:j1,i0:i1,i0:i1]
+        s[R_sq <= R_sq_in] = 1
+        # Linear interpolation at the transition (only evaluated in the shell around the surface)
+        shell = (R_sq > R_sq_in) * (R_sq < R_sq_out)
+        R = numpy.sqrt(R_sq[shell])
+        v = numpy.zeros(shape=R.shape, dtype=numpy.float64)
+        v[R<=nR] = 1
+        t = abs(nR-R)<0.5
+        v[t] = 0.5+0.5*(nR-R[t])
+        s[shell] = v
     return spheremap
 
 
-def make_spheroid_map(N, nA, nC, rotation=None):
+def make_spheroid_map(N, nA, nC, rotation=None, dtype="float64", slab_voxels=None):
     """
     Generate a 3D binary map of a spheroid particle on a regular grid
 
     The result is very rough (i.e. nearest-neighbor interpolation)
 
+    The map is generated slab by slab from 1D coordinate vectors and only voxels within the bounding box of the spheroid are evaluated. The peak memory consumption is therefore close to the size of the output map.
+
     Args:
       :N (int): Edge length of the grid in unit pixels
 
@@ -82,29 +126,87 @@ def make_spheroid_map(N, nA, nC, rotation=None):
     
       :rotation (:class:`condor.utils.rotation.Rotation`): Rotation instance for extrinsic rotation of the icosahedron. 
 
+      :dtype: Data type of the output map, e.g. ``'float32'`` for halving the memory footprint (default ``'float64'``)
+
+      :slab_voxels (int): Maximum number of voxels evaluated at once. If ``None`` the module default ``SLAB_VOXELS`` is used (default ``None``)
+
     .. note:: This function was written for testing purposes and generates a map with rough edges. Use :class:`condor.particle.particle_spheroid.ParticleSpheroid` for more accurate uniform spheroid diffraction simulations.
     """
-    X,Y,Z = 1.0*numpy.mgrid[0:N,0:N,0:N]
-    X = X-(N-1)/2.
-    Y = Y-(N-1)/2.
-    Z = Z-(N-1)/2.
-    R_sq = X**2+Y**2+Z**2
+    c = _get_grid_coordinates(N)
+    spheroidmap = numpy.zeros(shape=(N,N,N), dtype=dtype)
+    # No voxel outside the circumscribed sphere can be inside the spheroid
+    i0, i1 = _get_bounding_range(c, max([nA, nC])*(1+1E-12))
+    if i1 <= i0:
+        return spheroidmap
+    cb = c[i0:i1]
     e_c = numpy.array([0.0,1.0,0.0])
     if rotation is not None:
         e_c = rotation.rotate_vector(e_c)
-    d_sq_c = ((X*e_c[0])+(Y*e_c[1])+(Z*e_c[2]))**2
-    r_sq_c = abs( R_sq * (1 - (d_sq_c/(R_sq+numpy.finfo("float32").eps))))
-    spheroidmap = r_sq_c/float(nA)**2+d_sq_c/float(nC)**2
-    spheroidmap[spheroidmap<=1] = 1
-    spheroidmap[spheroidmap>1] = 0
+    Y = cb[:,numpy.newaxis]
+    Z = cb[numpy.newaxis,:]
+    R_sq_yz = Y**2 + Z**2
+    d_c_yz = Y*e_c[1] + Z*e_c[2]
+    eps = numpy.finfo("float32").eps
+    for j0, j1 in _iter_slabs(i0, i1, R_sq_yz.size, slab_voxels):
+        X = c[j0:j1,numpy.newaxis,numpy.newaxis]
+        R_sq = X**2 + R_sq_yz[numpy.newaxis,:,:]
+        d_sq_c = ((X*e_c[0]) + d_c_yz[numpy.newaxis,:,:])**2
+        r_sq_c = abs( R_sq * (1 - (d_sq_c/(R_sq+eps))))
+        spheroidmap[j0:j1,i0:i1,i0:i1] = (r_sq_c/float(nA)**2+d_sq_c/float(nC)**2) <= 1
     return spheroidmap
 
-def make_icosahedron_map(N,nRmax,extrinsic_rotation=None):
+def make_cube_map(N, nel, dtype="float64", slab_voxels=None):
+    """
+    Generate a 3D map of a cube on a regular grid (values between 0 and 1)
+
+    The faces of the cube are parallel to the grid axes. Voxels within half a pixel of a face are linearly interpolated. The map is generated slab by slab from 1D coordinate vectors and the peak memory consumption is therefore close to the size of the output map.
+
+    Args:
+      :N (int): Edge length of the grid in unit pixels
+
+      :nel (float): Edge length of the cube in unit pixels
+
+    Kwargs:
+      :dtype: Data type of the output map, e.g. ``'float32'`` for halving the memory footprint (default ``'float64'``)
+
+      :slab_voxels (int): Maximum number of voxels evaluated at once. If ``None`` the module default ``SLAB_VOXELS`` is used (default ``None``)
+    """
+    c = _get_grid_coordinates(N)
+    cubemap = numpy.zeros(shape=(N,N,N), dtype=dtype)
+    i0, i1 = _get_bounding_range(c, nel/2.+0.5)
+    if i1 <= i0:
+        return cubemap
+    cb = abs(c[i0:i1])
+    # Distance to the surface (negative inside) is given by the maximum norm
+    D_yz = numpy.maximum(cb[:,numpy.newaxis], cb[numpy.newaxis,:]) - nel/2.
+    for j0, j1 in _iter_slabs(i0, i1, D_yz.size, slab_voxels):
+        D = numpy.maximum(abs(c[j0:j1,numpy.newaxis,numpy.newaxis]) - nel/2., D_yz[numpy.newaxis,:,:])
+        cubemap[j0:j1,i0:i1,i0:i1] = numpy.clip(0.5-D, 0., 1.)
+    return cubemap
+
+def get_default_n_threads():
+    """
+    Return the default number of threads for map generation (value of the environment variable ``OMP_NUM_THREADS`` if set, otherwise the number of CPUs)
+    """
+    n = os.environ.get("OMP_NUM_THREADS")
+    if n is not None:
+        try:
+            return max(1, int(n))
+        except ValueError:
+            log_warning(logger, "Cannot interpret OMP_NUM_THREADS=%s as number of threads." % n)
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def make_icosahedron_map(N,nRmax,extrinsic_rotation=None,supersampling=1,out=None,dtype="float64",n_threads=None):
     """
     Generate map of a uniform icosahedron (density = 1) on a regular grid
 
     Orientation: The cartesian grid axis all lie parallel to 2-fold symmetry axes of the icosahedron.
 
+    The map is computed by the C extension :mod:`condor.utils.icosahedron`, which releases the global interpreter lock. The slices of the grid are split among ``n_threads`` threads.
+
     Args:
       :N (int): Edge length of the grid in unit pixels
 
@@ -112,18 +214,45 @@ def make_icosahedron_map(N,nRmax,extrinsic_rotation=None):
 
     Kwargs:
       :rotation (:class:`condor.utils.rotation.Rotation`): Rotation instance for extrinsic rotation of the icosahedron. 
+
+      :supersampling (int): If ``1`` voxels at the surface are linearly interpolated across one voxel. If ``k > 1`` voxels at the surface are assigned the fraction of ``k x k x k`` sample points that lie inside the icosahedron (partial-volume values) (default ``1``)
+
+      :out (array): C-contiguous float32 or float64 array of shape ``(N, N, N)`` into which the map is written. If ``None`` a new array of type ``dtype`` is allocated (default ``None``)
+
+      :dtype: Data type of the output map if ``out`` is ``None`` (default ``'float64'``)
+
+      :n_threads (int): Number of threads. If ``None`` the value returned by :func:`get_default_n_threads` is used (default ``None``)
     """
     log_debug(logger, "Building icosahedral geometry")
     log_debug(logger, "Grid: %i x %i x %i (%i voxels)" % (N,N,N,N**3))
     t0 = time.time()
-    if extrinsic_rotation is not None:
-        q = extrinsic_rotation.get_as_quaternion()
-        icomap = icosahedron.icosahedron(N,nRmax,q)
+    if out is None:
+        out = numpy.zeros(shape=(N,N,N), dtype=dtype)
+    q = extrinsic_rotation.get_as_quaternion() if extrinsic_rotation is not None else None
+    if n_threads is None:
+        n_threads = get_default_n_threads()
+    n_threads = max(1, min(int(n_threads), N))
+    # Split the grid in slabs of slices along the first axis
+    z = numpy.linspace(0, N, n_threads+1).round().astype(int)
+    if n_threads == 1:
+        icosahedron.icosahedron(N,nRmax,q,out,supersampling)
     else:
-        icomap = icosahedron.icosahedron(N,nRmax)
+        errors = []
+        def _fill(z_start, z_stop):
+            try:
+                icosahedron.icosahedron(N,nRmax,q,out,supersampling,z_start,z_stop)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=_fill, args=(int(z[i]),int(z[i+1]))) for i in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if len(errors) > 0:
+            raise errors[0]
     t1 = time.time()
     log_debug(logger, "Built map within %f seconds." % (t1-t0))
-    return icomap
+    return out
 
 def make_icosahedron_map_slow(N,nRmax,extrinsic_rotation=None):
     """
@@ -0,0 +1,397 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+"""
+Bounded in-memory caches and a persistent on-disk cache of arrays
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import os
+import collections
+import hashlib
+import tempfile
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+
+def get_nbytes(value):
+    """
+    Return the number of bytes held by the NumPy arrays in a value (arrays may be nested in tuples, lists and dictionaries)
+
+    Views of other arrays (e.g. arrays returned by :func:`numpy.broadcast_to`) are counted with the size of their base array.
+
+    Args:
+      :value: Value to be measured
+    """
+    if isinstance(value, numpy.ndarray):
+        while value.base is not None and isinstance(value.base, numpy.ndarray):
+            value = value.base
+        return value.nbytes
+    elif isinstance(value, dict):
+        return sum([get_nbytes(v) for v in value.values()])
+    elif isinstance(value, (tuple, list)):
+        return sum([get_nbytes(v) for v in value])
+    else:
+        return 0
+
+
+class LRUCache:
+    """
+    Cache that discards the least recently used entries when the number of entries or the total size of the cached arrays exceeds a limit
+
+    .. code-block:: python
+
+      C = condor.utils.cache.LRUCache(max_entries=8, max_bytes=1E9)
+      C.put(key, m)
+      m = C.get(key)    # None if the key is not (or no longer) cached
+
+    Kwargs:
+      :max_entries (int): Maximum number of entries. If ``None`` the number of entries is not limited (default ``None``)
+
+      :max_bytes (int): Maximum total size of the cached arrays in unit bytes (see :func:`get_nbytes`). A single entry that exceeds the limit is not cached. If ``None`` the size is not limited (default ``None``)
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        self._entries = collections.OrderedDict()
+        self.set_limits(max_entries=max_entries, max_bytes=max_bytes)
+        self.clear()
+
+    def set_limits(self, max_entries=None, max_bytes=None):
+        """
+        Set the limits of the cache and discard entries that exceed the new limits
+
+        Kwargs:
+          :max_entries (int): Maximum number of entries (default ``None``)
+
+          :max_bytes (int): Maximum total size of the cached arrays in unit bytes (default ``None``)
+        """
+        if max_entries is not None and max_entries < 0:
+            log_and_raise_error(logger, "Invalid maximum number of cache entries (%i)." % max_entries)
+            return
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._shrink()
+
+    def clear(self):
+        """
+        Discard all entries and reset the statistics
+        """
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        """
+        Return the list of keys from the least to the most recently used entry
+        """
+        return list(self._entries.keys())
+
+    def peek(self, key):
+        """
+        Return the cached value of the given key (``None`` if not cached) without counting the access and without changing the order of the entries
+
+        Args:
+          :key: Key of the entry
+        """
+        e = self._entries.get(key)
+        return None if e is None else e[0]
+
+    def get(self, key):
+        """
+        Return the cached value of the given key (``None`` if not cached) and mark the entry as most recently used
+
+        Args:
+          :key: Key of the entry
+        """
+        e = self._entries.get(key)
+        if e is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Move to the end of the order (most recently used)
+        del self._entries[key]
+        self._entries[key] = e
+        return e[0]
+
+    def find(self, match):
+        """
+        Return the tuple of key and value of the most recently used entry whose key satisfies a condition (``(None, None)`` if there is no such entry) and mark the entry as most recently used
+
+        Args:
+          :match: Function that takes a key and returns ``True`` if the entry is acceptable
+        """
+        for key in reversed(self.keys()):
+            if match(key):
+                return key, self.get(key)
+        self.misses += 1
+        return None, None
+
+    def put(self, key, value, nbytes=None):
+        """
+        Add an entry to the cache (an existing entry with the same key is replaced)
+
+        Args:
+          :key: Key of the entry
+
+          :value: Value to be cached
+
+        Kwargs:
+          :nbytes (int): Size of the entry in unit bytes. If ``None`` the size is determined with :func:`get_nbytes` (default ``None``)
+        """
+        if nbytes is None:
+            nbytes = get_nbytes(value)
+        self.pop(key)
+        if (self.max_bytes is not None and nbytes > self.max_bytes) or self.max_entries == 0:
+            log_debug(logger, "Entry of %i bytes is not cached because it exceeds the cache limits." % nbytes)
+            return
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self._shrink()
+
+    def pop(self, key):
+        """
+        Remove an entry from the cache and return its value (``None`` if not cached)
+
+        Args:
+          :key: Key of the entry
+        """
+        e = self._entries.pop(key, None)
+        if e is None:
+            return None
+        self.nbytes -= e[1]
+        return e[0]
+
+    def _shrink(self):
+        while len(self._entries) > 0 and \
+              ((self.max_entries is not None and len(self._entries) > self.max_entries) or \
+               (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            key, e = self._entries.popitem(last=False)
+            self.nbytes -= e[1]
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+        Return the statistics of the cache in form of a dictionary with the keys ``'entries'``, ``'nbytes'``, ``'max_entries'``, ``'max_bytes'``, ``'hits'``, ``'misses'`` and ``'evictions'``
+        """
+        return {
+            "entries"     : len(self._entries),
+            "nbytes"      : self.nbytes,
+            "max_entries" : self.max_entries,
+            "max_bytes"   : self.max_bytes,
+            "hits"        : self.hits,
+            "misses"      : self.misses,
+            "evictions"   : self.evictions,
+        }
+
+
+def get_content_key(*parts):
+    """
+    Return a key (hexadecimal SHA-256 digest) that identifies the content of the given parts
+
+    Arrays are identified by their data type, shape and values (arrays that are equal element by element have the same key irrespective of their memory layout). Other parts are identified by their representation (:func:`repr`), tuples and lists element by element.
+
+    Args:
+      :parts: Arrays, numbers, strings, tuples or lists
+    """
+    h = hashlib.sha256()
+    def update_data(a):
+        if a.ndim == 0:
+            h.update(a.tobytes())
+        elif a.flags.c_contiguous or a.ndim == 1:
+            h.update(numpy.ascontiguousarray(a).data)
+        else:
+            # Sub-arrays avoid a full copy of (e.g. broadcast) arrays
+            for a_i in a:
+                update_data(a_i)
+    def update(part):
+        if isinstance(part, numpy.ndarray):
+            h.update(("array%s%s" % (part.dtype.str, str(part.shape))).encode("utf-8"))
+            update_data(part)
+        elif isinstance(part, (tuple, list)):
+            h.update(("seq%i(" % len(part)).encode("utf-8"))
+            for p in part:
+                update(p)
+            h.update(b")")
+        else:
+            h.update(("%s:%s;" % (type(part).__name__, repr(part))).encode("utf-8"))
+    for part in parts:
+        update(part)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed cache of arrays in a directory on disk
+
+    Every entry is stored as a NumPy file (``<key>.npy``). Entries are written to a temporary file first and then renamed, so that concurrent processes never read incomplete entries. Entries are read as read-only memory maps, hence processes on one node that read the same entry share one copy of the data through the page cache of the operating system. The cache is not limited in size, entries can be removed at any time (e.g. with :meth:`clear`).
+
+    .. code-block:: python
+
+      C = condor.utils.cache.DiskCache("/scratch/condor_cache")
+      key = condor.utils.cache.get_content_key("volume", m, oversampling)
+      V = C.get(key)    # None if the key is not cached
+      if V is None:
+          V = C.put(key, calculate_volume(m, oversampling))
+
+    Kwargs:
+      :path (str): Directory of the cache. It is created if it does not exist. If ``None`` the cache is disabled, i.e. nothing is stored and :meth:`get` always returns ``None`` (default ``None``)
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def is_enabled(self):
+        """
+        Return ``True`` if the cache has a directory, ``False`` otherwise
+        """
+        return self.path is not None
+
+    def _get_filename(self, key):
+        return os.path.join(self.path, "%s.npy" % key)
+
+    def get(self, key):
+        """
+        Return the cached array of the given key as read-only memory map (``None`` if the key is not cached or the cache is disabled)
+
+        Args:
+          :key (str): Key of the entry (see :func:`get_content_key`)
+        """
+        if not self.is_enabled():
+            return None
+        filename = self._get_filename(key)
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+        try:
+            a = numpy.load(filename, mmap_mode="r")
+        except (IOError, OSError, ValueError) as e:
+            log_warning(logger, "Cannot read cache entry %s (%s)." % (filename, str(e)))
+            self.misses += 1
+            return None
+        log_debug(logger, "Read array of shape %s from cache entry %s." % (str(a.shape), filename))
+        self.hits += 1
+        return a
+
+    def put(self, key, a):
+        """
+        Write an array to the cache and return it as read-only memory map of the written entry (the array itself if the cache is disabled or the entry cannot be written)
+
+        Args:
+          :key (str): Key of the entry (see :func:`get_content_key`)
+
+          :a (array): Array to be cached
+        """
+        if not self.is_enabled():
+            return a
+        filename = self._get_filename(key)
+        tmp = None
+        try:
+            if not os.path.isdir(self.path):
+                try:
+                    os.makedirs(self.path)
+                except OSError:
+                    # Created concurrently by another process?
+                    if not os.path.isdir(self.path):
+                        raise
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".%s." % key, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                numpy.save(f, numpy.asarray(a))
+                f.flush()
+                os.fsync(f.fileno())
+            # Atomic on POSIX systems, an entry that was written concurrently with the same key has the same content
+            getattr(os, "replace", os.rename)(tmp, filename)
+            tmp = None
+        except (IOError, OSError) as e:
+            log_warning(logger, "Cannot write cache entry %s (%s)." % (filename, str(e)))
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return a
+        self.writes += 1
+        log_debug(logger, "Wrote array of shape %s to cache entry %s." % (str(numpy.shape(a)), filename))
+        return numpy.load(filename, mmap_mode="r")
+
+    def clear(self):
+        """
+        Remove all entries from the cache directory and reset the statistics
+        """
+        if self.is_enabled() and os.path.isdir(self.path):
+            for fn in os.listdir(self.path):
+                if fn.endswith(".npy"):
+                    os.remove(os.path.join(self.path, fn))
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get_stats(self):
+        """
+        Return the statistics of the cache in form of a dictionary with the keys ``'path'``, ``'hits'``, ``'misses'`` and ``'writes'``
+        """
+        return {
+            "path"   : self.path,
+            "hits"   : self.hits,
+            "misses" : self.misses,
+            "writes" : self.writes,
+        }
+
+_disk_cache = None
+
+def get_disk_cache():
+    """
+    Return the disk cache that is used for Fourier volumes and resampled maps (see :class:`DiskCache`)
+
+    Unless set by :func:`set_disk_cache_dir` the directory is given by the environment variable ``CONDOR_CACHE_DIR``. If the variable is not set the disk cache is disabled.
+    """
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = DiskCache(os.environ.get("CONDOR_CACHE_DIR") or None)
+    return _disk_cache
+
+def set_disk_cache_dir(path):
+    """
+    Set the directory of the disk cache (see :func:`get_disk_cache`)
+
+    Args:
+      :path (str): Directory of the cache. If ``None`` the disk cache is disabled
+    """
+    global _disk_cache
+    _disk_cache = DiskCache(path)
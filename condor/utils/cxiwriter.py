@@ -42,8 +42,10 @@ try:
 except ImportError:
     log_warning(logger, "Could not import h5py.")
 
+from .metrics import _NULL_STAGE
+
 class CXIWriter:
-    def __init__(self, filename, chunksize=2, gzip_compression=False):
+    def __init__(self, filename, chunksize=2, gzip_compression=False, metrics=None):
         self._filename = os.path.expandvars(filename)
         if os.path.exists(filename):
             log_warning(logger, "File %s exists and is being overwritten" % filename)
@@ -53,10 +55,14 @@ class CXIWriter:
         self._create_dataset_kwargs = {}
         if gzip_compression:
             self._create_dataset_kwargs["compression"] = "gzip"
+        # Optional condor.utils.metrics.Metrics instance for timing the write stage
+        self._metrics = metrics
+        self._bytes_written = 0
 
     def write(self, D):
-        self._write_without_iterate(D)
-        self._f.flush()
+        with (self._metrics.stage("write") if self._metrics is not None else _NULL_STAGE):
+            self._write_without_iterate(D)
+            self._f.flush()
         self._i += 1
         
     def _write_without_iterate(self, D, group_prefix="/"):
@@ -111,8 +117,19 @@ class CXIWriter:
                 log_debug(logger, "Write to dataset %s at stack position %i" % (name, self._i))
                 if numpy.isscalar(data):
                     self._f[name][self._i] = data
+                    nbytes = self._f[name].dtype.itemsize
                 else:
                     self._f[name][self._i,:] = data[:]
+                    nbytes = data.nbytes
+                self._bytes_written += nbytes
+                if self._metrics is not None:
+                    self._metrics.increment("bytes_written", nbytes)
+
+    def get_bytes_written(self):
+        """
+        Return the number of bytes (before compression) that have been written to the file so far
+        """
+        return self._bytes_written
 
     def _shrink_stacks(self, group_prefix="/"):
         for k in self._f[group_prefix].keys():
@@ -32,6 +32,8 @@
 
 from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
 import numpy, math
+
+from . import backend
  
 def crystallographic_resolution(wavelength, pixel_center_distance, detector_distance):
     r"""
@@ -124,6 +126,8 @@ def polarization_factor(x, y, detector_distance, polarization="ignore"):
         return
     if polarization == "ignore":
         P = 1.
+    elif backend.get_kernels() is not None:
+        P = backend.polarization_factor(x, y, detector_distance, polarization)
     else:
         r = numpy.sqrt(x**2 + y**2 + detector_distance**2)
         if polarization == "vertical":
@@ -0,0 +1,248 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+r"""
+Precomputed 3D Fourier volumes of maps
+
+The Fourier transform of a map (as evaluated by :func:`condor.utils.nfft.nfft`) is computed once on an oversampled regular grid with a plain FFT of the zero-padded map. Fourier amplitudes at arbitrary positions (e.g. on the rotated Ewald sphere of every shot) are then obtained by interpolation from the grid, which costs only a fixed number of operations per position.
+
+The interpolation uses the same scheme as non-equispaced FFT algorithms: the map is divided in real space by the Fourier transform of the interpolation kernel (deapodisation) before the FFT is taken, so that the convolution with the kernel in Fourier space is compensated exactly up to aliasing. With a Kaiser-Bessel kernel the error decreases exponentially with the product of kernel width and oversampling factor (relative errors of about :math:`10^{-3}` for a width of 4 voxels and :math:`10^{-5}` for a width of 6 voxels at oversampling 2). The linear kernel corresponds to trilinear interpolation of the deapodised volume, its error decreases only quadratically with the oversampling factor (about :math:`3 \cdot 10^{-2}` at oversampling 2).
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+import condor.utils.backend
+import condor.utils.cache
+import condor.utils.symmetry
+
+KERNELS = ["kaiser_bessel", "linear"]
+
+# Default oversampling factor of the Fourier volume with respect to the map
+OVERSAMPLING = 2.
+# Default width of the Kaiser-Bessel kernel in unit voxels of the Fourier volume
+KERNEL_WIDTH = 4
+# Samples per unit voxel of the tabulated Kaiser-Bessel kernel
+KERNEL_TABLE_SAMPLES = 4096
+# Maximum number of positions that are interpolated at once
+CHUNK_SIZE = 65536
+# Number of directions that are sampled for the bounding box of the asymmetric unit of a point group
+ASYMMETRIC_UNIT_SAMPLES = 20000
+
+def get_kaiser_bessel_beta(width, oversampling):
+    """
+    Return the shape parameter of the Kaiser-Bessel kernel for the given width and oversampling factor (Beatty et al., IEEE Trans. Med. Imaging 24, 799 (2005))
+
+    Args:
+      :width (int): Kernel width in unit voxels of the oversampled grid
+
+      :oversampling (float): Oversampling factor
+    """
+    return numpy.pi * numpy.sqrt(max((width/oversampling)**2 * (oversampling-0.5)**2 - 0.8, 0.))
+
+def _kernel(u, kernel, width, beta):
+    # Interpolation kernel as a function of the distance u in unit voxels
+    if kernel == "linear":
+        return numpy.clip(1. - abs(u), 0., None)
+    t = 1. - (2.*u/width)**2
+    w = numpy.zeros(numpy.shape(u))
+    valid = t >= 0.
+    w[valid] = numpy.i0(beta*numpy.sqrt(t[valid])) / numpy.i0(beta)
+    return w
+
+def _kernel_fourier(nu, kernel, width, beta, n_nodes=256):
+    # Fourier transform of the kernel at frequencies nu (in unit cycles per voxel) by Gauss-Legendre quadrature
+    x, w = numpy.polynomial.legendre.leggauss(n_nodes)
+    h = 1. if kernel == "linear" else width/2.
+    u = x*h
+    phi = _kernel(u, kernel, width, beta) * w * h
+    return numpy.cos(2*numpy.pi*numpy.outer(nu, u)).dot(phi)
+
+def _get_kernel_table(kernel, width, beta):
+    # Kernel sampled at KERNEL_TABLE_SAMPLES points per unit voxel (padded with zeros)
+    n_table = int(width/2.*KERNEL_TABLE_SAMPLES)
+    table = numpy.zeros(n_table + 2)
+    table[:n_table+1] = _kernel(numpy.arange(n_table + 1) / float(KERNEL_TABLE_SAMPLES), kernel, width, beta)
+    return table
+
+def _lookup_kernel(table, u):
+    # Kernel at distances u (in unit voxels) by linear interpolation of the tabulated kernel
+    t = abs(u) * KERNEL_TABLE_SAMPLES
+    i_t = numpy.minimum(t.astype(numpy.int64), table.size - 2)
+    t -= i_t
+    return table[i_t] * (1. - t) + table[i_t + 1] * t
+
+def _get_stencils(u, table, width):
+    # First index of the stencils and stencil weights of positions u (in unit voxels) along every dimension
+    i_start = numpy.floor(u - width/2.).astype(numpy.int64) + 1
+    weights = _lookup_kernel(table, u[...,numpy.newaxis] - (i_start[...,numpy.newaxis] + numpy.arange(width)))
+    return i_start, weights
+
+def _fft_padded(a, axis, N_os, keep):
+    # FFT along one axis of the array zero-padded to N_os samples (origin at index N//2 of the input and at index N_os//2 of the output), only the output samples with the given indices are returned
+    N = a.shape[axis]
+    shape = list(a.shape)
+    shape[axis] = N_os
+    p = numpy.zeros(shape=shape, dtype=numpy.complex128)
+    numpy.moveaxis(p, axis, 0)[(numpy.arange(N) - N//2) % N_os] = numpy.moveaxis(a, axis, 0)
+    p = numpy.fft.fft(p, axis=axis)
+    return numpy.take(p, (keep - N_os//2) % N_os, axis=axis)
+
+def _fibonacci_sphere(n):
+    # Approximately uniformly distributed unit vectors (x, y, z)
+    i = numpy.arange(n) + 0.5
+    z = 1. - 2.*i/n
+    r = numpy.sqrt(1. - z**2)
+    a = numpy.pi * (3. - numpy.sqrt(5.)) * i
+    return numpy.array([r*numpy.cos(a), r*numpy.sin(a), z]).T
+
+
+class FourierVolume:
+    r"""
+    Oversampled 3D Fourier transform of a map for fast evaluation at arbitrary positions
+
+    :meth:`interpolate` returns (up to the interpolation error) the same values as :func:`condor.utils.nfft.nfft` for the same map and coordinates, i.e. :math:`F(\vec{c}) = \sum_{\vec{n}} m_{\vec{n}} \exp(-2\pi i\,\vec{c} \cdot (\vec{n} - \vec{N}/2))` with the coordinates :math:`\vec{c}` in unit of the inverse edge length of a voxel. The transform is periodic in every coordinate with period 1.
+
+    If the map has the symmetry of a point group only the bounding box of the asymmetric unit (see :mod:`condor.utils.symmetry`) of the sphere :math:`|\vec{c}| \leq 1/2` is calculated and stored. The coordinates are mapped to their symmetry equivalents :math:`g\vec{c}` in the asymmetric unit before the interpolation. The centre of symmetry :math:`\vec{s}` is the centroid of the map (e.g. the centre of the array for maps of even size), hence :math:`F(\vec{c}) = \exp(2\pi i\,(g\vec{c} - \vec{c}) \cdot \vec{s}) F(g\vec{c})`. The transform is evaluated correctly only within the sphere. Maps on a cubic grid have the full symmetry only for groups that map the grid onto itself (e.g. ``'O'`` for a cube, ``'D2'`` for a spheroid along a grid axis). The voxelisation of an icosahedron breaks the 3- and 5-fold symmetries, and the transform obtained with ``'I'`` differs from the one of the full map by a relative root-mean-square error of typically 1 to 3% (maps of 48 to 96 voxels).
+
+    Args:
+      :map3d (array): Cubic 3D map (real or complex)
+
+    Kwargs:
+      :oversampling (float): Oversampling factor of the Fourier volume with respect to the map (default ``OVERSAMPLING``)
+
+      :kernel (str): Interpolation kernel, either ``'kaiser_bessel'`` or ``'linear'`` (default ``'kaiser_bessel'``)
+
+      :width (int): Width of the Kaiser-Bessel kernel in unit voxels of the Fourier volume (default ``KERNEL_WIDTH``)
+
+      :disk_cache: If not ``None`` the volume is read from or written to this :class:`condor.utils.cache.DiskCache` instance. Entries are identified by the content of the map and the parameters of the volume (default ``None``)
+
+      :point_group (str): Point group of the map (rotation axes in the frame of the map, see :mod:`condor.utils.symmetry`). If ``None`` the full volume is calculated (default ``None``)
+    """
+    def __init__(self, map3d, oversampling=OVERSAMPLING, kernel="kaiser_bessel", width=KERNEL_WIDTH, disk_cache=None, point_group=None):
+        if kernel not in KERNELS:
+            log_and_raise_error(logger, "Kernel %s is invalid. Choose one of the following: %s." % (kernel, ", ".join(KERNELS)))
+            return
+        if oversampling < 1.:
+            log_and_raise_error(logger, "Oversampling factor must be >= 1.")
+            return
+        map3d = numpy.asarray(map3d)
+        if map3d.ndim != 3 or numpy.any(numpy.array(map3d.shape) != map3d.shape[0]):
+            log_and_raise_error(logger, "The map has to be a cubic 3D array. Current shape is: %s" % str(map3d.shape))
+            return
+        self.kernel = kernel
+        self.width = 2 if kernel == "linear" else int(width)
+        self.oversampling = oversampling
+        N = map3d.shape[0]
+        N_os = int(numpy.ceil(N*oversampling))
+        N_os += N_os % 2
+        self.N = N
+        self.N_os = N_os
+        self.beta = get_kaiser_bessel_beta(self.width, float(N_os)/N)
+        # Tabulated kernel for the evaluation of the stencil weights (linear interpolation between samples)
+        self._table = _get_kernel_table(self.kernel, self.width, self.beta)
+        # Range of stored indices along every axis
+        self.point_group = point_group
+        if point_group is None:
+            self.box = [(0, N_os)]*3
+        else:
+            self.box = self._get_asymmetric_unit_box()
+            # Centre of symmetry (centroid of the map) relative to the origin at index N//2
+            w = abs(map3d)
+            n = numpy.arange(N) - N//2
+            self.centre = numpy.array([w.sum(axis=(1,2)).dot(n), w.sum(axis=(0,2)).dot(n), w.sum(axis=(0,1)).dot(n)]) / w.sum()
+        key = None
+        if disk_cache is not None and disk_cache.is_enabled():
+            key = condor.utils.cache.get_content_key("fourier_volume", map3d, N_os, self.kernel, self.width, self.box)
+            self.volume = disk_cache.get(key)
+            if self.volume is not None:
+                return
+        self.volume = self._calculate_volume(map3d)
+        if key is not None:
+            self.volume = disk_cache.put(key, self.volume)
+        log_debug(logger, "Fourier volume of %i x %i x %i voxels computed from map of %i x %i x %i voxels." % (self.volume.shape + (N, N, N)))
+
+    def _calculate_volume(self, map3d):
+        N = self.N
+        N_os = self.N_os
+        # Deapodisation (positions relative to the origin at index N//2 in unit cycles of the oversampled grid)
+        n = numpy.arange(N) - N//2
+        d = 1. / _kernel_fourier(n/float(N_os), self.kernel, self.width, self.beta)
+        V = map3d * (d[:,numpy.newaxis,numpy.newaxis] * d[numpy.newaxis,:,numpy.newaxis] * d[numpy.newaxis,numpy.newaxis,:])
+        # Zero padding and FFT axis by axis, transforms of lines that are zero or outside the stored range are skipped
+        for axis in [2, 1, 0]:
+            V = _fft_padded(V, axis, N_os, numpy.arange(*self.box[axis]))
+        return numpy.ascontiguousarray(V)
+
+    def _get_asymmetric_unit_box(self):
+        # Bounding box of the asymmetric unit of the sphere |c| <= 1/2 (sampled on the surface, the cone also contains the origin)
+        n = ASYMMETRIC_UNIT_SAMPLES
+        c = condor.utils.symmetry.fold_vectors(0.5 * _fibonacci_sphere(n)[:,::-1], self.point_group, order="zyx")
+        # Margin for the sampling of the surface and the stencil
+        margin = 0.5 * numpy.sqrt(4*numpy.pi/n) * self.N_os + self.width/2. + 1
+        lo = numpy.minimum(c.min(axis=0), 0.) * self.N_os + self.N_os//2 - margin
+        hi = numpy.maximum(c.max(axis=0), 0.) * self.N_os + self.N_os//2 + margin
+        return [(max(int(numpy.floor(l)), 0), min(int(numpy.ceil(h)) + 1, self.N_os)) for l, h in zip(lo, hi)]
+
+    def get_nbytes(self):
+        """
+        Return the size of the Fourier volume in unit bytes
+        """
+        return self.volume.nbytes
+
+    def interpolate(self, coordinates):
+        """
+        Return the Fourier transform of the map at the given coordinates
+
+        Args:
+          :coordinates (array): Coordinates (in the same order as the axes of the map) along the last dimension in unit of the inverse edge length of a voxel (the range ``[-0.5, 0.5)`` covers one period)
+        """
+        c = numpy.asarray(coordinates, dtype=numpy.float64)
+        shape = c.shape[:-1]
+        c = c.reshape(-1, 3)
+        out = numpy.empty(c.shape[0], dtype=numpy.complex128)
+        W = self.width
+        for i0 in range(0, c.shape[0], CHUNK_SIZE):
+            i1 = min(i0 + CHUNK_SIZE, c.shape[0])
+            # Fractional indices in the Fourier volume
+            c_i = c[i0:i1]
+            if self.point_group is not None:
+                c_i = condor.utils.symmetry.fold_vectors(c_i, self.point_group, order="zyx")
+            u = c_i * self.N_os + self.N_os//2 - numpy.array([b[0] for b in self.box])
+            i_start, weights = _get_stencils(u, self._table, W)
+            condor.utils.backend.interpolate_volume(self.volume, i_start, weights, out=out[i0:i1])
+            if self.point_group is not None:
+                out[i0:i1] *= numpy.exp(2j*numpy.pi*(c_i - c[i0:i1]).dot(self.centre))
+        return out.reshape(shape)
@@ -3,81 +3,23 @@
 #include <math.h>
 #include <stdio.h>
 
-PyDoc_STRVAR(icosahedron__doc__, "icosahedron(array_side, radius, rotation)\n\nGenerate an icosahedron. Radius is given in pixels and is defined as the distance to the corners. Rotation should be tuple of quaternions (w,x,y,z)");
-static PyObject *icosahedron(PyObject *self, PyObject *args, PyObject *kwargs)
-{
-  int image_side = 0.;
-  double radius = 0.;
-  PyObject *rotation_obj = NULL;
-  PyObject *rotation_sequence;
-
-  static char *kwlist[] = {"array_side", "radius", "rotation", NULL};
-  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "id|O", kwlist, &image_side, &radius, &rotation_obj)) {
-    PyErr_SetString(PyExc_ValueError, "Invalid input for iscoahedron.");
-    return NULL;
-  }
-
-  if (image_side <= 0) {
-    PyErr_SetString(PyExc_ValueError, "Image side must be > 0.");
-    return NULL;
-  }
-
-  if (radius <= 0.) {
-    PyErr_SetString(PyExc_ValueError, "Radius must be > 0.");
-    return NULL;
-  }
-
-  double rotm_11, rotm_12, rotm_13;
-  double rotm_21, rotm_22, rotm_23;
-  double rotm_31, rotm_32, rotm_33;
+typedef struct {
+  double rotm[3][3];
   int rotate;
-  if (rotation_obj == NULL) {
-    rotate = 0;
-  } else {
-    rotate = 1;
-    rotation_sequence = PySequence_Fast(rotation_obj, "Expected a sequence");
-    
-    long length = PySequence_Size(rotation_sequence);
-    if (length != 3 && length != 4) {
-      PyErr_SetString(PyExc_ValueError, "Rotation must be of length 4 (quaternion)");
-      return NULL;
-    }
-
-    PyObject *seq_1 = PySequence_Fast_GET_ITEM(rotation_sequence, 0);
-    PyObject *seq_2 = PySequence_Fast_GET_ITEM(rotation_sequence, 1);
-    PyObject *seq_3 = PySequence_Fast_GET_ITEM(rotation_sequence, 2);
-    PyObject *seq_4 = PySequence_Fast_GET_ITEM(rotation_sequence, 3);
-    double quat_1 = PyFloat_AsDouble(seq_1);
-    double quat_2 = PyFloat_AsDouble(seq_2);
-    double quat_3 = PyFloat_AsDouble(seq_3);
-    double quat_4 = PyFloat_AsDouble(seq_4);
-      
-    double quaternion_norm = sqrt(pow(quat_1, 2) + pow(quat_2, 2) + pow(quat_3, 2) + pow(quat_4, 2));
-    quat_1 /= quaternion_norm;
-    quat_2 /= quaternion_norm;
-    quat_3 /= quaternion_norm;
-    quat_4 /= quaternion_norm;
-    
-    rotm_11 = quat_1*quat_1 + quat_2*quat_2 - quat_3*quat_3 - quat_4*quat_4;
-    rotm_12 = 2.*quat_2*quat_3 - 2.*quat_1*quat_4;
-    rotm_13 = 2.*quat_2*quat_4 + 2.*quat_1*quat_3;
-      
-    rotm_21 = 2.*quat_2*quat_3 + 2.*quat_1*quat_4;
-    rotm_22 = quat_1*quat_1 - quat_2*quat_2 + quat_3*quat_3 - quat_4*quat_4;
-    rotm_23 = 2.*quat_3*quat_4 - 2.*quat_1*quat_2;
+  double center_x, center_y, center_z;
+  double normal1_x, normal1_y, normal1_z;
+  double normal2_x, normal2_y, normal2_z;
+  double normal3_x, normal3_y, normal3_z;
+  double edge_distance;
+  double face_normal_1[3], face_normal_2[3], face_normal_3[3], face_normal_center[3];
+  double face_distance;
+  double edge_thickness, half_edge_thickness;
+} icosahedron_geometry;
 
-    rotm_31 = 2.*quat_2*quat_4 - 2.*quat_1*quat_3;
-    rotm_32 = 2.*quat_3*quat_4 + 2.*quat_1*quat_2;
-    rotm_33 = quat_1*quat_1 - quat_2*quat_2 - quat_3*quat_3 + quat_4*quat_4;
-  }
-
-  npy_intp out_dim[] = {image_side, image_side, image_side};
-  PyObject *out_array = (PyObject *)PyArray_SimpleNew(3, out_dim, NPY_FLOAT64);
-  double *out = PyArray_DATA(out_array);
-
-  //double edge_thickness = 1./image_side;
-  double edge_thickness = 1.;
-  double half_edge_thickness = edge_thickness/2.;
+static void icosahedron_init_geometry(icosahedron_geometry *g, double radius)
+{
+  g->edge_thickness = 1.;
+  g->half_edge_thickness = g->edge_thickness/2.;
   const double phi = (1.+sqrt(5.))/2.; //golden ratio
 
   double corner1[] = {0., 1., phi};
@@ -91,124 +33,300 @@ static PyObject *icosahedron(PyObject *self, PyObject *args, PyObject *kwargs)
   corner2[0] *= size_scaling; corner2[1] *= size_scaling; corner2[2] *= size_scaling;
   corner3[0] *= size_scaling; corner3[1] *= size_scaling; corner3[2] *= size_scaling;
   
-  double center_z = (corner1[0]+corner2[0]+corner3[0])/3.;
-  double center_y = (corner1[1]+corner2[1]+corner3[1])/3.;
-  double center_x = (corner1[2]+corner2[2]+corner3[2])/3.;
-
-  double normal1_z = (corner1[0] + corner2[0])/2. - center_z;
-  double normal1_y = (corner1[1] + corner2[1])/2. - center_y;
-  double normal1_x = (corner1[2] + corner2[2])/2. - center_x;
-
-  double normal2_z = (corner2[0] + corner3[0])/2. - center_z;
-  double normal2_y = (corner2[1] + corner3[1])/2. - center_y;
-  double normal2_x = (corner2[2] + corner3[2])/2. - center_x;
-
-  double normal3_z = (corner3[0] + corner1[0])/2. - center_z;
-  double normal3_y = (corner3[1] + corner1[1])/2. - center_y;
-  double normal3_x = (corner3[2] + corner1[2])/2. - center_x;
-
-  double edge_distance = sqrt(pow(normal1_z, 2) + pow(normal1_y, 2) + pow(normal1_x, 2));
-  normal1_z /= edge_distance; normal1_y /= edge_distance; normal1_x /= edge_distance;
-  normal2_z /= edge_distance; normal2_y /= edge_distance; normal2_x /= edge_distance;
-  normal3_z /= edge_distance; normal3_y /= edge_distance; normal3_x /= edge_distance;
-
-  double face_normal_3[] = {phi/3., 0., (2.*phi+1.)/3.};
-  double face_normal_2[] = {(2.*phi+1.)/3., phi/3., 0.};
-  double face_normal_1[] = {0., (2.*phi+1.)/3., phi/3.};
-  double face_normal_center[] = {1., 1., 1.};
-
-  double face_distance = sqrt(pow(center_z, 2) + pow(center_y, 2) + pow(center_x, 2))/size_scaling;
-  face_normal_1[0] /= face_distance; face_normal_1[1] /= face_distance; face_normal_1[2] /= face_distance;
-  face_normal_2[0] /= face_distance; face_normal_2[1] /= face_distance; face_normal_2[2] /= face_distance;
-  face_normal_3[0] /= face_distance; face_normal_3[1] /= face_distance; face_normal_3[2] /= face_distance;
-  face_normal_center[0] /= sqrt(3.); face_normal_center[1] /= sqrt(3.);
-  face_normal_center[2] /= sqrt(3.);
+  g->center_z = (corner1[0]+corner2[0]+corner3[0])/3.;
+  g->center_y = (corner1[1]+corner2[1]+corner3[1])/3.;
+  g->center_x = (corner1[2]+corner2[2]+corner3[2])/3.;
+
+  g->normal1_z = (corner1[0] + corner2[0])/2. - g->center_z;
+  g->normal1_y = (corner1[1] + corner2[1])/2. - g->center_y;
+  g->normal1_x = (corner1[2] + corner2[2])/2. - g->center_x;
+
+  g->normal2_z = (corner2[0] + corner3[0])/2. - g->center_z;
+  g->normal2_y = (corner2[1] + corner3[1])/2. - g->center_y;
+  g->normal2_x = (corner2[2] + corner3[2])/2. - g->center_x;
+
+  g->normal3_z = (corner3[0] + corner1[0])/2. - g->center_z;
+  g->normal3_y = (corner3[1] + corner1[1])/2. - g->center_y;
+  g->normal3_x = (corner3[2] + corner1[2])/2. - g->center_x;
+
+  g->edge_distance = sqrt(pow(g->normal1_z, 2) + pow(g->normal1_y, 2) + pow(g->normal1_x, 2));
+  g->normal1_z /= g->edge_distance; g->normal1_y /= g->edge_distance; g->normal1_x /= g->edge_distance;
+  g->normal2_z /= g->edge_distance; g->normal2_y /= g->edge_distance; g->normal2_x /= g->edge_distance;
+  g->normal3_z /= g->edge_distance; g->normal3_y /= g->edge_distance; g->normal3_x /= g->edge_distance;
+
+  g->face_normal_3[0] = phi/3.; g->face_normal_3[1] = 0.; g->face_normal_3[2] = (2.*phi+1.)/3.;
+  g->face_normal_2[0] = (2.*phi+1.)/3.; g->face_normal_2[1] = phi/3.; g->face_normal_2[2] = 0.;
+  g->face_normal_1[0] = 0.; g->face_normal_1[1] = (2.*phi+1.)/3.; g->face_normal_1[2] = phi/3.;
+  g->face_normal_center[0] = 1.; g->face_normal_center[1] = 1.; g->face_normal_center[2] = 1.;
+
+  double face_distance = sqrt(pow(g->center_z, 2) + pow(g->center_y, 2) + pow(g->center_x, 2))/size_scaling;
+  int k;
+  for (k = 0; k < 3; k++) {
+    g->face_normal_1[k] /= face_distance;
+    g->face_normal_2[k] /= face_distance;
+    g->face_normal_3[k] /= face_distance;
+    g->face_normal_center[k] /= sqrt(3.);
+  }
   
-  face_distance = sqrt(pow(center_z, 2) + pow(center_y, 2) + pow(center_x, 2));
+  g->face_distance = sqrt(pow(g->center_z, 2) + pow(g->center_y, 2) + pow(g->center_x, 2));
+}
 
-  double no_rot_x, no_rot_y, no_rot_z;
+static void icosahedron_init_rotation(icosahedron_geometry *g, double quat_1, double quat_2, double quat_3, double quat_4)
+{
+  double quaternion_norm = sqrt(pow(quat_1, 2) + pow(quat_2, 2) + pow(quat_3, 2) + pow(quat_4, 2));
+  quat_1 /= quaternion_norm;
+  quat_2 /= quaternion_norm;
+  quat_3 /= quaternion_norm;
+  quat_4 /= quaternion_norm;
+    
+  g->rotm[0][0] = quat_1*quat_1 + quat_2*quat_2 - quat_3*quat_3 - quat_4*quat_4;
+  g->rotm[0][1] = 2.*quat_2*quat_3 - 2.*quat_1*quat_4;
+  g->rotm[0][2] = 2.*quat_2*quat_4 + 2.*quat_1*quat_3;
+      
+  g->rotm[1][0] = 2.*quat_2*quat_3 + 2.*quat_1*quat_4;
+  g->rotm[1][1] = quat_1*quat_1 - quat_2*quat_2 + quat_3*quat_3 - quat_4*quat_4;
+  g->rotm[1][2] = 2.*quat_3*quat_4 - 2.*quat_1*quat_2;
+
+  g->rotm[2][0] = 2.*quat_2*quat_4 - 2.*quat_1*quat_3;
+  g->rotm[2][1] = 2.*quat_3*quat_4 + 2.*quat_1*quat_2;
+  g->rotm[2][2] = quat_1*quat_1 - quat_2*quat_2 - quat_3*quat_3 + quat_4*quat_4;
+  g->rotate = 1;
+}
+
+static void icosahedron_fold(const icosahedron_geometry *g, double no_rot_z, double no_rot_y, double no_rot_x,
+			     double *z, double *y, double *x)
+{
+  if (g->rotate == 1) {
+    //Transpose rotation matrix in comparison to Max' code since I don't rotate the icosahedron but the coordinate system.
+    *z = fabs(no_rot_z*g->rotm[0][0] + no_rot_y*g->rotm[1][0] + no_rot_x*g->rotm[2][0]);
+    *y = fabs(no_rot_z*g->rotm[0][1] + no_rot_y*g->rotm[1][1] + no_rot_x*g->rotm[2][1]);
+    *x = fabs(no_rot_z*g->rotm[0][2] + no_rot_y*g->rotm[1][2] + no_rot_x*g->rotm[2][2]);
+  } else {
+    *z = fabs(no_rot_z);
+    *y = fabs(no_rot_y);
+    *x = fabs(no_rot_x);
+  }
+}
+
+// Value of a voxel with a linear ramp of one voxel across the face that is selected by central projection
+static double icosahedron_voxel_ramp(const icosahedron_geometry *g, double no_rot_z, double no_rot_y, double no_rot_x)
+{
   double x, y, z;
   double projected_x, projected_y, projected_z;
   double scalar_product, distance;
+
+  icosahedron_fold(g, no_rot_z, no_rot_y, no_rot_x, &z, &y, &x);
+
+  scalar_product = x*g->face_normal_center[2] + y*g->face_normal_center[1] + z*g->face_normal_center[0];
+  projected_x = x * g->face_distance/scalar_product;
+  projected_y = y * g->face_distance/scalar_product;
+  projected_z = z * g->face_distance/scalar_product;
+  
+  if ((projected_x-g->center_x)*g->normal1_x + (projected_y-g->center_y)*g->normal1_y +
+      (projected_z-g->center_z)*g->normal1_z > g->edge_distance) {
+    distance = x*g->face_normal_1[2] + y*g->face_normal_1[1] + z*g->face_normal_1[0];
+  } else if ((projected_x-g->center_x)*g->normal2_x + (projected_y-g->center_y)*g->normal2_y +
+	     (projected_z-g->center_z)*g->normal2_z > g->edge_distance) {
+    distance = x*g->face_normal_2[2] + y*g->face_normal_2[1] + z*g->face_normal_2[0];
+  } else if ((projected_x-g->center_x)*g->normal3_x + (projected_y-g->center_y)*g->normal3_y +
+	     (projected_z-g->center_z)*g->normal3_z > g->edge_distance) {
+    distance = x*g->face_normal_3[2] + y*g->face_normal_3[1] + z*g->face_normal_3[0];
+  } else {
+    distance = x*g->face_normal_center[2] + y*g->face_normal_center[1] + z*g->face_normal_center[0];
+  }
+
+  if (distance > g->face_distance + g->half_edge_thickness) {
+    return 0.;
+  } else if (distance < g->face_distance - g->half_edge_thickness) {
+    return 1.;
+  } else {
+    return 0.5 + (g->face_distance - distance) / g->edge_thickness;
+  }
+}
+
+// Signed distance of a point to the closest face plane (negative inside the icosahedron)
+static double icosahedron_plane_distance(const icosahedron_geometry *g, double no_rot_z, double no_rot_y, double no_rot_x)
+{
+  double x, y, z, d, d_max;
+
+  icosahedron_fold(g, no_rot_z, no_rot_y, no_rot_x, &z, &y, &x);
+
+  // After folding into the first octant only the central face and its three neighbours can be closest
+  d_max = x*g->face_normal_center[2] + y*g->face_normal_center[1] + z*g->face_normal_center[0];
+  d = x*g->face_normal_1[2] + y*g->face_normal_1[1] + z*g->face_normal_1[0];
+  if (d > d_max) d_max = d;
+  d = x*g->face_normal_2[2] + y*g->face_normal_2[1] + z*g->face_normal_2[0];
+  if (d > d_max) d_max = d;
+  d = x*g->face_normal_3[2] + y*g->face_normal_3[1] + z*g->face_normal_3[0];
+  if (d > d_max) d_max = d;
+  return d_max - g->face_distance;
+}
+
+// Fraction of the voxel volume inside the icosahedron estimated on a regular grid of k x k x k sample points
+static double icosahedron_voxel_supersampled(const icosahedron_geometry *g, double no_rot_z, double no_rot_y, double no_rot_x, int k)
+{
+  // Half of the voxel diagonal: voxels further away from all face planes are entirely inside or outside
+  const double half_diagonal = sqrt(3.)/2.;
+  double d = icosahedron_plane_distance(g, no_rot_z, no_rot_y, no_rot_x);
+  if (d > half_diagonal) {
+    return 0.;
+  } else if (d < -half_diagonal) {
+    return 1.;
+  }
+  int sz, sy, sx;
+  long n_inside = 0;
+  double oz, oy, ox;
+  for (sz = 0; sz < k; sz++) {
+    oz = no_rot_z + ((double)sz + 0.5)/(double)k - 0.5;
+    for (sy = 0; sy < k; sy++) {
+      oy = no_rot_y + ((double)sy + 0.5)/(double)k - 0.5;
+      for (sx = 0; sx < k; sx++) {
+	ox = no_rot_x + ((double)sx + 0.5)/(double)k - 0.5;
+	if (icosahedron_plane_distance(g, oz, oy, ox) <= 0.) {
+	  n_inside++;
+	}
+      }
+    }
+  }
+  return (double)n_inside / (double)(k*k*k);
+}
+
+static void icosahedron_fill(const icosahedron_geometry *g, void *out, int is_float32, int image_side,
+			     int z_start, int z_stop, int supersampling)
+{
+  double no_rot_x, no_rot_y, no_rot_z;
   double image_side_float = (double) image_side;
-  int x_pixel, y_pixel, z_pixel, i;
+  double value;
+  int x_pixel, y_pixel, z_pixel;
+  npy_intp i;
   
-  for (z_pixel = 0; z_pixel < image_side; z_pixel++) {
-    //x = fabs(((double)x_pixel - image_side_float/2. + 0.5));
+  for (z_pixel = z_start; z_pixel < z_stop; z_pixel++) {
     no_rot_z = ((double)z_pixel - image_side_float/2. + 0.5);
     for (y_pixel = 0; y_pixel < image_side; y_pixel++) {
-      //y = fabs(((double)y_pixel - image_side_float/2. + 0.5));
       no_rot_y = ((double)y_pixel - image_side_float/2. + 0.5);
       for (x_pixel = 0; x_pixel < image_side; x_pixel++) {
-	//z = fabs(((double)z_pixel - image_side_float/2. + 0.5));
 	no_rot_x = ((double)x_pixel - image_side_float/2. + 0.5);
-	
-	if (rotate == 1) {
-	  //Transpose rotation matrix in comparison to Max' code since I don't rotate the icosahedron but the coordinate system.
-	  z = fabs(no_rot_z*rotm_11 + no_rot_y*rotm_21 + no_rot_x*rotm_31);
-	  y = fabs(no_rot_z*rotm_12 + no_rot_y*rotm_22 + no_rot_x*rotm_32);
-	  x = fabs(no_rot_z*rotm_13 + no_rot_y*rotm_23 + no_rot_x*rotm_33);
+	if (supersampling > 1) {
+	  value = icosahedron_voxel_supersampled(g, no_rot_z, no_rot_y, no_rot_x, supersampling);
 	} else {
-	  z = fabs(no_rot_z);
-	  y = fabs(no_rot_y);
-	  x = fabs(no_rot_x);
+	  value = icosahedron_voxel_ramp(g, no_rot_z, no_rot_y, no_rot_x);
 	}
-
-	scalar_product = x*face_normal_center[2] + y*face_normal_center[1] + z*face_normal_center[0];
-	projected_x = x * face_distance/scalar_product;
-	projected_y = y * face_distance/scalar_product;
-	projected_z = z * face_distance/scalar_product;
-  
-	i = z_pixel*image_side*image_side + y_pixel*image_side + x_pixel;
-	if ((projected_x-center_x)*normal1_x + (projected_y-center_y)*normal1_y +
-	    (projected_z-center_z)*normal1_z > edge_distance) {
-	  distance = x*face_normal_1[2] + y*face_normal_1[1] + z*face_normal_1[0];
-
-	  if (distance > face_distance + half_edge_thickness) {
-	    out[i] = 0.;
-	  } else if (distance < face_distance - half_edge_thickness) {
-	    out[i] = 1.;
-	  } else {
-	    out[i] = 0.5 + (face_distance - distance) / edge_thickness;
-	  }
-	    
-	} else if ((projected_x-center_x)*normal2_x + (projected_y-center_y)*normal2_y +
-		   (projected_z-center_z)*normal2_z > edge_distance) {
-	  distance = x*face_normal_2[2] + y*face_normal_2[1] + z*face_normal_2[0];
-	  if (distance > face_distance + half_edge_thickness) {
-	    out[i] = 0.;
-	  } else if (distance < face_distance - half_edge_thickness) {
-	    out[i] = 1.;
-	  } else {
-	    out[i] = 0.5 + (face_distance - distance) / edge_thickness;
-	  }
-
-	} else if ((projected_x-center_x)*normal3_x + (projected_y-center_y)*normal3_y +
-		   (projected_z-center_z)*normal3_z > edge_distance) {
-	  distance = x*face_normal_3[2] + y*face_normal_3[1] + z*face_normal_3[0];
-	  if (distance > face_distance + half_edge_thickness) {
-	    out[i] = 0.;
-	  } else if (distance < face_distance - half_edge_thickness) {
-	    out[i] = 1.;
-	  } else {
-	    out[i] = 0.5 + (face_distance - distance) / edge_thickness;
-	  }
-
+	i = ((npy_intp)z_pixel*image_side + y_pixel)*image_side + x_pixel;
+	if (is_float32) {
+	  ((float *)out)[i] = (float)value;
 	} else {
-	  distance = x*face_normal_center[2] + y*face_normal_center[1] + z*face_normal_center[0];
-	  if (distance > face_distance + half_edge_thickness) {
-	    out[i] = 0.;
-	  } else if (distance < face_distance - half_edge_thickness) {
-	    out[i] = 1.;
-	  } else {
-	    out[i] = 0.5 + (face_distance - distance) / edge_thickness;
-	  }
+	  ((double *)out)[i] = value;
 	}
       }
     }
   }
+}
+
+PyDoc_STRVAR(icosahedron__doc__, "icosahedron(array_side, radius, rotation=None, out=None, supersampling=1, z_start=0, z_stop=array_side)\n\nGenerate an icosahedron. Radius is given in pixels and is defined as the distance to the corners. Rotation should be tuple of quaternions (w,x,y,z).\n\nIf supersampling is 1 voxels at the surface are linearly interpolated across one voxel. If supersampling is k > 1 voxels at the surface are assigned the fraction of k x k x k sample points that lie inside the icosahedron.\n\nThe map is written to out (C-contiguous float32 or float64 array of shape (array_side, array_side, array_side)) if given, otherwise a new float64 array is returned. Only the slices z_start <= z < z_stop of the first axis are computed. The global interpreter lock is released during the computation, so disjoint ranges of slices can be filled by concurrent threads.");
+static PyObject *icosahedron(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+  int image_side = 0.;
+  double radius = 0.;
+  PyObject *rotation_obj = NULL;
+  PyObject *rotation_sequence;
+  PyObject *out_obj = NULL;
+  int supersampling = 1;
+  int z_start = 0;
+  int z_stop = -1;
+
+  static char *kwlist[] = {"array_side", "radius", "rotation", "out", "supersampling", "z_start", "z_stop", NULL};
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "id|OOiii", kwlist, &image_side, &radius, &rotation_obj, &out_obj, &supersampling, &z_start, &z_stop)) {
+    PyErr_SetString(PyExc_ValueError, "Invalid input for iscoahedron.");
+    return NULL;
+  }
+
+  if (image_side <= 0) {
+    PyErr_SetString(PyExc_ValueError, "Image side must be > 0.");
+    return NULL;
+  }
+
+  if (radius <= 0.) {
+    PyErr_SetString(PyExc_ValueError, "Radius must be > 0.");
+    return NULL;
+  }
+
+  if (supersampling < 1) {
+    PyErr_SetString(PyExc_ValueError, "Supersampling must be >= 1.");
+    return NULL;
+  }
+
+  if (z_stop < 0) {
+    z_stop = image_side;
+  }
+  if (z_start < 0 || z_start > z_stop || z_stop > image_side) {
+    PyErr_SetString(PyExc_ValueError, "Slice range must fulfil 0 <= z_start <= z_stop <= array_side.");
+    return NULL;
+  }
+
+  icosahedron_geometry g = {0};
+  g.rotate = 0;
+  if (rotation_obj != NULL && rotation_obj != Py_None) {
+    rotation_sequence = PySequence_Fast(rotation_obj, "Expected a sequence");
+    if (rotation_sequence == NULL) {
+      return NULL;
+    }
+    
+    long length = PySequence_Size(rotation_sequence);
+    if (length != 4) {
+      Py_DECREF(rotation_sequence);
+      PyErr_SetString(PyExc_ValueError, "Rotation must be of length 4 (quaternion)");
+      return NULL;
+    }
+
+    double quat_1 = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(rotation_sequence, 0));
+    double quat_2 = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(rotation_sequence, 1));
+    double quat_3 = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(rotation_sequence, 2));
+    double quat_4 = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(rotation_sequence, 3));
+    Py_DECREF(rotation_sequence);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
+    icosahedron_init_rotation(&g, quat_1, quat_2, quat_3, quat_4);
+  }
+  icosahedron_init_geometry(&g, radius);
+
+  PyArrayObject *out_array;
+  if (out_obj == NULL || out_obj == Py_None) {
+    npy_intp out_dim[] = {image_side, image_side, image_side};
+    out_array = (PyArrayObject *)PyArray_ZEROS(3, out_dim, NPY_FLOAT64, 0);
+    if (out_array == NULL) {
+      return NULL;
+    }
+  } else {
+    if (!PyArray_Check(out_obj)) {
+      PyErr_SetString(PyExc_TypeError, "Output must be a numpy array.");
+      return NULL;
+    }
+    out_array = (PyArrayObject *)out_obj;
+    if (PyArray_NDIM(out_array) != 3 || PyArray_DIM(out_array, 0) != image_side ||
+	PyArray_DIM(out_array, 1) != image_side || PyArray_DIM(out_array, 2) != image_side) {
+      PyErr_SetString(PyExc_ValueError, "Output array must be of shape (array_side, array_side, array_side).");
+      return NULL;
+    }
+    if (PyArray_TYPE(out_array) != NPY_FLOAT64 && PyArray_TYPE(out_array) != NPY_FLOAT32) {
+      PyErr_SetString(PyExc_TypeError, "Output array must be of type float32 or float64.");
+      return NULL;
+    }
+    if (!PyArray_IS_C_CONTIGUOUS(out_array) || !PyArray_ISWRITEABLE(out_array)) {
+      PyErr_SetString(PyExc_ValueError, "Output array must be C-contiguous and writeable.");
+      return NULL;
+    }
+    Py_INCREF(out_array);
+  }
+
+  void *out = PyArray_DATA(out_array);
+  int is_float32 = (PyArray_TYPE(out_array) == NPY_FLOAT32);
+
+  Py_BEGIN_ALLOW_THREADS
+  icosahedron_fill(&g, out, is_float32, image_side, z_start, z_stop, supersampling);
+  Py_END_ALLOW_THREADS
   
-  return out_array;
+  return (PyObject *)out_array;
 }
 
 static PyMethodDef IcosahedronMethods[] = {
@@ -73,21 +73,21 @@ def log(logger, message, lvl, exception=None, rollback=1):
 def log_execution_time(logger):
     def st_time(func):
         def st_func(*args, **keyArgs):
+            # Skip the measurement entirely unless the message would be emitted
+            if not logger.isEnabledFor(logging.DEBUG):
+                return func(*args, **keyArgs)
             t1 = time.time()
             r = func(*args, **keyArgs)
             t2 = time.time()
-            try:
-                filename = inspect.getsourcefile(func)
-                module = inspect.getmodule(func)
-                line = inspect.getsourcelines(func)[1]
+            code = getattr(func, "__code__", None)
+            if code is not None:
                 loc = "\'%s\' [%s:%i]" % (func.__name__,
-                                         filename,
-                                         line)
-            except TypeError:
+                                           code.co_filename,
+                                           code.co_firstlineno)
+            else:
                 loc = "\'%s\'" % func.__name__
             msg = "Execution time = %.4f sec\n\t=> in function %s" % (t2 - t1,loc)
             log(logger, msg, "DEBUG", exception=None, rollback=None)
             return r        
         return st_func
     return st_time
-
@@ -0,0 +1,544 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+"""
+Low-overhead instrumentation of the simulation stages (timers, counters, histograms and optional peak-memory accounting)
+"""
+
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import math, time, sys, os, platform
+
+try:
+    import tracemalloc
+except ImportError:
+    # Not available in python 2
+    tracemalloc = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+# Monotonic high-resolution clock (time.perf_counter is not available in python 2)
+_clock = getattr(time, "perf_counter", time.time)
+
+# Histogram buckets: logarithmically spaced between 10^HISTOGRAM_MIN_EXP and 10^HISTOGRAM_MAX_EXP seconds
+HISTOGRAM_MIN_EXP = -6
+HISTOGRAM_MAX_EXP = 4
+HISTOGRAM_BINS_PER_DECADE = 10
+_N_BUCKETS = (HISTOGRAM_MAX_EXP - HISTOGRAM_MIN_EXP) * HISTOGRAM_BINS_PER_DECADE + 2
+
+def histogram_edges():
+    """
+    Return the edges (in unit seconds) of the histogram buckets that are used by all timers
+
+    The first bucket collects all durations below the lowest edge and the last bucket all durations above the highest edge.
+    """
+    n = (HISTOGRAM_MAX_EXP - HISTOGRAM_MIN_EXP) * HISTOGRAM_BINS_PER_DECADE + 1
+    return [10.**(HISTOGRAM_MIN_EXP + i / float(HISTOGRAM_BINS_PER_DECADE)) for i in range(n)]
+
+def get_backend_versions():
+    """
+    Return the versions of python, Condor and the libraries that Condor uses for the simulation in form of a dictionary (``None`` for libraries that cannot be imported)
+    """
+    import condor
+    versions = {
+        "python"   : platform.python_version(),
+        "condor"   : condor.__version__,
+    }
+    for name in ["numpy", "scipy", "h5py", "spsim", "numba"]:
+        try:
+            module = __import__(name)
+            versions[name] = getattr(module, "__version__", "unknown")
+        except ImportError:
+            versions[name] = None
+    return versions
+
+def get_workers(processes=None):
+    """
+    Return information on the compute resources that are available to this process in form of a dictionary
+
+    The number of processes of the run (key ``'processes'``) is included only if it is given or if the process runs under MPI (``mpi4py`` already imported).
+
+    Kwargs:
+      :processes (int): Number of processes that contribute to the run (default ``None``)
+    """
+    W = {
+        "cpu_count"       : os.cpu_count() if hasattr(os, "cpu_count") else None,
+        "omp_num_threads" : os.environ.get("OMP_NUM_THREADS"),
+        "platform"        : platform.platform(),
+        "hostname"        : platform.node(),
+    }
+    if processes is None and "mpi4py.MPI" in sys.modules:
+        # Importing mpi4py here would initialise MPI
+        processes = sys.modules["mpi4py.MPI"].COMM_WORLD.Get_size()
+    if processes is not None:
+        W["processes"] = processes
+    return W
+
+def _bucket(seconds):
+    if seconds <= 0.:
+        return 0
+    i = int(math.floor((math.log10(seconds) - HISTOGRAM_MIN_EXP) * HISTOGRAM_BINS_PER_DECADE)) + 1
+    if i < 0:
+        return 0
+    if i >= _N_BUCKETS:
+        return _N_BUCKETS - 1
+    return i
+
+
+class Timer:
+    """
+    Accumulated statistics of the execution time of one named stage
+
+    Args:
+      :name (str): Name of the stage
+    """
+    __slots__ = ("name", "count", "total", "min", "max", "_buckets")
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """
+        Set all statistics back to zero
+        """
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+        self._buckets = [0] * _N_BUCKETS
+
+    def add(self, seconds):
+        """
+        Add one measurement
+
+        Args:
+          :seconds (float): Execution time in unit seconds
+        """
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self._buckets[_bucket(seconds)] += 1
+
+    def get_percentile(self, p):
+        """
+        Return an estimate of the given percentile of the execution time in unit seconds (interpolated within the histogram bucket)
+
+        Args:
+          :p (float): Percentile between 0 and 100
+        """
+        if self.count == 0:
+            return None
+        edges = histogram_edges()
+        target = p / 100. * self.count
+        cum = 0
+        for i, n in enumerate(self._buckets):
+            if n == 0:
+                continue
+            if cum + n >= target:
+                if i == 0:
+                    lo, hi = self.min, edges[0]
+                elif i == _N_BUCKETS - 1:
+                    lo, hi = edges[-1], self.max
+                else:
+                    lo, hi = edges[i-1], edges[i]
+                # Clip bucket limits to the observed range
+                lo = max(lo, self.min)
+                hi = min(hi, self.max)
+                return lo + (hi - lo) * max(0., target - cum) / n
+            cum += n
+        return self.max
+
+    def get(self):
+        """
+        Return the statistics as a dictionary
+        """
+        return {
+            "count"     : self.count,
+            "total"     : self.total,
+            "mean"      : (self.total / self.count) if self.count > 0 else None,
+            "min"       : self.min,
+            "max"       : self.max,
+            "histogram" : list(self._buckets),
+        }
+
+
+class MemoryStat:
+    """
+    Accumulated statistics of the peak memory allocation of one named stage
+
+    The peak is measured relative to the memory that was allocated when the stage was entered, i.e. it is the additional memory that the stage required at most.
+
+    Args:
+      :name (str): Name of the stage
+    """
+    __slots__ = ("name", "count", "total", "max", "last")
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """
+        Set all statistics back to zero
+        """
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.last = 0
+
+    def add(self, nbytes):
+        """
+        Add one measurement
+
+        Args:
+          :nbytes (int): Peak allocation in unit bytes
+        """
+        self.count += 1
+        self.total += nbytes
+        self.last = nbytes
+        if nbytes > self.max:
+            self.max = nbytes
+
+    def get(self):
+        """
+        Return the statistics as a dictionary (all values in unit bytes)
+        """
+        return {
+            "count"     : self.count,
+            "peak_mean" : (self.total / float(self.count)) if self.count > 0 else None,
+            "peak_max"  : self.max,
+            "peak_last" : self.last,
+        }
+
+
+class _Stage:
+    __slots__ = ("_metrics", "_name", "_t0")
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._t0 = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.add_time(self._name, _clock() - self._t0)
+        return False
+
+
+class _MemoryStage:
+    __slots__ = ("_metrics", "_name", "_t0")
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._metrics._memory_enter(self._name)
+        self._t0 = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.add_time(self._name, _clock() - self._t0)
+        self._metrics._memory_exit(self._name)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class Metrics:
+    """
+    Collection of named stage timers and counters
+
+    Stages are timed with a context manager. Nothing is logged per call and if the instance is disabled the cost of a measurement reduces to a single attribute lookup.
+
+    If memory tracking is switched on (see :meth:`enable_memory_tracking`) the peak memory allocation of every stage is recorded as well. The measurement relies on the python module ``tracemalloc``, which also traces the data buffers of NumPy arrays. Tracing slows down the simulation noticeably and is therefore switched off by default.
+
+    .. code-block:: python
+
+      M = condor.utils.metrics.Metrics()
+      with M.stage("nfft"):
+          ...
+      M.increment("qmap_cache_hit")
+      M.get()
+
+    Kwargs:
+      :enabled (bool): If ``False`` no measurements are recorded (default ``True``)
+
+      :track_memory (bool): If ``True`` the peak memory allocation of every stage is recorded (default ``False``)
+    """
+    def __init__(self, enabled=True, track_memory=False):
+        self.enabled = enabled
+        self.track_memory = False
+        self._started_tracemalloc = False
+        self._memory_stack = []
+        self.reset()
+        if track_memory:
+            self.enable_memory_tracking()
+
+    def reset(self):
+        """
+        Discard all recorded measurements
+        """
+        self._timers = {}
+        self._counters = {}
+        self._memory = {}
+
+    def enable_memory_tracking(self):
+        """
+        Start recording the peak memory allocation of every stage (starts ``tracemalloc`` if it is not already tracing)
+        """
+        if tracemalloc is None:
+            log_warning(logger, "Memory tracking requires the python module tracemalloc, which is not available.")
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if not hasattr(tracemalloc, "reset_peak"):
+            log_warning(logger, "tracemalloc.reset_peak is not available (python < 3.9). Peak memory of nested stages may be overestimated.")
+        self.track_memory = True
+
+    def disable_memory_tracking(self):
+        """
+        Stop recording the peak memory allocation (stops ``tracemalloc`` if it was started by this instance)
+        """
+        self.track_memory = False
+        self._memory_stack = []
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _memory_enter(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        if len(self._memory_stack) > 0:
+            # Conserve the peak of the enclosing stage before the peak counter is reset
+            parent = self._memory_stack[-1]
+            parent[1] = max(parent[1], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self._memory_stack.append([current, current])
+
+    def _memory_exit(self, name):
+        if len(self._memory_stack) == 0:
+            # Memory tracking was switched on inside the stage
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        baseline, peak_children = self._memory_stack.pop()
+        peak = max(peak, peak_children)
+        if len(self._memory_stack) > 0:
+            parent = self._memory_stack[-1]
+            parent[1] = max(parent[1], peak)
+        self.add_memory(name, max(0, peak - baseline))
+
+    def add_memory(self, name, nbytes):
+        """
+        Add a peak memory measurement to the memory statistics of the given name
+
+        Args:
+          :name (str): Name of the stage
+
+          :nbytes (int): Peak allocation in unit bytes
+        """
+        if not self.enabled:
+            return
+        m = self._memory.get(name)
+        if m is None:
+            m = MemoryStat(name)
+            self._memory[name] = m
+        m.add(nbytes)
+
+    def enable(self):
+        """
+        Start recording measurements
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop recording measurements (recorded values are kept)
+        """
+        self.enabled = False
+
+    def stage(self, name):
+        """
+        Return context manager that measures the execution time of the enclosed code block and adds it to the timer of the given name
+
+        Args:
+          :name (str): Name of the stage
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        if self.track_memory:
+            return _MemoryStage(self, name)
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        """
+        Add an execution time measurement to the timer of the given name
+
+        Args:
+          :name (str): Name of the stage
+
+          :seconds (float): Execution time in unit seconds
+        """
+        if not self.enabled:
+            return
+        t = self._timers.get(name)
+        if t is None:
+            t = Timer(name)
+            self._timers[name] = t
+        t.add(seconds)
+
+    def increment(self, name, n=1):
+        """
+        Increment the counter of the given name
+
+        Args:
+          :name (str): Name of the counter
+
+        Kwargs:
+          :n (int): Increment (default ``1``)
+        """
+        if not self.enabled:
+            return
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def get_timer(self, name):
+        """
+        Return the :class:`condor.utils.metrics.Timer` instance of the given name (``None`` if nothing has been recorded yet)
+
+        Args:
+          :name (str): Name of the stage
+        """
+        return self._timers.get(name)
+
+    def get_memory(self, name):
+        """
+        Return the :class:`condor.utils.metrics.MemoryStat` instance of the given name (``None`` if nothing has been recorded yet)
+
+        Args:
+          :name (str): Name of the stage
+        """
+        return self._memory.get(name)
+
+    def get_counter(self, name):
+        """
+        Return the value of the counter of the given name
+
+        Args:
+          :name (str): Name of the counter
+        """
+        return self._counters.get(name, 0)
+
+    def get_cache_hit_rates(self):
+        """
+        Return the hit rates of all caches in form of a dictionary
+
+        A cache is recognised by a pair of counters with the names ``'<cache>_cache_hit'`` and ``'<cache>_cache_miss'``. Entries that were discarded from a bounded cache are counted by the counter ``'<cache>_cache_eviction'``.
+        """
+        rates = {}
+        for name in self._counters.keys():
+            if name.endswith("_cache_hit") or name.endswith("_cache_miss"):
+                cache = name[:name.rindex("_cache_")]
+                hits = self.get_counter(cache + "_cache_hit")
+                misses = self.get_counter(cache + "_cache_miss")
+                rates[cache] = {
+                    "hits"      : hits,
+                    "misses"    : misses,
+                    "evictions" : self.get_counter(cache + "_cache_eviction"),
+                    "hit_rate"  : hits / float(hits + misses) if (hits + misses) > 0 else None,
+                }
+        return rates
+
+    def get_report(self, wall_time=None, shot_stage="propagate", percentiles=(50, 90, 95, 99), processes=None):
+        """
+        Return a summary of the recorded measurements that is suitable for writing to a JSON file
+
+        Kwargs:
+          :wall_time (float): Total wall-clock time of the run in unit seconds. If ``None`` the throughput is calculated from the accumulated time of the stage ``shot_stage`` (default ``None``)
+
+          :shot_stage (str): Name of the stage that is executed once per shot (default ``'propagate'``)
+
+          :percentiles (tuple): Percentiles of the execution time that are reported for every stage (default ``(50, 90, 95, 99)``)
+
+          :processes (int): Number of processes that contribute to the run, see :func:`get_workers` (default ``None``)
+        """
+        timer = self._timers.get(shot_stage)
+        n_shots = timer.count if timer is not None else 0
+        if wall_time is None and timer is not None:
+            wall_time = timer.total
+        stages = {}
+        for name, t in self._timers.items():
+            D = t.get()
+            D.pop("histogram")
+            for p in percentiles:
+                D["p%g" % p] = t.get_percentile(p)
+            stages[name] = D
+        return {
+            "shots"            : n_shots,
+            "wall_time"        : wall_time,
+            "shots_per_second" : (n_shots / wall_time) if wall_time else None,
+            "bytes_written"    : self.get_counter("bytes_written"),
+            "stages"           : stages,
+            "memory"           : dict([(n, m.get()) for n, m in self._memory.items()]),
+            "caches"           : self.get_cache_hit_rates(),
+            "counters"         : dict(self._counters),
+            "workers"          : get_workers(processes=processes),
+            "versions"         : get_backend_versions(),
+        }
+
+    def get(self):
+        """
+        Return a snapshot of all measurements as a dictionary with the keys ``'timers'``, ``'counters'``, ``'memory'`` (peak allocation per stage invocation in unit bytes, empty if memory tracking is off) and ``'histogram_edges'``
+        """
+        return {
+            "timers"          : dict([(n, t.get()) for n, t in self._timers.items()]),
+            "counters"        : dict(self._counters),
+            "memory"          : dict([(n, m.get()) for n, m in self._memory.items()]),
+            "histogram_edges" : histogram_edges(),
+        }
@@ -0,0 +1,301 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+"""
+On-disk library of simulated diffraction patterns for the classification and sizing of measured patterns by nearest-neighbour lookup
+
+A library is a directory with the following files:
+
+- ``features.npy``: Feature vectors of all patterns in single precision (memory-mapped when the library is opened)
+- ``features_squared.npy``: Element-wise squares of the feature vectors (for the norms of the masked features)
+- ``parameters.npz``: Parameters of the simulated particles (e.g. ``'diameter'``, ``'flattening'``, ``'extrinsic_quaternion'``)
+- ``library.json``: Detector geometry and feature configuration
+
+Two kinds of features are supported. ``'radial'`` features are the radial profiles of the patterns (suited for spheres and orientation-independent sizing). ``'binned'`` features are the patterns binned by a given factor (suited for anisotropic particles like spheroids). All features are multiplied by :math:`(q/q_{max})^2`, which compensates the decay of the intensity with :math:`q^{-4}` so that all fringes contribute to the correlation.
+
+Patterns are compared by the masked normalised correlation
+
+.. math::
+
+  c_i = \\frac{\\sum_j w_j x_{ij} y_j}{\\sqrt{\\sum_j w_j x_{ij}^2 \\sum_j w_j y_j^2}}
+
+with the library features :math:`x_{ij}`, the features of the measured pattern :math:`y_j` and the fraction of valid pixels :math:`w_j` in every feature element. The correlation is independent of the intensity scale of the measured pattern. For every query it costs two matrix-vector products, one with the feature matrix and one with the matrix of squared features. The libraries are memory-mapped and correlated in chunks and may therefore be larger than the available memory.
+
+.. code-block:: python
+
+  lib = condor.utils.pattern_library.build_pattern_library("./spheres.lib", E, 10000)
+  res = lib.query(image, mask=mask, k=5)
+  res["diameter"], res["score"]
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import os, json
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+from .scattering_vector import generate_absqmap
+
+FEATURES = ["radial", "binned"]
+
+class PatternLibrary:
+    """
+    Library of simulated patterns (see :mod:`condor.utils.pattern_library`). A new library is created with :func:`build_pattern_library`.
+
+    Args:
+      :path (str): Directory of the library
+
+    Kwargs:
+      :mmap_mode (str): Memory-map mode of the feature matrix, see :func:`numpy.load`. If ``None`` the features are read into memory (default ``'r'``)
+    """
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        with open(os.path.join(path, "library.json"), "r") as f:
+            self.conf = json.load(f)
+        self.features = numpy.load(os.path.join(path, "features.npy"), mmap_mode=mmap_mode)
+        self.features_squared = numpy.load(os.path.join(path, "features_squared.npy"), mmap_mode=mmap_mode)
+        with numpy.load(os.path.join(path, "parameters.npz")) as f:
+            self.parameters = dict([(k, f[k]) for k in f.files])
+        self._geometry = _FeatureGeometry(**self.conf["geometry"])
+        self._norms = None
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def get_norms(self):
+        """
+        Return the squared norms of all library features (calculated at the first call)
+        """
+        if self._norms is None:
+            self._norms = numpy.concatenate([self.features_squared[i0:i0+65536].sum(axis=1) for i0 in range(0, len(self), 65536)])
+        return self._norms
+
+    def get_features(self, image, mask=None):
+        """
+        Return the tuple of feature vector and weights (fraction of valid pixels) of a pattern
+
+        Args:
+          :image (array): 2D pattern recorded with the detector geometry of the library
+
+        Kwargs:
+          :mask (array): Boolean array of valid pixels (default ``None``)
+        """
+        return self._geometry.get_features(image, mask)
+
+    def query(self, image, mask=None, k=10, chunk_size=65536):
+        """
+        Return the ``k`` best matches of a pattern in form of a dictionary with the indices of the library entries (``'index'``), the normalised correlations (``'score'``, in descending order) and the parameters of the matching entries
+
+        Args:
+          :image (array): 2D pattern recorded with the detector geometry of the library
+
+        Kwargs:
+          :mask (array): Boolean array of valid pixels (default ``None``)
+
+          :k (int): Number of matches (default ``10``)
+
+          :chunk_size (int): Number of library entries that are correlated at once (default ``65536``)
+        """
+        res = self.query_batch(numpy.asarray(image)[numpy.newaxis], masks=None if mask is None else numpy.asarray(mask)[numpy.newaxis], k=k, chunk_size=chunk_size)
+        return dict([(key, v[0]) for key, v in res.items()])
+
+    def query_batch(self, images, masks=None, k=10, chunk_size=65536):
+        """
+        Return the ``k`` best matches for a stack of patterns (see :meth:`query`). All entries of the returned dictionary have the number of patterns as first dimension.
+
+        Args:
+          :images (array): Stack of 2D patterns
+
+        Kwargs:
+          :masks (array): Stack of boolean arrays of valid pixels (default ``None``)
+
+          :k (int): Number of matches (default ``10``)
+
+          :chunk_size (int): Number of library entries that are correlated at once (default ``65536``)
+        """
+        N = len(images)
+        Y = []
+        W = []
+        for i in range(N):
+            y, w = self.get_features(images[i], None if masks is None else masks[i])
+            Y.append(y)
+            W.append(w)
+        Y = numpy.array(Y, dtype=numpy.float32)
+        W = numpy.array(W, dtype=numpy.float32)
+        WY = W * Y
+        S_yy = (WY * Y).sum(axis=1)
+        # Without masked pixels the norms of the library features do not depend on the query
+        masked = (W < 1.).any()
+        k = min(k, len(self))
+        scores = numpy.empty(shape=(N, len(self)), dtype=numpy.float32)
+        for i0 in range(0, len(self), chunk_size):
+            S_xy = numpy.dot(WY, self.features[i0:i0+chunk_size].T)
+            if masked:
+                S_xx = numpy.dot(W, self.features_squared[i0:i0+chunk_size].T)
+            else:
+                S_xx = self.get_norms()[numpy.newaxis,i0:i0+chunk_size]
+            scores[:,i0:i0+S_xy.shape[1]] = S_xy / numpy.sqrt(numpy.maximum(S_xx * S_yy[:,numpy.newaxis], 1E-30))
+        # Top k without sorting the whole library
+        index = numpy.argpartition(-scores, k-1, axis=1)[:,:k]
+        s = numpy.take_along_axis(scores, index, axis=1)
+        order = numpy.argsort(-s, axis=1)
+        index = numpy.take_along_axis(index, order, axis=1)
+        res = {
+            "index" : index,
+            "score" : numpy.take_along_axis(s, order, axis=1),
+        }
+        for key, v in self.parameters.items():
+            res[key] = v[index]
+        return res
+
+
+class _FeatureGeometry:
+    def __init__(self, feature, nx, ny, cx, cy, pixel_size, distance, wavelength, bin_width=1., binning=4):
+        if feature not in FEATURES:
+            log_and_raise_error(logger, "Invalid feature %s. Valid features are: %s" % (feature, ", ".join(FEATURES)))
+            return
+        self.feature = feature
+        self.nx = nx
+        self.ny = ny
+        self.binning = binning
+        Y, X = numpy.indices((ny, nx), dtype=numpy.float64)
+        X -= cx
+        Y -= cy
+        q = generate_absqmap(X, Y, pixel_size, distance, wavelength)
+        if feature == "radial":
+            r = numpy.sqrt(X**2 + Y**2)
+            self._index = (r / bin_width).astype(numpy.intp).ravel()
+            self._n_bins = self._index.max() + 1
+            self._n_full = numpy.bincount(self._index, minlength=self._n_bins)
+            q_bin = numpy.bincount(self._index, weights=q.ravel(), minlength=self._n_bins) / numpy.maximum(self._n_full, 1)
+        else:
+            self._n_full = self._bin(numpy.ones(shape=(ny, nx))).ravel()
+            q_bin = self._bin(q).ravel() / self._n_full
+        self._weight = (q_bin / q_bin.max())**2
+
+    def _bin(self, A):
+        b = self.binning
+        ny = (self.ny // b) * b
+        nx = (self.nx // b) * b
+        return A[:ny,:nx].reshape(ny//b, b, nx//b, b).sum(axis=(1,3))
+
+    def get_features(self, image, mask=None):
+        image = numpy.asarray(image, dtype=numpy.float64)
+        if image.shape != (self.ny, self.nx):
+            log_and_raise_error(logger, "Pattern shape %s does not match the detector geometry of the library (%i, %i)." % (str(image.shape), self.ny, self.nx))
+            return
+        if self.feature == "radial":
+            if mask is None:
+                n = self._n_full
+                s = numpy.bincount(self._index, weights=image.ravel(), minlength=self._n_bins)
+            else:
+                M = numpy.asarray(mask, dtype=bool).ravel()
+                n = numpy.bincount(self._index[M], minlength=self._n_bins)
+                s = numpy.bincount(self._index[M], weights=image.ravel()[M], minlength=self._n_bins)
+        else:
+            if mask is None:
+                n = self._n_full
+                s = self._bin(image).ravel()
+            else:
+                M = numpy.asarray(mask, dtype=bool)
+                n = self._bin(numpy.float64(M)).ravel()
+                s = self._bin(image * M).ravel()
+        y = self._weight * s / numpy.maximum(n, 1)
+        w = n / numpy.maximum(self._n_full, 1.)
+        return y, w
+
+
+def build_pattern_library(path, experiment, n_patterns, feature="radial", bin_width=1., binning=4, overwrite=False):
+    """
+    Simulate patterns with an experiment, store their features in a new library and return the opened :class:`PatternLibrary` instance
+
+    Every call of :meth:`condor.experiment.Experiment.propagate` yields one library entry. The parameters of the library are therefore defined by the variations of the particle model (e.g. ``diameter_variation='uniform'`` for a random sampling of diameters or ``rotation_formalism='random'`` for random orientations). The features are calculated from the noise-free intensities. The parameters of the first particle of every pattern are stored.
+
+    Args:
+      :path (str): Directory of the new library
+
+      :experiment (:class:`condor.experiment.Experiment`): Experiment that simulates the patterns
+
+      :n_patterns (int): Number of library entries
+
+    Kwargs:
+      :feature (str): Either ``'radial'`` (radial profile) or ``'binned'`` (binned pattern) (default ``'radial'``)
+
+      :bin_width (float): Width of the radial bins in unit pixel (for ``feature='radial'``) (default ``1.``)
+
+      :binning (int): Binning factor (for ``feature='binned'``) (default ``4``)
+
+      :overwrite (bool): If ``True`` an existing library at the same location is overwritten (default ``False``)
+    """
+    if os.path.exists(os.path.join(path, "library.json")) and not overwrite:
+        log_and_raise_error(logger, "Library %s already exists. Set overwrite=True to replace it." % path)
+        return
+    if not os.path.exists(path):
+        os.makedirs(path)
+    det = experiment.detector
+    wavelength = experiment.source.photon.get_wavelength()
+    geometry = {
+        "feature"    : feature,
+        "nx"         : int(det.get_mask().shape[1]),
+        "ny"         : int(det.get_mask().shape[0]),
+        "cx"         : float(det.get_cx_mean_value()),
+        "cy"         : float(det.get_cy_mean_value()),
+        "pixel_size" : float(det.pixel_size),
+        "distance"   : float(det.distance),
+        "wavelength" : float(wavelength),
+        "bin_width"  : float(bin_width),
+        "binning"    : int(binning),
+    }
+    G = _FeatureGeometry(**geometry)
+    n_features = len(G._n_full)
+    features = numpy.lib.format.open_memmap(os.path.join(path, "features.npy"), mode="w+", dtype=numpy.float32, shape=(n_patterns, n_features))
+    parameters = {}
+    for i in range(n_patterns):
+        O = experiment.propagate()
+        I = abs(O["entry_1"]["data_1"]["data_fourier"])**2
+        features[i] = G.get_features(I)[0]
+        D = O["particles"][sorted(O["particles"].keys())[0]]
+        for key in ["diameter", "flattening", "extrinsic_quaternion", "position"]:
+            if key in D:
+                parameters.setdefault(key, []).append(D[key])
+    features.flush()
+    # Squared features for the masked norms (avoids squaring the feature matrix at every query)
+    features_squared = numpy.lib.format.open_memmap(os.path.join(path, "features_squared.npy"), mode="w+", dtype=numpy.float32, shape=(n_patterns, n_features))
+    features_squared[:] = numpy.asarray(features)**2
+    features_squared.flush()
+    del features, features_squared
+    numpy.savez(os.path.join(path, "parameters.npz"), **dict([(k, numpy.array(v)) for k, v in parameters.items()]))
+    with open(os.path.join(path, "library.json"), "w") as f:
+        json.dump({"geometry" : geometry, "n_patterns" : n_patterns}, f, indent=2, sort_keys=True)
+    log_info(logger, "Pattern library with %i entries written to %s" % (n_patterns, path))
+    return PatternLibrary(path)
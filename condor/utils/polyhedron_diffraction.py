@@ -0,0 +1,283 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+r"""
+Analytical form factor of homogeneous polyhedra with triangulated surfaces
+
+With Gauss' theorem the Fourier transform of the indicator function of a polyhedron :math:`P` reduces to a sum of integrals over its triangular faces :math:`T_f` with the outward normal vectors :math:`\vec{N}_f = (\vec{b}_f-\vec{a}_f) \times (\vec{c}_f-\vec{a}_f)` (length equals twice the area of the face)
+
+.. math::
+
+  A(\vec{q}) = \int_P e^{-i\vec{q}\cdot\vec{r}} \, d^3r = \frac{i}{q^2} \sum_f \left(\vec{q}\cdot\vec{N}_f\right) \, e[z_{a,f}, z_{b,f}, z_{c,f}]
+
+  z_{v} = -i \, \vec{q}\cdot\vec{v}
+
+The integral over a triangle is given by the second divided difference :math:`e[z_a, z_b, z_c]` of the exponential function at the phases of the three vertices (Hermite-Genocchi formula). The divided difference is evaluated in a numerically stable way also for (almost) coinciding phases.
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+from . import backend
+
+# Default size of the temporary arrays of one chunk of scattering vectors in unit bytes
+CHUNK_BYTES = 64 * 1024**2
+
+# Phase differences below this value are treated with Taylor expansions
+_EPS_PHASE = 1E-2
+# Values of q*R below this value are treated with the small-angle approximation
+_EPS_QR = 1E-5
+
+def get_icosahedron_mesh():
+    """
+    Return the tuple of vertices (:math:`x`, :math:`y`, :math:`z`) and faces (vertex indices, counter clockwise seen from outside) of a regular icosahedron with unit volume
+
+    The orientation equals the one of the icosahedron maps of :class:`condor.particle.particle_map.ParticleMap` (the cartesian axes are parallel to 2-fold symmetry axes).
+    """
+    phi = (1+numpy.sqrt(5))/2.
+    v = []
+    for s1 in [1., -1.]:
+        for s2 in [1., -1.]:
+            v += [[s2*phi, s1*1., 0.], [0., s2*phi, s1*1.], [s1*1., 0., s2*phi]]
+    v = numpy.array(v)
+    # Faces are all triples of vertices that are mutual nearest neighbours (edge length 2)
+    faces = []
+    n = len(v)
+    for i in range(n):
+        for j in range(i+1, n):
+            for k in range(j+1, n):
+                if numpy.isclose(((v[i]-v[j])**2).sum(), 4.) and numpy.isclose(((v[j]-v[k])**2).sum(), 4.) and numpy.isclose(((v[k]-v[i])**2).sum(), 4.):
+                    faces.append([i, j, k])
+    v, faces = orient_mesh(v, _orient_convex(v, faces))
+    return v / get_mesh_volume(v, faces)**(1/3.), faces
+
+def get_cube_mesh():
+    """
+    Return the tuple of vertices (:math:`x`, :math:`y`, :math:`z`) and faces (vertex indices, counter clockwise seen from outside) of a cube with unit edge length and faces perpendicular to the cartesian axes
+    """
+    v = numpy.array([[x, y, z] for z in [-0.5, 0.5] for y in [-0.5, 0.5] for x in [-0.5, 0.5]])
+    # Two triangles per square face
+    squares = [[0, 1, 3, 2], [4, 5, 7, 6], [0, 1, 5, 4], [2, 3, 7, 6], [0, 2, 6, 4], [1, 3, 7, 5]]
+    faces = []
+    for a, b, c, d in squares:
+        faces += [[a, b, c], [a, c, d]]
+    return orient_mesh(v, _orient_convex(v, faces))
+
+def _orient_convex(vertices, faces):
+    # Order the vertices of every face of a convex polyhedron (centred at the origin) counter clockwise seen from outside
+    faces = numpy.array(faces, dtype=numpy.intp)
+    a, b, c = [vertices[faces[:,i]] for i in range(3)]
+    flip = (numpy.cross(b - a, c - a) * (a + b + c)).sum(axis=1) < 0
+    faces[flip] = faces[flip][:,::-1]
+    return faces
+
+def orient_mesh(vertices, faces):
+    """
+    Check that a triangulated surface is closed and return the tuple of vertices and faces with all faces ordered counter clockwise when seen from outside
+
+    The orientation of the faces relative to each other must be consistent. If the enclosed volume is negative the orientation of all faces is inverted.
+
+    Args:
+      :vertices (array): Vertex coordinates of shape (:math:`N_v`, 3)
+
+      :faces (array): Vertex indices of the triangular faces of shape (:math:`N_f`, 3)
+    """
+    vertices = numpy.asarray(vertices, dtype=numpy.float64)
+    faces = numpy.asarray(faces, dtype=numpy.intp)
+    if vertices.ndim != 2 or vertices.shape[1] != 3 or faces.ndim != 2 or faces.shape[1] != 3:
+        log_and_raise_error(logger, "Invalid mesh. Vertices and faces must have the shapes (N_v, 3) and (N_f, 3) but have the shapes %s and %s." % (str(vertices.shape), str(faces.shape)))
+        return
+    if faces.min() < 0 or faces.max() >= len(vertices):
+        log_and_raise_error(logger, "Invalid mesh. Faces refer to vertices that do not exist.")
+        return
+    # Every directed edge must be matched by exactly one edge in opposite direction
+    edges = numpy.concatenate([faces[:,[0,1]], faces[:,[1,2]], faces[:,[2,0]]])
+    forward = set(map(tuple, edges))
+    backward = set(map(tuple, edges[:,::-1]))
+    if len(forward) != len(edges) or forward != backward:
+        log_and_raise_error(logger, "Invalid mesh. The surface is not closed or the orientation of its faces is inconsistent.")
+        return
+    if get_mesh_volume(vertices, faces) < 0:
+        faces = faces[:,::-1].copy()
+    return vertices, faces
+
+def get_mesh_volume(vertices, faces):
+    """
+    Return the (signed) volume enclosed by a closed triangulated surface
+
+    Args:
+      :vertices (array): Vertex coordinates of shape (:math:`N_v`, 3)
+
+      :faces (array): Vertex indices of the triangular faces of shape (:math:`N_f`, 3)
+    """
+    a, b, c = [vertices[faces[:,i]] for i in range(3)]
+    return (a * numpy.cross(b, c)).sum() / 6.
+
+def get_mesh_centroid(vertices, faces):
+    """
+    Return the centre of mass of the volume enclosed by a closed triangulated surface
+
+    Args:
+      :vertices (array): Vertex coordinates of shape (:math:`N_v`, 3)
+
+      :faces (array): Vertex indices of the triangular faces of shape (:math:`N_f`, 3)
+    """
+    a, b, c = [vertices[faces[:,i]] for i in range(3)]
+    w = (a * numpy.cross(b, c)).sum(axis=1)
+    return (w[:,numpy.newaxis] * (a + b + c)).sum(axis=0) / (4. * w.sum())
+
+def _phi1(w):
+    # (exp(w) - 1) / w for small |w|
+    return 1. + w*(1/2. + w*(1/6. + w*(1/24. + w/120.)))
+
+def _divided_difference_1(E_a, E_b, p_a, p_b):
+    # First divided difference of exp at z = -i p
+    d = p_b - p_a
+    small = abs(d) < _EPS_PHASE
+    dd = 1j * (E_b - E_a) / numpy.where(small, 1., d)
+    if small.any():
+        dd[small] = E_a[small] * _phi1(-1j * d[small])
+    return dd
+
+def _divided_difference_2(E, p):
+    # Second divided difference of exp at z = -i p for the three nodes along the first dimension of E and p
+    d01 = p[1] - p[0]
+    d12 = p[2] - p[1]
+    d20 = p[0] - p[2]
+    # Symmetric form, accurate if no two nodes are close to each other
+    bad = numpy.minimum(numpy.minimum(abs(d01), abs(d12)), abs(d20)) < _EPS_PHASE
+    d01[bad] = d12[bad] = 1.
+    d20[bad] = -2.
+    dd = E[0] * d12
+    dd += E[1] * d20
+    dd += E[2] * d01
+    dd /= d01 * d12 * d20
+    if bad.any():
+        dd[bad] = _divided_difference_2_stable(E[:,bad], p[:,bad])
+    return dd
+
+def _divided_difference_2_stable(E, p):
+    # Order the nodes by phase such that the first and the last node are the most distant ones
+    order = numpy.argsort(p, axis=0)
+    p = numpy.take_along_axis(p, order, axis=0)
+    E = numpy.take_along_axis(E, order, axis=0)
+    d = p[2] - p[0]
+    small = d < _EPS_PHASE
+    dd = 1j * (_divided_difference_1(E[1], E[2], p[1], p[2]) - _divided_difference_1(E[0], E[1], p[0], p[1])) / numpy.where(small, 1., d)
+    if small.any():
+        # Taylor expansion around the mean phase (power sums of the centred nodes, the first one vanishes)
+        p_m = p[:,small].mean(axis=0)
+        w = -1j * (p[:,small] - p_m)
+        s2 = (w**2).sum(axis=0)
+        s3 = (w**3).sum(axis=0)
+        s4 = (w**4).sum(axis=0)
+        dd[small] = numpy.exp(-1j * p_m) * (1/2. + s2/48. + s3/360. + (s2**2/8. + s4/4.)/720.)
+    return dd
+
+def polyhedron_form_factor(qmap, vertices, faces, out=None, chunk_bytes=None):
+    r"""
+    Return the Fourier transform :math:`A(\vec{q}) = \int_P e^{-i\vec{q}\cdot\vec{r}} \, d^3r` of the indicator function of a polyhedron in unit cubic meter (see :mod:`condor.utils.polyhedron_diffraction`)
+
+    Args:
+      :qmap (array): Scattering vectors in unit inverse meter with the components (:math:`q_x`, :math:`q_y`, :math:`q_z`) along the last dimension
+
+      :vertices (array): Vertex coordinates (:math:`x`, :math:`y`, :math:`z`) in unit meter of shape (:math:`N_v`, 3)
+
+      :faces (array): Vertex indices of the triangular faces of shape (:math:`N_f`, 3), counter clockwise seen from outside (see :func:`orient_mesh`)
+
+    Kwargs:
+      :out (array): If not ``None`` the result is written to this complex array of the shape ``qmap.shape[:-1]`` (default ``None``)
+
+      :chunk_bytes (int): Size of the temporary arrays of one chunk of scattering vectors in unit bytes. If ``None`` the value of ``CHUNK_BYTES`` is used (default ``None``)
+    """
+    if backend.get_kernels() is not None:
+        return backend.polyhedron_form_factor(qmap, vertices, faces, out=out)
+    qmap = numpy.asarray(qmap, dtype=numpy.float64)
+    vertices = numpy.asarray(vertices, dtype=numpy.float64)
+    faces = numpy.asarray(faces, dtype=numpy.intp)
+    if out is None:
+        out = numpy.empty(shape=qmap.shape[:-1], dtype=numpy.complex128)
+    q_flat = qmap.reshape(-1, 3)
+    out_flat = out.reshape(-1)
+    a, b, c = [vertices[faces[:,i]] for i in range(3)]
+    N = numpy.cross(b - a, c - a)
+    V = get_mesh_volume(vertices, faces)
+    centroid = get_mesh_centroid(vertices, faces)
+    R = numpy.sqrt(((vertices - centroid)**2).sum(axis=1)).max()
+    if chunk_bytes is None:
+        chunk_bytes = CHUNK_BYTES
+    # Temporary arrays per scattering vector: about 16 complex values per face
+    n = max(1, int(chunk_bytes // (16 * 16 * len(faces))))
+    for i0 in range(0, len(q_flat), n):
+        q = q_flat[i0:i0+n]
+        # Phases of all vertices
+        p_v = numpy.dot(vertices, q.T)
+        E_v = numpy.exp(-1j * p_v)
+        p = p_v[faces.T]
+        E = E_v[faces.T]
+        dd = _divided_difference_2(E, p)
+        q_sq = (q**2).sum(axis=1)
+        small = q_sq * R**2 < _EPS_QR**2
+        A = 1j * (numpy.dot(N, q.T) * dd).sum(axis=0) / numpy.where(small, 1., q_sq)
+        # Small-angle approximation (relative error of the order of (qR)^2)
+        if small.any():
+            A[small] = V * numpy.exp(-1j * numpy.dot(q[small], centroid))
+        out_flat[i0:i0+n] = A
+    return out
+
+def F_polyhedron_diffraction(K, qmap, vertices, faces, out=None):
+    r"""
+    Scattering amplitude from homogeneous polyhedron
+
+    .. math::
+
+      F(\vec{q}) = \sqrt{K} \cdot \frac{A(\vec{q})}{V}
+
+    with the Fourier transform :math:`A(\vec{q})` of the polyhedron (see :func:`polyhedron_form_factor`) and its volume :math:`V`.
+
+    Args:
+      :K (float): Intensity scaling factor :math:`K = I_0 \left(\rho_e \frac{p}{D} r_0 V\right)^2` (see :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`)
+
+      :qmap (array): See :func:`polyhedron_form_factor`
+
+      :vertices (array): See :func:`polyhedron_form_factor`
+
+      :faces (array): See :func:`polyhedron_form_factor`
+
+    Kwargs:
+      :out (array): See :func:`polyhedron_form_factor` (default ``None``)
+    """
+    F = polyhedron_form_factor(qmap, vertices, faces, out=out)
+    F *= numpy.sqrt(abs(K)) / get_mesh_volume(numpy.asarray(vertices, dtype=numpy.float64), numpy.asarray(faces, dtype=numpy.intp))
+    return F
@@ -0,0 +1,180 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+r"""
+Propagation of maps in the projection approximation
+
+The Fourier transform of a map at the scattering vectors :math:`\vec{q} = (q_x, q_y, q_z)` of the detector pixels (beam along :math:`z`) is calculated from projections of the map along the beam axis. Expanding the phase factor :math:`\exp(-i q_z z)` in a Taylor series around the centre :math:`z_c` of the map along the beam gives
+
+.. math::
+
+  F(\vec{q}) = e^{-i q_z z_c} \sum_{k=0}^{K} \frac{(-i q_z)^k}{k!} \hat{P}_k(q_x, q_y), \qquad P_k(x, y) = \int (z-z_c)^k \, m(x, y, z) \, dz
+
+The term :math:`k = 0` is the projection approximation, the higher order terms correct for the curvature of the Ewald sphere. The transforms :math:`\hat{P}_k` are evaluated with a 2D non-equispaced FFT: the (rotated) voxels are spread onto an oversampled 2D grid with a Kaiser-Bessel kernel, the grid is Fourier transformed and the transform is interpolated at (:math:`q_x`, :math:`q_y`) (see :mod:`condor.utils.fourier_volume`).
+
+The truncation error of the series is estimated by :math:`u^{K+1}/(K+1)!` with :math:`u = \max |q_z| \cdot \Delta z/2` and :math:`\Delta z` denoting the extent of the map along the beam. For small particles and small scattering angles the projection approximation (:math:`K = 0`) is sufficient.
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+import condor.utils.backend
+
+from .fourier_volume import KERNEL_WIDTH, get_kaiser_bessel_beta, _get_kernel_table, _get_stencils, _kernel_fourier
+
+# Maximum tolerated estimate of the relative truncation error of the curvature corrections
+PROJECTION_TOLERANCE = 1E-3
+# Maximum order of the curvature corrections that is chosen automatically
+PROJECTION_MAX_ORDER = 4
+# Oversampling of the 2D grids with respect to the voxel size
+PROJECTION_OVERSAMPLING = 2.
+
+def get_curvature_error(qz_max, dz, order):
+    r"""
+    Return the estimate of the relative truncation error :math:`u^{K+1}/(K+1)!` with :math:`u = q_{z,max} \Delta z/2` of the projection approximation with curvature corrections up to the given order
+
+    Args:
+      :qz_max (float): Maximum absolute value of the scattering vector components along the beam
+
+      :dz (float): Extent of the particle along the beam
+
+      :order (int): Order :math:`K` of the curvature corrections (``0`` for the plain projection approximation)
+    """
+    u = qz_max * dz / 2.
+    err = 1.
+    for k in range(1, order + 2):
+        err *= u / k
+    return err
+
+def get_curvature_order(qz_max, dz, tolerance=PROJECTION_TOLERANCE, max_order=PROJECTION_MAX_ORDER):
+    """
+    Return the lowest order of the curvature corrections for which the estimated truncation error (see :func:`get_curvature_error`) does not exceed the tolerance (``None`` if even the maximum order exceeds it)
+
+    Args:
+      :qz_max (float): Maximum absolute value of the scattering vector components along the beam
+
+      :dz (float): Extent of the particle along the beam
+
+    Kwargs:
+      :tolerance (float): Tolerated estimate of the relative truncation error (default ``PROJECTION_TOLERANCE``)
+
+      :max_order (int): Maximum order (default ``PROJECTION_MAX_ORDER``)
+    """
+    for order in range(max_order + 1):
+        if get_curvature_error(qz_max, dz, order) <= tolerance:
+            return order
+    return None
+
+def F_projection(map3d, dx, qmap, rotation=None, curvature_order=None, tolerance=PROJECTION_TOLERANCE):
+    r"""
+    Return the Fourier transform :math:`\sum_{\vec{n}} m_{\vec{n}} \exp(-i \vec{q} \cdot \vec{r}_{\vec{n}})` of a map (as :func:`condor.utils.nfft.nfft` but with scattering vectors in unit inverse meter) in the projection approximation with curvature corrections
+
+    Args:
+      :map3d (array): Cubic 3D map with the axes in the order (*z*, *y*, *x*) and the origin at index ``N//2``
+
+      :dx (float): Grid spacing of the map in unit meter
+
+      :qmap (array): Scattering vectors with the components (:math:`q_x`, :math:`q_y`, :math:`q_z`) along the last dimension, the beam is along :math:`z`
+
+    Kwargs:
+      :rotation: :class:`condor.utils.rotation.Rotation` instance that rotates the map into the frame of the scattering vectors. If ``None`` the map is not rotated (default ``None``)
+
+      :curvature_order (int): Order of the curvature corrections. If ``None`` the lowest order that meets the tolerance is chosen (default ``None``)
+
+      :tolerance (float): Tolerated estimate of the relative truncation error of the curvature corrections. A warning is issued if the estimate exceeds it (default ``PROJECTION_TOLERANCE``)
+    """
+    m = numpy.asarray(map3d)
+    if m.ndim != 3 or numpy.any(numpy.array(m.shape) != m.shape[0]):
+        log_and_raise_error(logger, "The map has to be a cubic 3D array. Current shape is: %s" % str(m.shape))
+        return
+    N = m.shape[0]
+    q = numpy.asarray(qmap, dtype=numpy.float64)
+    shape = q.shape[:-1]
+    # Scattering vectors in unit radian per voxel
+    q = q.reshape(-1, 3) * dx
+    F = numpy.zeros(q.shape[0], dtype=numpy.complex128)
+    # Positions of the non-zero voxels in unit voxels
+    iz, iy, ix = numpy.nonzero(m)
+    if len(iz) == 0:
+        return F.reshape(shape)
+    w = numpy.asarray(m[iz, iy, ix], dtype=numpy.complex128)
+    r = numpy.array([ix, iy, iz], dtype=numpy.float64).T - N//2
+    if rotation is not None:
+        r = r.dot(rotation.rotation_matrix.T)
+    z_c = (r[:,2].max() + r[:,2].min()) / 2.
+    dz = r[:,2].max() - r[:,2].min()
+    # Curvature corrections
+    qz_max = abs(q[:,2]).max()
+    K = curvature_order
+    if K is None:
+        K = get_curvature_order(qz_max, dz, tolerance=tolerance)
+        if K is None:
+            K = PROJECTION_MAX_ORDER
+            log_warning(logger, "Projection approximation is inaccurate even with curvature corrections of order %i (estimated error %e). Consider propagation=\'nfft\'." % (K, get_curvature_error(qz_max, dz, K)))
+        log_debug(logger, "Curvature corrections up to order %i." % K)
+    elif get_curvature_error(qz_max, dz, K) > tolerance:
+        log_warning(logger, "Projection approximation with curvature corrections of order %i is inaccurate (estimated error %e)." % (K, get_curvature_error(qz_max, dz, K)))
+    # Kaiser-Bessel kernel for spreading and interpolation
+    sigma = PROJECTION_OVERSAMPLING
+    W = KERNEL_WIDTH
+    beta = get_kaiser_bessel_beta(W, sigma)
+    table = _get_kernel_table("kaiser_bessel", W, beta)
+    # Spread the weighted voxels onto a 2D grid with spacing 1/sigma voxels (origin at index G//2)
+    u = r[:,:2] * sigma
+    G = 2 * int(numpy.ceil(abs(u).max() + W/2. + 1))
+    i_start, weights = _get_stencils(u + G//2, table, W)
+    P = condor.utils.backend.spread_moments(w, r[:,2] - z_c, K, i_start, weights, G)
+    # Deapodisation for the interpolation in Fourier space, zero padding and FFT
+    G2 = int(numpy.ceil(G * sigma))
+    G2 += G2 % 2
+    d = 1. / _kernel_fourier((numpy.arange(G) - G//2) / float(G2), "kaiser_bessel", W, beta)
+    P_hat = numpy.zeros(shape=(K + 1, G2, G2), dtype=numpy.complex128)
+    i0 = G2//2 - G//2
+    P_hat[:, i0:i0+G, i0:i0+G] = P * (d[:,numpy.newaxis] * d[numpy.newaxis,:])
+    P_hat = numpy.fft.fftshift(numpy.fft.fft2(numpy.fft.ifftshift(P_hat, axes=(1, 2))), axes=(1, 2))
+    # Interpolate at the scattering vectors (in unit cycles per grid sample)
+    c = q[:,:2] / (2*numpy.pi*sigma)
+    i_start, weights = _get_stencils(c * G2 + G2//2, table, W)
+    F_k = numpy.zeros(shape=(K + 1, q.shape[0]), dtype=numpy.complex128)
+    condor.utils.backend.interpolate_grids(P_hat, i_start, weights, F_k)
+    # Compensate the spreading kernel
+    nu = numpy.linspace(0., 0.5, 2049)
+    phi_hat = _kernel_fourier(nu, "kaiser_bessel", W, beta)
+    F_k /= numpy.interp(abs(c[:,0]), nu, phi_hat) * numpy.interp(abs(c[:,1]), nu, phi_hat)
+    # Sum the series
+    for k in range(K, -1, -1):
+        F = F * (-1j * q[:,2]) + F_k[k]
+    F *= numpy.exp(-1j * q[:,2] * z_c)
+    return F.reshape(shape)
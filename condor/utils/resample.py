@@ -89,8 +89,8 @@ def downsample(array2d0,factor0,mode="pick",mask2d0=None,bad_bits=None,min_N_pix
         Y,X = numpy.indices((Ny,Nx))
         Y = Y.flatten()
         X = X.flatten()
-        Y /= factor
-        X /= factor
+        Y //= factor
+        X //= factor
         superp = Y*Nx_new+X
         superp_order = superp.argsort()
         A = A[superp_order]
@@ -117,3 +117,93 @@ def downsample(array2d0,factor0,mode="pick",mask2d0=None,bad_bits=None,min_N_pix
                 BM[BN >= min_N_pixels] = BM[BN >= min_N_pixels] & ~bad_bits
             B[BN >= min_N_pixels] = B[BN >= min_N_pixels] * factor*factor /numpy.float64(BN[BN >= min_N_pixels])
             return [B.reshape((Ny_new,Nx_new)),BM.reshape((Ny_new,Nx_new))]
+
+
+# Default relative width of the cosine taper beyond the band limit (see resample_map_fourier)
+FOURIER_RESAMPLING_MARGIN = 0.5
+# Default zero-padding factor of the map before the Fourier transform (see resample_map_fourier)
+FOURIER_RESAMPLING_PADDING = 1.5
+# Maximum size of the temporary arrays of one chunk in unit bytes
+FOURIER_RESAMPLING_CHUNK_BYTES = 64*1024**2
+
+def get_fourier_resampling_grid(N, dx, q_band, margin=FOURIER_RESAMPLING_MARGIN, padding=FOURIER_RESAMPLING_PADDING):
+    """
+    Return the grid parameters of :func:`resample_map_fourier` as a tuple ``(N_padded, N_band, N_new, dx_new)``: edge length of the zero-padded map, of the cropped Fourier domain and of the resampled map (all in unit voxels) and the grid spacing of the resampled map
+
+    Args:
+      :N (int): Edge length of the map in unit voxels
+
+      :dx (float): Grid spacing of the map
+
+      :q_band (float): Band limit (maximum scattering vector component that has to be reproduced exactly, in unit of radians per unit of ``dx``)
+
+    Kwargs:
+      :margin (float): Relative width of the cosine taper of the Fourier domain beyond ``q_band`` (default ``FOURIER_RESAMPLING_MARGIN``)
+
+      :padding (float): Zero-padding factor of the map before the Fourier transform (default ``FOURIER_RESAMPLING_PADDING``)
+    """
+    N_padded = int(numpy.ceil(N*padding))
+    N_padded += N_padded % 2
+    # The taper has to end within the Nyquist limit of the new grid
+    N_band = int(numpy.ceil(N_padded*dx*q_band*(1+margin)/numpy.pi))
+    N_band += N_band % 2
+    dx_new = dx*N_padded/float(N_band)
+    # Crop the zero-padding again except for a few voxels that hold the tails of the (smooth) interpolation kernel
+    N_new = int(numpy.ceil(N*dx/dx_new)) + 2*int(numpy.ceil(2./margin))
+    N_new += (N_band - N_new) % 2
+    N_new = min(N_new, N_band)
+    return N_padded, N_band, N_new, dx_new
+
+def _resample_axis_fourier(a, N_padded, N_band, N_new, window):
+    # Resample along the first axis (chunks along the second axis limit the memory of the temporary arrays)
+    N = a.shape[0]
+    out = numpy.zeros(shape=tuple([N_new] + list(a.shape[1:])), dtype=a.dtype)
+    p0 = N_padded//2 - N//2
+    k0 = N_padded//2 - N_band//2
+    n0 = N_band//2 - N_new//2
+    w = window.reshape(tuple([N_band] + [1]*(a.ndim-1)))
+    n_chunk = max(1, int(FOURIER_RESAMPLING_CHUNK_BYTES // (16*N_padded*max(1, numpy.prod(a.shape[2:])))))
+    for j0 in range(0, a.shape[1], n_chunk):
+        j1 = min(j0+n_chunk, a.shape[1])
+        t = numpy.zeros(shape=tuple([N_padded, j1-j0] + list(a.shape[2:])), dtype=numpy.complex128)
+        t[p0:p0+N] = a[:,j0:j1]
+        # Index N_padded//2 (the centre of the map) is the origin
+        t = numpy.fft.fftshift(numpy.fft.fft(numpy.fft.ifftshift(t, axes=0), axis=0), axes=0)
+        t = t[k0:k0+N_band] * w
+        t = numpy.fft.fftshift(numpy.fft.ifft(numpy.fft.ifftshift(t, axes=0), axis=0), axes=0)
+        t = t[n0:n0+N_new] * (N_band/float(N_padded))
+        out[:,j0:j1] = t if numpy.iscomplexobj(out) else t.real
+    return out
+
+def resample_map_fourier(map3d, dx, q_band, margin=FOURIER_RESAMPLING_MARGIN, padding=FOURIER_RESAMPLING_PADDING):
+    r"""
+    Resample a 3D map on a coarser grid without changing its Fourier transform within a band limit and return the resampled map and its grid spacing
+
+    The map is zero-padded, Fourier transformed and cropped in the Fourier domain. Along every axis the Fourier coefficients are multiplied by a window that equals 1 for :math:`|q_i| \leq q_{\text{band}}` and decays with a cosine taper to 0 at :math:`|q_i| = (1+\text{margin})\,q_{\text{band}}`. The smooth window results in a compact interpolation kernel, which allows cropping the zero-padding again. The discrete Fourier transform of the resampled map (scaled by the voxel volume) agrees with the one of the original map for all scattering vectors within the band limit (relative errors of the order of :math:`10^{-3}` for maps with sharp edges).
+
+    The transform is separable and carried out axis by axis in chunks. The peak memory consumption is therefore not much larger than the size of the input map.
+
+    The centre voxel of the map (index ``N//2``) remains the centre voxel of the resampled map.
+
+    Args:
+      :map3d (array): Real or complex 3D map with equal edge lengths
+
+      :dx (float): Grid spacing of the map
+
+      :q_band (float): Band limit (maximum scattering vector component that has to be reproduced exactly, in unit of radians per unit of ``dx``)
+
+    Kwargs:
+      :margin (float): Relative width of the cosine taper of the Fourier domain beyond ``q_band`` (default ``FOURIER_RESAMPLING_MARGIN``)
+
+      :padding (float): Zero-padding factor of the map before the Fourier transform (default ``FOURIER_RESAMPLING_PADDING``)
+    """
+    N = map3d.shape[-1]
+    N_padded, N_band, N_new, dx_new = get_fourier_resampling_grid(N, dx, q_band, margin=margin, padding=padding)
+    q = numpy.abs(numpy.arange(N_band) - N_band//2) * 2*numpy.pi/(N_padded*dx)
+    t = numpy.clip((q - q_band)/(margin*q_band), 0., 1.)
+    window = 0.5*(1 + numpy.cos(numpy.pi*t))
+    dtype = numpy.complex128 if numpy.iscomplexobj(map3d) else numpy.float64
+    m = numpy.asarray(map3d, dtype=dtype)
+    for axis in range(3):
+        m = numpy.moveaxis(_resample_axis_fourier(numpy.moveaxis(m, axis, 0), N_padded, N_band, N_new, window), 0, axis)
+    return numpy.ascontiguousarray(m), dx_new
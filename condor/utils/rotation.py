@@ -297,8 +297,12 @@ class Rotations:
       :values (array): Arrays of values that define the rotation. For random rotations set ``values = None`` (default ``None``)
 
       :formalism (str): See :class:`condor.utils.rotation.Rotation`. For no rotation set ``formalism = None`` (default ``None``)
+
+      :point_group (str): Point group of the particle (see :mod:`condor.utils.symmetry`). If not ``None`` all rotations are replaced by their symmetry equivalents in the asymmetric unit and symmetry equivalent rotations in a sequence are removed, so that every distinct orientation of the particle occurs only once (default ``None``)
+
+      :rotation_mode (str): Either ``'extrinsic'`` (rotations of the particle) or ``'intrinsic'`` (rotations of the coordinate system), takes only effect if ``point_group`` is not ``None`` (default ``'extrinsic'``)
     """    
-    def __init__(self, values=None, formalism=None):
+    def __init__(self, values=None, formalism=None, point_group=None, rotation_mode="extrinsic"):
         """
        """
         if values is None and formalism is None:
@@ -331,6 +335,15 @@ class Rotations:
             self._rotations = []
             for i in range(len(values)):
                 self._rotations.append(Rotation(values[i], formalism=formalism))
+        # Restrict to the asymmetric unit of the point group (no rotation is the identity, which lies in the asymmetric unit)
+        self._point_group = point_group
+        self._point_group_side = "left" if rotation_mode == "intrinsic" else "right"
+        if point_group is not None and formalism not in [None,"random","random_x","random_y","random_z"]:
+            import condor.utils.symmetry
+            R = numpy.array([r.get_as_rotation_matrix() for r in self._rotations])
+            indices, R = condor.utils.symmetry.get_unique_rotation_matrices(R, point_group, side=self._point_group_side)
+            log_info(logger, "%i of %i rotations are distinct with respect to point group %s." % (len(R), len(self._rotations), point_group))
+            self._rotations = [Rotation(R_i, formalism="rotation_matrix") for R_i in R]
 
     def get_formalism(self):
         """
@@ -344,6 +357,9 @@ class Rotations:
         """
         if self._formalism in ["random","random_x","random_y","random_z"]:
             self._rotations[0]._set_as_random_formalism(self._formalism)
+            if self._point_group is not None:
+                import condor.utils.symmetry
+                self._rotations[0].rotation_matrix = condor.utils.symmetry.reduce_rotation_matrices(self._rotations[0].rotation_matrix, self._point_group, side=self._point_group_side)
         rotation =  self.get_current_rotation()
         self._i += 1
         return rotation
@@ -360,6 +376,18 @@ class Rotations:
         """
         return self._values
 
+    def get_point_group(self):
+        """
+        Return the name of the point group (``None`` if no point group is declared)
+        """
+        return self._point_group
+
+    def get_number_of_rotations(self):
+        """
+        Return the number of distinct rotations of the sequence (``1`` for random rotations)
+        """
+        return len(self._rotations)
+
 
 # CONVERSIONS BETWEEN THE DIFFERENT REPRESENTATIONS
 
@@ -34,54 +34,273 @@ from __future__ import print_function, absolute_import # Compatibility with pyth
 import numpy
 
 from .scattering_vector import generate_qmap
+from . import backend
 
-_F_sphere_diffraction = lambda K,q,r: numpy.sqrt(abs(K))*3*(numpy.sin(q*r)-q*r*numpy.cos(q*r))/((q*r)**3+numpy.finfo("float64").eps)
-F_sphere_diffraction = lambda K,q,r: ((q*r)**6 < numpy.finfo("float64").resolution)*numpy.sqrt(abs(K)) + ((q*r)**6 >= numpy.finfo("float64").resolution)*_F_sphere_diffraction(K,q,r)
-r"""
-Scattering amplitude from homogeneous sphere (ref. [Feigin1987]_)
+# Upper limit for the memory of one chunk of a stack of patterns in unit bytes
+STACK_CHUNK_BYTES = 256 * 1024**2
 
-.. math::
+# Below this value of x the form factor is evaluated by its Taylor series (the closed form suffers from cancellation)
+_X_TAYLOR = 0.1
 
-  F(q) = \sqrt{K} \cdot f(q)
+def _sphere_form_factor_exact(x, out=None):
+    if backend.get_kernels() is not None:
+        return backend.sphere_form_factor(x, out=out)
+    x = numpy.asarray(x, dtype=numpy.float64)
+    if x.ndim == 0:
+        x = x.reshape(1)
+    small = x < _X_TAYLOR
+    any_small = numpy.any(small)
+    if any_small:
+        # Copy before the output (which may share memory with x) is written
+        x2 = x[small]**2
+    # Evaluation of 3 (sin x - x cos x) / x^3 with few temporary arrays
+    xs = numpy.maximum(x, _X_TAYLOR)
+    f = numpy.cos(xs, out=out)
+    f *= xs
+    numpy.subtract(numpy.sin(xs), f, out=f)
+    f /= xs
+    f /= xs
+    f /= xs
+    f *= 3.
+    if any_small:
+        f[small] = 1. + x2*(-1./10. + x2*(1./280. + x2*(-1./15120. + x2*(1./1330560.))))
+    return f
 
-  f(q) =  \frac{ 3 \left[ \sin(qr) - qr \cos(qr) \right]}{ (qr)^3 }
+def _sphere_form_factor_derivative_exact(x):
+    x = numpy.array(x, dtype=numpy.float64, ndmin=1)
+    small = x < _X_TAYLOR
+    xs = numpy.where(small, _X_TAYLOR, x)
+    d = 3. * ((xs**2 - 3.) * numpy.sin(xs) + 3. * xs * numpy.cos(xs)) / xs**4
+    if numpy.any(small):
+        xx = x[small]
+        x2 = xx**2
+        d[small] = xx*(-1./5. + x2*(1./70. + x2*(-1./2520. + x2*(1./166320.))))
+    return d
 
-:math:`I_0`: Primary intensity on the sample in unit number of photons per square meter
 
-:math:`\rho_e`: Electron density in unit number of electrons per cubic meter
+class SphereFormFactorTable:
+    r"""
+    Lookup table of the sphere form factor :math:`f(x) = 3 \left[ \sin(x) - x \cos(x) \right] / x^3` for fast approximate evaluation
 
-:math:`p`: Pixel size (i.e. edge length) in unit meter
+    The table stores :math:`f` and its derivative on a uniform grid of :math:`x` and interpolates piecewise with cubic Hermite polynomials. All derivatives of :math:`f` are bounded by :math:`|f^{(n)}(x)| \leq 3/[(n+1)(n+3)]` and therefore the absolute interpolation error is bounded by :math:`h^4 \, (3/35) / 384` for grid spacing :math:`h`. The grid spacing is chosen such that this bound does not exceed the given tolerance (:math:`h \approx 0.08` for a tolerance of :math:`10^{-8}`). The table grows automatically if it is evaluated beyond its current range.
 
-:math:`D`: Detector distance in unit meter
+    The table does not depend on the size of the particle and can be shared by all evaluations of sphere and spheroid form factors (see :func:`get_sphere_form_factor_table`).
 
-:math:`r_0`: Classical electron radius in unit meter
+    Kwargs:
+      :tolerance (float): Maximum absolute error of :math:`f` (which is normalised to :math:`f(0) = 1`) (default ``1E-8``)
 
-:math:`V_r`: Sphere volume in unit cubic meter
+      :x_max (float): Initial range of the table (default ``100.``)
+    """
+    def __init__(self, tolerance=1E-8, x_max=100.):
+        self.tolerance = tolerance
+        self.h = (384. * 35. / 3. * tolerance)**0.25
+        self._coefficients = None
+        self.x_max = 0.
+        self._extend(x_max)
 
-Args:
-  :K (float): Intensity scaling factor :math:`K = I_0 \left(\rho_e \frac{p}{D} r_0 V_r\right)^2`
+    def _extend(self, x_max):
+        n = int(numpy.ceil(x_max / self.h)) + 1
+        x = numpy.arange(n + 1) * self.h
+        f = _sphere_form_factor_exact(x)
+        d = _sphere_form_factor_derivative_exact(x) * self.h
+        f0, f1, d0, d1 = f[:-1], f[1:], d[:-1], d[1:]
+        # Cubic Hermite polynomial in local coordinate s = (x - x_i)/h: c0 + c1 s + c2 s^2 + c3 s^3
+        C = numpy.empty(shape=(n, 4), dtype=numpy.float64)
+        C[:,0] = f0
+        C[:,1] = d0
+        C[:,2] = 3.*(f1 - f0) - 2.*d0 - d1
+        C[:,3] = 2.*(f0 - f1) + d0 + d1
+        # Store columns contiguously for fast gathering
+        self._coefficients = [numpy.ascontiguousarray(C[:,j]) for j in range(4)]
+        self.x_max = n * self.h
 
-  :q (float/array): :math:`q`: Length of scattering vector in unit inverse meter
+    def error_bound(self):
+        """
+        Return the upper bound of the absolute interpolation error
+        """
+        return self.h**4 * (3. / 35.) / 384.
 
-  :r (float): :math:`r`: Sphere radius in unit meter
-"""
+    def __call__(self, x, out=None):
+        """
+        Return the interpolated form factor for the given (non-negative) values of :math:`x`
 
-_I_sphere_diffraction = lambda K,q,r: abs(K)*(3*(numpy.sin(q*r)-q*r*numpy.cos(q*r))/((q*r)**3+numpy.finfo("float64").eps))**2
-I_sphere_diffraction = lambda K,q,r: ((q*r)**6 < numpy.finfo("float64").resolution)*abs(K) + ((q*r)**6 >= numpy.finfo("float64").resolution)*_I_sphere_diffraction(K,q,r)
-r"""
-Scattering Intensity from homogeneous sphere
+        Args:
+          :x (float/array): Argument of the form factor
 
-.. math::
+        Kwargs:
+          :out (array): If not ``None`` the result is written to this array of the same shape as ``x`` (default ``None``)
+        """
+        x = numpy.asarray(x, dtype=numpy.float64)
+        x_max = x.max() if x.size > 0 else 0.
+        if x_max >= self.x_max:
+            self._extend(1.5 * x_max)
+        t = x / self.h
+        i = t.astype(numpy.intp)
+        t -= i
+        c0, c1, c2, c3 = self._coefficients
+        # Horner scheme
+        f = numpy.take(c3, i, out=out)
+        f *= t
+        f += c2[i]
+        f *= t
+        f += c1[i]
+        f *= t
+        f += c0[i]
+        return f
 
-  I(q) = \left|F(q)\right|^2
+_tables = {}
 
-Args:
-  :K (float): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
+def get_sphere_form_factor_table(tolerance):
+    """
+    Return the shared :class:`condor.utils.sphere_diffraction.SphereFormFactorTable` instance for the given tolerance
 
-  :q (float/array): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
+    Args:
+      :tolerance (float): Maximum absolute error of the form factor
+    """
+    table = _tables.get(tolerance)
+    if table is None:
+        table = SphereFormFactorTable(tolerance=tolerance)
+        _tables[tolerance] = table
+    return table
 
-  :r (float): :math:`r`: See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
-"""
+def sphere_form_factor(x, table=None, out=None):
+    r"""
+    Return the normalised form factor of a homogeneous sphere
+
+    .. math::
+
+      f(x) = \frac{ 3 \left[ \sin(x) - x \cos(x) \right]}{ x^3 }
+
+    Args:
+      :x (float/array): :math:`x = qr`
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): If not ``None`` the form factor is interpolated from this table (default ``None``)
+
+      :out (array): If not ``None`` the result is written to this array of the same shape as ``x`` (default ``None``)
+    """
+    x = abs(numpy.asarray(x, dtype=numpy.float64))
+    if table is None:
+        if out is not None:
+            return _sphere_form_factor_exact(x, out=out)
+        return _sphere_form_factor_exact(x).reshape(x.shape)
+    else:
+        return table(x, out=out)
+
+def F_sphere_diffraction(K, q, r, table=None):
+    r"""
+    Scattering amplitude from homogeneous sphere (ref. [Feigin1987]_)
+
+    .. math::
+
+      F(q) = \sqrt{K} \cdot f(q)
+
+      f(q) =  \frac{ 3 \left[ \sin(qr) - qr \cos(qr) \right]}{ (qr)^3 }
+
+    :math:`I_0`: Primary intensity on the sample in unit number of photons per square meter
+
+    :math:`\rho_e`: Electron density in unit number of electrons per cubic meter
+
+    :math:`p`: Pixel size (i.e. edge length) in unit meter
+
+    :math:`D`: Detector distance in unit meter
+
+    :math:`r_0`: Classical electron radius in unit meter
+
+    :math:`V_r`: Sphere volume in unit cubic meter
+
+    Args:
+      :K (float): Intensity scaling factor :math:`K = I_0 \left(\rho_e \frac{p}{D} r_0 V_r\right)^2`
+
+      :q (float/array): :math:`q`: Length of scattering vector in unit inverse meter
+
+      :r (float): :math:`r`: Sphere radius in unit meter
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): If not ``None`` the form factor is interpolated from this table (default ``None``)
+    """
+    return numpy.sqrt(abs(K)) * sphere_form_factor(q*r, table=table)
+
+def I_sphere_diffraction(K, q, r, table=None):
+    r"""
+    Scattering Intensity from homogeneous sphere
+
+    .. math::
+
+      I(q) = \left|F(q)\right|^2
+
+    Args:
+      :K (float): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
+
+      :q (float/array): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
+
+      :r (float): :math:`r`: See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction` (default ``None``)
+    """
+    return abs(K) * sphere_form_factor(q*r, table=table)**2
+
+def iter_I_sphere_diffraction_stack(K, q, r, table=None, chunk_bytes=None):
+    """
+    Iterate over chunks of a stack of sphere diffraction patterns for many particle parameters on the same grid of scattering vectors
+
+    Every iteration yields a tuple of the index of the first pattern in the chunk and the chunk of intensity patterns with shape (:math:`N_{chunk}`, ) + ``q.shape``. The memory of one chunk does not exceed ``chunk_bytes`` (unless a single pattern is larger).
+
+    Args:
+      :K (float/array): Intensity scaling factor(s), see :func:`condor.utils.sphere_diffraction.F_sphere_diffraction`
+
+      :q (array): Lengths of the scattering vectors in unit inverse meter
+
+      :r (float/array): Sphere radius (radii) in unit meter. ``K`` and ``r`` are broadcast against each other to :math:`N` parameter combinations.
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction` (default ``None``)
+
+      :chunk_bytes (int): Maximum memory of one chunk in unit bytes. If ``None`` the value of ``condor.utils.sphere_diffraction.STACK_CHUNK_BYTES`` is used (default ``None``)
+    """
+    q = numpy.asarray(q, dtype=numpy.float64)
+    K, r = numpy.broadcast_arrays(numpy.asarray(K, dtype=numpy.float64).ravel(), numpy.asarray(r, dtype=numpy.float64).ravel())
+    N = len(r)
+    n_chunk = _get_chunk_length(q.size, chunk_bytes)
+    q_flat = q.ravel()
+    for i0 in range(0, N, n_chunk):
+        i1 = min(N, i0 + n_chunk)
+        I = numpy.multiply.outer(r[i0:i1], q_flat)
+        sphere_form_factor(I, table=table, out=I)
+        I *= I
+        I *= abs(K[i0:i1,numpy.newaxis])
+        yield i0, I.reshape((i1-i0,) + q.shape)
+
+def I_sphere_diffraction_stack(K, q, r, table=None, chunk_bytes=None):
+    """
+    Return stack of sphere diffraction patterns with shape (:math:`N`, ) + ``q.shape`` for :math:`N` particle parameters on the same grid of scattering vectors
+
+    The patterns are calculated in chunks of bounded memory (see :func:`condor.utils.sphere_diffraction.iter_I_sphere_diffraction_stack`, which also allows processing the chunks without holding the whole stack in memory).
+
+    Args:
+      :K (float/array): See :func:`condor.utils.sphere_diffraction.iter_I_sphere_diffraction_stack`
+
+      :q (array): See :func:`condor.utils.sphere_diffraction.iter_I_sphere_diffraction_stack`
+
+      :r (float/array): See :func:`condor.utils.sphere_diffraction.iter_I_sphere_diffraction_stack`
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): See :func:`condor.utils.sphere_diffraction.F_sphere_diffraction` (default ``None``)
+
+      :chunk_bytes (int): See :func:`condor.utils.sphere_diffraction.iter_I_sphere_diffraction_stack` (default ``None``)
+    """
+    N = numpy.broadcast(numpy.asarray(K).ravel(), numpy.asarray(r).ravel()).size
+    I = numpy.empty(shape=(N,) + numpy.shape(q), dtype=numpy.float64)
+    for i0, I_chunk in iter_I_sphere_diffraction_stack(K, q, r, table=table, chunk_bytes=chunk_bytes):
+        I[i0:i0+len(I_chunk)] = I_chunk
+    return I
+
+def _get_chunk_length(pattern_size, chunk_bytes=None):
+    if chunk_bytes is None:
+        chunk_bytes = STACK_CHUNK_BYTES
+    # Account for temporary arrays of the size of the chunk
+    return max(1, int(chunk_bytes // (2 * 8 * max(1, pattern_size))))
 
 #Fringe_sphere_diffraction = None
 
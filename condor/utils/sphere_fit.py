@@ -0,0 +1,241 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+"""
+Fast fitting of the analytical sphere model to measured diffraction patterns
+
+The fitter estimates the beam center, the sphere diameter and the intensity scale of a pattern in three steps:
+
+1. The center is located by the Friedel (point) symmetry of the pattern, using the masked projections of the pattern onto the detector axes.
+
+2. The masked radial profile around the center is compared with the tabulated sphere form factor for a grid of diameters. For every diameter the optimal intensity scale follows in closed form (linear least squares), so that the whole grid is evaluated by a few matrix products.
+
+3. The diameter is refined locally on successively finer grids around the best grid point.
+
+All geometry that depends only on the detector (pixel coordinates, scattering vectors of the radial bins, model profiles of the diameter grid) is precomputed once per :class:`SphereFitter` instance and reused for every frame. Many frames can be fitted in batch with :meth:`SphereFitter.fit_batch`.
+
+.. code-block:: python
+
+  fitter = condor.utils.sphere_fit.SphereFitter(detector, wavelength=1E-9, diameter_min=20E-9, diameter_max=200E-9)
+  res = fitter.fit_batch(frames)
+  res["diameter"], res["scale"], res["cx"], res["cy"]
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+from .scattering_vector import generate_absqmap
+from .sphere_diffraction import get_sphere_form_factor_table
+
+class SphereFitter:
+    r"""
+    Fitter of the sphere model :math:`I(q) = s \, f(q d / 2)^2` (with the sphere form factor :math:`f` normalised to :math:`f(0) = 1`) to diffraction patterns recorded with a given detector
+
+    The residual of the radial profile is weighted with the number of valid pixels per radial bin and with :math:`q^4`, which compensates the decay of the envelope of the sphere pattern (Porod's law) so that all fringes contribute to the fit.
+
+    Args:
+      :detector (:class:`condor.detector.Detector`): Detector that recorded the patterns. Its mask is applied to every frame and its (mean) center is the starting point of the center search.
+
+      :wavelength (float): Photon wavelength in unit meter
+
+      :diameter_min (float): Lower limit of the diameter in unit meter
+
+      :diameter_max (float): Upper limit of the diameter in unit meter
+
+    Kwargs:
+      :n_diameters (int): Number of diameters of the coarse grid. If ``None`` the grid spacing is chosen such that the fringes at the largest scattering vector shift by less than a quarter period between neighbouring grid points (default ``None``)
+
+      :max_shift (float): Maximum distance of the center from the detector center in unit pixel (default ``10.``)
+
+      :bin_width (float): Width of the radial bins in unit pixel (default ``1.``)
+
+      :n_refine (int): Number of refinement steps. Every step halves the uncertainty of the diameter (default ``8``)
+
+      :tolerance (float): Tolerance of the tabulated form factor, see :class:`condor.utils.sphere_diffraction.SphereFormFactorTable` (default ``1E-6``)
+    """
+    def __init__(self, detector, wavelength, diameter_min, diameter_max, n_diameters=None, max_shift=10., bin_width=1., n_refine=8, tolerance=1E-6):
+        if diameter_min <= 0 or diameter_max <= diameter_min:
+            log_and_raise_error(logger, "Invalid diameter range (%e m, %e m)." % (diameter_min, diameter_max))
+            return
+        self.detector = detector
+        self.wavelength = wavelength
+        self.max_shift = max_shift
+        self.bin_width = bin_width
+        self.n_refine = n_refine
+        self._table = get_sphere_form_factor_table(tolerance)
+        # Pixel coordinates with respect to the detector center
+        self.cx0 = detector.get_cx_mean_value()
+        self.cy0 = detector.get_cy_mean_value()
+        self._X, self._Y = detector.generate_xypix(cx=self.cx0, cy=self.cy0)
+        self.mask = detector.get_mask(boolmask=True)
+        # Radial bins (covering also shifted centers)
+        r_max = numpy.sqrt(self._X**2 + self._Y**2).max() + numpy.sqrt(2.) * max_shift
+        self._n_bins = int(numpy.ceil(r_max / bin_width)) + 1
+        r = (numpy.arange(self._n_bins) + 0.5) * bin_width
+        self.q = generate_absqmap(r.reshape(1, self._n_bins), numpy.zeros(shape=(1, self._n_bins)), detector.pixel_size, detector.distance, wavelength)[0]
+        self._q4 = (self.q / self.q.max())**4
+        # Coarse grid of diameters
+        if n_diameters is None:
+            n_diameters = int(numpy.ceil((diameter_max - diameter_min) * self.q.max() * 2. / numpy.pi)) + 1
+        self.diameters = numpy.linspace(diameter_min, diameter_max, max(n_diameters, 2))
+        self._models = self._get_models(self.diameters)
+
+    def _get_models(self, diameters):
+        x = numpy.multiply.outer(numpy.asarray(diameters) / 2., self.q)
+        f = self._table(x.ravel()).reshape(x.shape)
+        f *= f
+        return f
+
+    def get_center(self, image, mask=None):
+        """
+        Return the center (*x*, *y*) in unit pixel of a pattern estimated from its Friedel symmetry
+
+        Args:
+          :image (array): 2D pattern
+
+        Kwargs:
+          :mask (array): Boolean array of valid pixels that is combined with the mask of the detector (default ``None``)
+        """
+        M = self.mask if mask is None else (self.mask & mask)
+        # Balance the dynamic range of the pattern
+        A = numpy.sqrt(numpy.clip(image, 0., numpy.inf)) * M
+        cx = self._get_symmetry_center(A.sum(axis=0), M.sum(axis=0), self.cx0)
+        cy = self._get_symmetry_center(A.sum(axis=1), M.sum(axis=1), self.cy0)
+        return cx, cy
+
+    def _get_symmetry_center(self, a, m, c0):
+        # Mean value per column (or row)
+        v = numpy.float64(m > 0)
+        p = numpy.where(m > 0, a / numpy.maximum(m, 1), 0.)
+        # Mean squared difference between p(x) and p(s-x) for all s = 2c
+        n = numpy.convolve(v, v)
+        D = 2 * numpy.convolve(p**2, v) - 2 * numpy.convolve(p, p)
+        s = numpy.arange(len(D))
+        valid = (abs(s - 2*c0) <= 2*self.max_shift) & (n >= len(v) / 4.)
+        if not valid.any():
+            return c0
+        D = numpy.where(valid, D / numpy.maximum(n, 1), numpy.inf)
+        i = int(numpy.argmin(D))
+        # Parabolic interpolation
+        if 0 < i < len(D)-1 and numpy.isfinite(D[i-1]) and numpy.isfinite(D[i+1]):
+            den = D[i-1] - 2*D[i] + D[i+1]
+            if den > 0:
+                return (i + 0.5 * (D[i-1] - D[i+1]) / den) / 2.
+        return i / 2.
+
+    def get_radial_profile(self, image, cx, cy, mask=None):
+        """
+        Return the tuple of mean intensity and number of valid pixels for every radial bin around the given center
+
+        Args:
+          :image (array): 2D pattern
+
+          :cx (float): *x*-coordinate of the center in unit pixel
+
+          :cy (float): *y*-coordinate of the center in unit pixel
+
+        Kwargs:
+          :mask (array): Boolean array of valid pixels that is combined with the mask of the detector (default ``None``)
+        """
+        M = self.mask if mask is None else (self.mask & mask)
+        r = numpy.sqrt((self._X[M] - (cx - self.cx0))**2 + (self._Y[M] - (cy - self.cy0))**2)
+        i = numpy.minimum((r / self.bin_width).astype(numpy.intp), self._n_bins - 1)
+        n = numpy.bincount(i, minlength=self._n_bins)
+        y = numpy.bincount(i, weights=image[M], minlength=self._n_bins)
+        return y / numpy.maximum(n, 1), n
+
+    def fit(self, image, mask=None):
+        """
+        Fit a single pattern and return a dictionary with the diameter (``'diameter'``, unit meter), the intensity scale (``'scale'``, intensity at :math:`q=0` in the units of the pattern), the center (``'cx'``, ``'cy'``, unit pixel) and the normalised residual (``'error'``)
+
+        Args:
+          :image (array): 2D pattern
+
+        Kwargs:
+          :mask (array): Boolean array of valid pixels that is combined with the mask of the detector (default ``None``)
+        """
+        res = self.fit_batch(numpy.asarray(image)[numpy.newaxis], masks=None if mask is None else numpy.asarray(mask)[numpy.newaxis])
+        return dict([(k, v[0]) for k, v in res.items()])
+
+    def fit_batch(self, images, masks=None):
+        """
+        Fit a stack of patterns and return a dictionary of arrays (see :meth:`fit`)
+
+        Args:
+          :images (array): Stack of 2D patterns
+
+        Kwargs:
+          :masks (array): Stack of boolean arrays of valid pixels that are combined with the mask of the detector (default ``None``)
+        """
+        N = len(images)
+        cx = numpy.zeros(N)
+        cy = numpy.zeros(N)
+        Y = numpy.zeros(shape=(N, self._n_bins))
+        W = numpy.zeros(shape=(N, self._n_bins))
+        for i in range(N):
+            mask = None if masks is None else masks[i]
+            cx[i], cy[i] = self.get_center(images[i], mask)
+            Y[i], n = self.get_radial_profile(images[i], cx[i], cy[i], mask)
+            W[i] = n * self._q4
+        # Coarse grid search (with the optimal scale for every diameter)
+        WY = W * Y
+        S_yy = (WY * Y).sum(axis=1)
+        S_ym = numpy.dot(WY, self._models.T)
+        S_mm = numpy.dot(W, (self._models**2).T)
+        i_best = numpy.argmin(S_yy[:,numpy.newaxis] - S_ym**2 / S_mm, axis=1)
+        d = self.diameters[i_best]
+        # Local refinement
+        step = self.diameters[1] - self.diameters[0]
+        offsets = numpy.linspace(-1., 1., 5)
+        for level in range(self.n_refine):
+            d_local = numpy.clip(d[:,numpy.newaxis] + step * offsets, self.diameters[0], self.diameters[-1])
+            models = self._get_models(d_local)
+            S_ym = numpy.einsum("nb,nkb->nk", WY, models)
+            S_mm = numpy.einsum("nb,nkb->nk", W, models**2)
+            k_best = numpy.argmin(S_yy[:,numpy.newaxis] - S_ym**2 / S_mm, axis=1)
+            d = d_local[numpy.arange(N), k_best]
+            step /= 2.
+        models = self._get_models(d)
+        S_ym = (WY * models).sum(axis=1)
+        S_mm = (W * models**2).sum(axis=1)
+        scale = S_ym / S_mm
+        error = (S_yy - S_ym**2 / S_mm) / S_yy
+        return {
+            "diameter" : d,
+            "scale"    : scale,
+            "cx"       : cx,
+            "cy"       : cy,
+            "error"    : error,
+        }
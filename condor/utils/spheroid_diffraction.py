@@ -34,81 +34,257 @@ from __future__ import print_function, absolute_import # Compatibility with pyth
 import numpy
 
 from .scattering_vector import generate_qmap
+from .sphere_diffraction import sphere_form_factor, _get_chunk_length
+from . import backend
 #import rotation
 
-_q_spheroid_diffraction = lambda q_x, q_y: numpy.sqrt(q_x**2+q_y**2)
-_g_spheroid_diffraction = lambda q_x, q_y, theta, phi: numpy.arccos((numpy.cos(theta)*(1-numpy.finfo("float64").eps))*(-q_x*numpy.sin(phi)+q_y*numpy.cos(phi))/(_q_spheroid_diffraction(q_x,q_y)+numpy.finfo("float64").eps))
-_H_spheroid_diffraction = lambda q_x, q_y, a, c,theta, phi: numpy.sqrt(a**2*numpy.sin(_g_spheroid_diffraction(q_x,q_y,theta,phi))**2+c**2*numpy.cos(_g_spheroid_diffraction(q_x,q_y,theta,phi))**2)
-_qH_spheroid_diffraction = lambda q_x, q_y ,a, c,theta, phi: _q_spheroid_diffraction(q_x,q_y)*_H_spheroid_diffraction(q_x,q_y,a,c,theta,phi)
-_F_spheroid_diffraction = lambda K, q_x, q_y, a, c, theta, phi: numpy.sqrt(abs(K))*3.*(numpy.sin(_qH_spheroid_diffraction(q_x,q_y,a,c,theta,phi))-_qH_spheroid_diffraction(q_x,q_y,a,c,theta,phi)*numpy.cos(_qH_spheroid_diffraction(q_x,q_y,a,c,theta,phi)))/(_qH_spheroid_diffraction(q_x,q_y,a,c,theta,phi)**3+numpy.finfo("float64").eps)
-F_spheroid_diffraction = lambda K, q_x, q_y, a, c, theta, phi: (_qH_spheroid_diffraction(q_x,q_y,a,c,theta,phi)**6 < numpy.finfo("float64").resolution)*numpy.sqrt(abs(K)) + (_qH_spheroid_diffraction(q_x,q_y,a,c,theta,phi)**6 >= numpy.finfo("float64").resolution)*_F_spheroid_diffraction(K,q_x,q_y,a,c,theta,phi)
-r"""
-Scattering amplitude from homogeneous spheroid (ref. [Feigin1987]_, [Hamzeh1974]_)
+def qH_spheroid_diffraction(q_x, q_y, a, c, theta, phi, out=None):
+    r"""
+    Return the argument :math:`qH(\vec{q})` of the spheroid form factor (see :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`)
 
-The rotation axis is alligned parallel to the the :math:`y`-axis before the rotations by :math:`theta` and :math:`phi` are applied (see below).
+    The expression is evaluated in a single pass without trigonometric functions of the scattering vector. With :math:`q \cos(g) = \cos(\theta) \left( -q_x \sin(\phi) + q_y \cos(\phi) \right)` follows
 
-.. math::
+    .. math::
 
-  F(\vec{q}) = \sqrt{K} \cdot f(\vec{q})
+      (qH)^2 = a^2 q^2 + (c^2 - a^2) \, q^2 \cos^2(g)
 
-  f(\vec{q}) = \frac{ 3 \left[\sin(qH(\vec{q})) - qH \cos(qH(\vec{q})) \right]}{ (qH(\vec{q}))^3}
+    Args:
+      :q_x (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
 
-  H(\vec{q}) = \sqrt{a^2 \sin^2(g(\vec{q}))+c^2 \cos^2(g(\vec{q}))}
+      :q_y (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
 
-  g(\vec{q}) = \arccos\left( \frac{ -q_x \cos(\theta) sin(\phi) + q_y \cos(\theta) cos(\phi) }{ q } \right)
+      :a (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
 
-:math:`I_0`: Primary intensity on the sample in unit number of photons per square meter
+      :c (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
 
-:math:`\rho_e`: Electron density in unit number of electrons per cubic meter
+      :theta (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
 
-:math:`p`: Pixel size (i.e. edge length) in unit meter
+      :phi (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
 
-:math:`D`: Detector distance in unit meter
+    Kwargs:
+      :out (array): If not ``None`` the result is written to this array of the same shape as ``q_x`` (default ``None``)
+    """
+    q_x = numpy.asarray(q_x, dtype=numpy.float64)
+    q_y = numpy.asarray(q_y, dtype=numpy.float64)
+    if out is None:
+        out = numpy.empty(shape=numpy.broadcast(q_x, q_y).shape, dtype=numpy.float64)
+    # Projection of q onto the spheroid axis
+    u = numpy.multiply(q_x, -numpy.cos(theta)*numpy.sin(phi))
+    u += numpy.cos(theta)*numpy.cos(phi) * q_y
+    u *= u
+    u *= (c**2 - a**2)
+    qH = numpy.multiply(q_x, q_x, out=out)
+    qH += q_y**2
+    qH *= a**2
+    qH += u
+    # Rounding may produce tiny negative values for a > c
+    numpy.maximum(qH, 0., out=qH)
+    return numpy.sqrt(qH, out=qH)
 
-:math:`r_0`: Classical electron radius in unit meter
+def _spheroid_form_factor(q_x, q_y, a, c, theta, phi, table=None, out=None, qH=None):
+    if table is None and backend.get_kernels() is not None:
+        return backend.spheroid_form_factor(q_x, q_y, a, c, theta, phi, out=out)
+    qH = qH_spheroid_diffraction(q_x, q_y, a, c, theta, phi, out=qH)
+    return sphere_form_factor(qH, table=table, out=out)
 
-:math:`V_{a,c}`: Spheroid volume in unit cubic meter
+def F_spheroid_diffraction(K, q_x, q_y, a, c, theta, phi, table=None, out=None):
+    r"""
+    Scattering amplitude from homogeneous spheroid (ref. [Feigin1987]_, [Hamzeh1974]_)
 
-Args:
-  :K (float): Intensity scaling factor :math:`K = I_0 \left(\rho_e \frac{p}{D} r_0 V_{a,c}\right)^2`
+    The rotation axis is alligned parallel to the the :math:`y`-axis before the rotations by :math:`theta` and :math:`phi` are applied (see below).
 
-  :q_x (float/array): :math:`q_x`: :math:`x`-coordinate of scattering vector in unit inverse meter
+    .. math::
 
-  :q_y (float/array): :math:`q_y`: :math:`y`-coordinate of scattering vector in unit inverse meter
+      F(\vec{q}) = \sqrt{K} \cdot f(\vec{q})
 
-  :a (float): :math:`a`: radius perpendicular to the rotation axis of the ellipsoid in unit meter
+      f(\vec{q}) = \frac{ 3 \left[\sin(qH(\vec{q})) - qH \cos(qH(\vec{q})) \right]}{ (qH(\vec{q}))^3}
 
-  :c (float): :math:`c`: radius along the rotation axis of the ellipsoid in unit meter
+      H(\vec{q}) = \sqrt{a^2 \sin^2(g(\vec{q}))+c^2 \cos^2(g(\vec{q}))}
 
-  :theta (float): :math:`\theta`: extrinisc rotation around :math:`x`-axis (1st, counter clockwise / right hand rule)
+      g(\vec{q}) = \arccos\left( \frac{ -q_x \cos(\theta) sin(\phi) + q_y \cos(\theta) cos(\phi) }{ q } \right)
 
-  :phi (float): :math:`\phi`: extrinsic rotation around :math:`z`-axis (2nd, counter clockwise / right hand rule)
-"""
+    :math:`I_0`: Primary intensity on the sample in unit number of photons per square meter
 
-_I_spheroid_diffraction = lambda K, qX, qY, a, c, theta, phi: abs(K)*(3.*(numpy.sin(_qH_spheroid_diffraction(qX,qY,a,c,theta,phi))-_qH_spheroid_diffraction(qX,qY,a,c,theta,phi)*numpy.cos(_qH_spheroid_diffraction(qX,qY,a,c,theta,phi)))/(_qH_spheroid_diffraction(qX,qY,a,c,theta,phi)**3+numpy.finfo("float64").eps))**2
-I_spheroid_diffraction = lambda K, qX, qY, a, c, theta, phi: (_qH_spheroid_diffraction(qX,qY,a,c,theta,phi)**6 < numpy.finfo("float64").resolution)*abs(K) + (_qH_spheroid_diffraction(qX,qY,a,c,theta,phi)**6 >= numpy.finfo("float64").resolution)*_I_spheroid_diffraction(K,qX,qY,a,c,theta,phi)
-r"""
-Scattering Intensity from homogeneous spheroid
+    :math:`\rho_e`: Electron density in unit number of electrons per cubic meter
 
-.. math::
+    :math:`p`: Pixel size (i.e. edge length) in unit meter
 
-  I = \left|F\right|^2
+    :math:`D`: Detector distance in unit meter
 
-Args:
-  :K (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+    :math:`r_0`: Classical electron radius in unit meter
 
-  :q_x (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+    :math:`V_{a,c}`: Spheroid volume in unit cubic meter
 
-  :q_y (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+    Args:
+      :K (float): Intensity scaling factor :math:`K = I_0 \left(\rho_e \frac{p}{D} r_0 V_{a,c}\right)^2`
 
-  :a (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+      :q_x (float/array): :math:`q_x`: :math:`x`-coordinate of scattering vector in unit inverse meter
 
-  :c (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+      :q_y (float/array): :math:`q_y`: :math:`y`-coordinate of scattering vector in unit inverse meter
 
-  :theta (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+      :a (float): :math:`a`: radius perpendicular to the rotation axis of the ellipsoid in unit meter
 
-  :phi (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
-"""
+      :c (float): :math:`c`: radius along the rotation axis of the ellipsoid in unit meter
+
+      :theta (float): :math:`\theta`: extrinisc rotation around :math:`x`-axis (1st, counter clockwise / right hand rule)
+
+      :phi (float): :math:`\phi`: extrinsic rotation around :math:`z`-axis (2nd, counter clockwise / right hand rule)
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): If not ``None`` the form factor is interpolated from this table (default ``None``)
+
+      :out (array): If not ``None`` the result is written to this array. If ``theta`` and ``phi`` are given as arrays of :math:`N` orientations it must have the shape (:math:`N`, ) + ``q_x.shape``, otherwise the shape of ``q_x`` (default ``None``)
+
+    If ``theta`` and ``phi`` are arrays the patterns of all orientations are returned in a stack of shape (:math:`N`, ) + ``q_x.shape``.
+    """
+    q_x = numpy.asarray(q_x, dtype=numpy.float64)
+    q_y = numpy.asarray(q_y, dtype=numpy.float64)
+    if numpy.ndim(theta) > 0 or numpy.ndim(phi) > 0:
+        theta, phi = numpy.broadcast_arrays(numpy.asarray(theta, dtype=numpy.float64).ravel(), numpy.asarray(phi, dtype=numpy.float64).ravel())
+        if out is None:
+            out = numpy.empty(shape=(len(theta),) + q_x.shape, dtype=numpy.float64)
+        qH = numpy.empty(shape=q_x.shape, dtype=numpy.float64)
+        for i in range(len(theta)):
+            _spheroid_form_factor(q_x, q_y, a, c, theta[i], phi[i], table=table, out=out[i], qH=qH)
+        out *= numpy.sqrt(abs(K))
+        return out
+    F = _spheroid_form_factor(q_x, q_y, a, c, theta, phi, table=table, out=out)
+    F *= numpy.sqrt(abs(K))
+    return F
+
+def F_spheroid_diffraction_3d(K, qmap, a, c, axis, table=None, out=None):
+    r"""
+    Scattering amplitude from homogeneous spheroid on a grid of three-dimensional scattering vectors (e.g. a Fourier volume)
+
+    The argument of the form factor (see :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`) is evaluated in vector form
+
+    .. math::
+
+      (qH)^2 = a^2 q^2 + (c^2 - a^2) \, (\vec{q} \cdot \vec{n})^2
+
+    with :math:`\vec{n}` the unit vector along the rotation axis of the spheroid. The grid is processed in slabs along the first dimension to keep the temporary arrays small.
+
+    Args:
+      :K (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :qmap (array): Scattering vectors in unit inverse meter with the components (:math:`q_x`, :math:`q_y`, :math:`q_z`) along the last dimension (e.g. output of :meth:`condor.detector.Detector.generate_qmap_3d` with ``order='xyz'``)
+
+      :a (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :c (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :axis (array): Vector (:math:`x`, :math:`y`, :math:`z`) along the rotation axis of the spheroid
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction` (default ``None``)
+
+      :out (array): If not ``None`` the result is written to this array of the shape ``qmap.shape[:-1]`` (default ``None``)
+    """
+    qmap = numpy.asarray(qmap, dtype=numpy.float64)
+    n = numpy.asarray(axis, dtype=numpy.float64)
+    n = n / numpy.sqrt((n**2).sum())
+    if out is None:
+        out = numpy.empty(shape=qmap.shape[:-1], dtype=numpy.float64)
+    if qmap.ndim <= 2:
+        slabs = [(qmap.reshape(-1, 3), out.reshape(-1))]
+    else:
+        slabs = zip(qmap, out)
+    for q_slab, out_slab in slabs:
+        u = numpy.dot(q_slab, n)
+        u *= u
+        u *= (c**2 - a**2)
+        qH = numpy.einsum("...i,...i->...", q_slab, q_slab)
+        qH *= a**2
+        qH += u
+        # Rounding may produce tiny negative values for a > c
+        numpy.maximum(qH, 0., out=qH)
+        numpy.sqrt(qH, out=qH)
+        sphere_form_factor(qH, table=table, out=out_slab)
+    out *= numpy.sqrt(abs(K))
+    return out
+
+def I_spheroid_diffraction(K, q_x, q_y, a, c, theta, phi, table=None):
+    r"""
+    Scattering Intensity from homogeneous spheroid
+
+    .. math::
+
+      I = \left|F\right|^2
+
+    Args:
+      :K (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :q_x (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :q_y (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :a (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :c (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :theta (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :phi (float): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction` (default ``None``)
+    """
+    F = F_spheroid_diffraction(abs(K), q_x, q_y, a, c, theta, phi, table=table)
+    F *= F
+    return F
+
+def iter_I_spheroid_diffraction_stack(K, q_x, q_y, a, c, theta, phi, table=None, chunk_bytes=None):
+    """
+    Iterate over chunks of a stack of spheroid diffraction patterns for many particle parameters (size, shape and orientation) on the same grid of scattering vectors
+
+    Every iteration yields a tuple of the index of the first pattern in the chunk and the chunk of intensity patterns with shape (:math:`N_{chunk}`, ) + ``q_x.shape``. The memory of one chunk does not exceed ``chunk_bytes`` (unless a single pattern is larger).
+
+    Args:
+      :K (float/array): Intensity scaling factor(s), see :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :q_x (array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :q_y (array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :a (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :c (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :theta (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`
+
+      :phi (float/array): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction`. The parameters ``K``, ``a``, ``c``, ``theta`` and ``phi`` are broadcast against each other to :math:`N` parameter combinations.
+
+    Kwargs:
+      :table (:class:`condor.utils.sphere_diffraction.SphereFormFactorTable`): See :func:`condor.utils.spheroid_diffraction.F_spheroid_diffraction` (default ``None``)
+
+      :chunk_bytes (int): Maximum memory of one chunk in unit bytes. If ``None`` the value of ``condor.utils.sphere_diffraction.STACK_CHUNK_BYTES`` is used (default ``None``)
+    """
+    q_x = numpy.asarray(q_x, dtype=numpy.float64)
+    q_y = numpy.asarray(q_y, dtype=numpy.float64)
+    K, a, c, theta, phi = numpy.broadcast_arrays(*[numpy.asarray(v, dtype=numpy.float64).ravel() for v in [K, a, c, theta, phi]])
+    N = len(K)
+    n_chunk = _get_chunk_length(q_x.size, chunk_bytes)
+    qH = numpy.empty(shape=q_x.shape, dtype=numpy.float64)
+    for i0 in range(0, N, n_chunk):
+        i1 = min(N, i0 + n_chunk)
+        I = numpy.empty(shape=(i1-i0,) + q_x.shape, dtype=numpy.float64)
+        for j, i in enumerate(range(i0, i1)):
+            _spheroid_form_factor(q_x, q_y, a[i], c[i], theta[i], phi[i], table=table, out=I[j], qH=qH)
+            I[j] *= I[j]
+            I[j] *= abs(K[i])
+        yield i0, I
+
+def I_spheroid_diffraction_stack(K, q_x, q_y, a, c, theta, phi, table=None, chunk_bytes=None):
+    """
+    Return stack of spheroid diffraction patterns with shape (:math:`N`, ) + ``q_x.shape`` for :math:`N` particle parameters on the same grid of scattering vectors
+
+    The patterns are calculated in chunks of bounded memory (see :func:`condor.utils.spheroid_diffraction.iter_I_spheroid_diffraction_stack`, which also allows processing the chunks without holding the whole stack in memory). For the arguments see :func:`condor.utils.spheroid_diffraction.iter_I_spheroid_diffraction_stack`.
+    """
+    N = numpy.broadcast(*[numpy.asarray(v).ravel() for v in [K, a, c, theta, phi]]).size
+    I = numpy.empty(shape=(N,) + numpy.shape(q_x), dtype=numpy.float64)
+    for i0, I_chunk in iter_I_spheroid_diffraction_stack(K, q_x, q_y, a, c, theta, phi, table=table, chunk_bytes=chunk_bytes):
+        I[i0:i0+len(I_chunk)] = I_chunk
+    return I
 
 to_spheroid_semi_diameter_a = lambda diameter,flattening: flattening**(1/3.)*diameter/2.
 """
@@ -0,0 +1,192 @@
+# -----------------------------------------------------------------------------------------------------
+# CONDOR
+# Simulator for diffractive single-particle imaging experiments with X-ray lasers
+# http://xfel.icm.uu.se/condor/
+# -----------------------------------------------------------------------------------------------------
+# Copyright 2016 Max Hantke, Filipe R.N.C. Maia, Tomas Ekeberg
+# Condor is distributed under the terms of the BSD 2-Clause License
+# -----------------------------------------------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------------------------------
+# General note:
+# All variables are in SI units by default. Exceptions explicit by variable name.
+# -----------------------------------------------------------------------------------------------------
+r"""
+Point-group symmetry of particles
+
+A particle whose map is invariant under the rotations :math:`g` of a point group :math:`G` gives identical diffraction patterns for the orientations :math:`R` and :math:`R g`. All orientations are therefore represented by the orientations in an asymmetric unit of :math:`G`, here the orientations that are closer to the identity than any of their symmetry equivalents (largest trace of the rotation matrix). Likewise the Fourier transform of the map satisfies :math:`F(g \vec{q}) = F(\vec{q})` and it is sufficient to know it in an asymmetric unit of reciprocal space, here the cone of scattering vectors that are closer to a reference direction than any of their symmetry equivalents.
+
+Supported point groups (rotation axes in the frame of the map, axes *x*, *y*, *z*):
+
+  - ``'C<n>'`` - cyclic group of order *n* with the rotation axis along *z* (e.g. ``'C2'``)
+
+  - ``'D<n>'`` - dihedral group of order *2n* with the *n*-fold axis along *z* and a 2-fold axis along *x* (e.g. ``'D2'``)
+
+  - ``'T'`` - tetrahedral group (order 12) with the 2-fold axes along *x*, *y* and *z*
+
+  - ``'O'`` - octahedral group (order 24) with the 4-fold axes along *x*, *y* and *z* (symmetry of ``geometry='cube'``)
+
+  - ``'I'`` - icosahedral group (order 60) with the 2-fold axes along *x*, *y* and *z* (symmetry of ``geometry='icosahedron'``)
+"""
+from __future__ import print_function, absolute_import # Compatibility with python 2 and 3
+import numpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .log import log_and_raise_error,log_warning,log_info,log_debug
+
+import condor.utils.rotation
+
+# Reference direction for the asymmetric unit in reciprocal space (not on any symmetry axis of the supported groups)
+REFERENCE_DIRECTION = numpy.array([1., numpy.sqrt(2.), numpy.sqrt(3.)+0.1]) / numpy.sqrt(6.+0.2*numpy.sqrt(3.)+0.01)
+
+_point_groups = {}
+
+def _axis_rotation(axis, angle):
+    axis = numpy.asarray(axis, dtype=numpy.float64)
+    axis = axis / numpy.sqrt((axis**2).sum())
+    q = condor.utils.rotation.quat(angle, axis[0], axis[1], axis[2])
+    return condor.utils.rotation.rotmx_from_quat(q)
+
+def _close_group(generators):
+    # All products of the generators
+    elements = [numpy.identity(3)]
+    new = list(elements)
+    while len(new) > 0:
+        products = []
+        for a in new:
+            for b in generators:
+                c = a.dot(b)
+                if not any([numpy.allclose(c, e, atol=1E-9) for e in elements + products]):
+                    products.append(c)
+        elements += products
+        new = products
+    return numpy.array(elements)
+
+def get_point_group(name):
+    r"""
+    Return the rotation matrices (acting on vectors with the components *x*, *y*, *z*) of a point group as array of shape (:math:`|G|`, 3, 3), the first element is the identity
+
+    Args:
+      :name (str): Name of the point group (see :mod:`condor.utils.symmetry`)
+    """
+    if name in _point_groups:
+        return _point_groups[name]
+    phi = (1+numpy.sqrt(5))/2.
+    if len(name) > 1 and name[0] in ["C", "D"] and name[1:].isdigit() and int(name[1:]) > 0:
+        n = int(name[1:])
+        generators = [_axis_rotation([0., 0., 1.], 2*numpy.pi/n)]
+        if name[0] == "D":
+            generators.append(_axis_rotation([1., 0., 0.], numpy.pi))
+    elif name == "T":
+        generators = [_axis_rotation([0., 0., 1.], numpy.pi), _axis_rotation([1., 1., 1.], 2*numpy.pi/3.)]
+    elif name == "O":
+        generators = [_axis_rotation([0., 0., 1.], numpy.pi/2.), _axis_rotation([1., 1., 1.], 2*numpy.pi/3.)]
+    elif name == "I":
+        # 5-fold axis through the vertex (0, phi, 1) of the icosahedron (see condor.utils.polyhedron_diffraction.get_icosahedron_mesh)
+        generators = [_axis_rotation([0., 0., 1.], numpy.pi), _axis_rotation([1., 1., 1.], 2*numpy.pi/3.), _axis_rotation([0., phi, 1.], 2*numpy.pi/5.)]
+    else:
+        log_and_raise_error(logger, "Point group %s is invalid. Choose one of the following: C<n>, D<n>, T, O, I." % name)
+        return
+    G = _close_group(generators)
+    # Exact zeros and ones where possible
+    G[abs(G) < 1E-12] = 0.
+    G.flags.writeable = False
+    _point_groups[name] = G
+    log_debug(logger, "Point group %s of order %i." % (name, len(G)))
+    return G
+
+def reduce_rotation_matrices(R, point_group, side="right"):
+    r"""
+    Return the symmetry equivalents of the given rotations in the asymmetric unit of a point group, i.e. :math:`R g` (or :math:`g R` for ``side='left'``) with :math:`g` chosen such that the trace is maximal
+
+    Args:
+      :R (array): Rotation matrices of shape (..., 3, 3)
+
+      :point_group (str): Name of the point group (see :func:`get_point_group`)
+
+    Kwargs:
+      :side (str): ``'right'`` for extrinsic rotations of the particle, ``'left'`` for rotations of the coordinate system (intrinsic rotations) (default ``'right'``)
+    """
+    G = get_point_group(point_group)
+    R = numpy.asarray(R, dtype=numpy.float64)
+    # trace(R g) = sum_ij R_ij g_ji (also for g R)
+    traces = numpy.einsum("...ij,nji->...n", R, G)
+    g = G[numpy.argmax(traces - 1E-9*numpy.arange(len(G)), axis=-1)]
+    if side == "right":
+        return numpy.einsum("...ij,...jk->...ik", R, g)
+    elif side == "left":
+        return numpy.einsum("...ij,...jk->...ik", g, R)
+    else:
+        log_and_raise_error(logger, "Side %s is invalid. Choose either \'right\' or \'left\'." % side)
+
+def get_unique_rotation_matrices(R, point_group, side="right", tolerance=1E-6):
+    """
+    Return the indices of the first occurrences of the orientations that are not symmetry equivalent to any preceding orientation and their equivalents in the asymmetric unit (see :func:`reduce_rotation_matrices`)
+
+    Args:
+      :R (array): Rotation matrices of shape (:math:`N`, 3, 3)
+
+      :point_group (str): Name of the point group (see :func:`get_point_group`)
+
+    Kwargs:
+      :side (str): See :func:`reduce_rotation_matrices` (default ``'right'``)
+
+      :tolerance (float): Maximum absolute difference of the elements of rotation matrices that are considered equal (default ``1E-6``)
+    """
+    R_red = reduce_rotation_matrices(R, point_group, side=side)
+    # Group candidates by rounded values and compare exactly within the groups
+    keys = numpy.round(R_red.reshape(-1, 9) / (10*tolerance)).astype(numpy.int64)
+    seen = {}
+    indices = []
+    for i, k in enumerate(map(tuple, keys)):
+        if not any([numpy.allclose(R_red[i], R_red[j], atol=tolerance, rtol=0.) for j in seen.get(k, [])]):
+            indices.append(i)
+        seen.setdefault(k, []).append(i)
+    indices = numpy.array(indices, dtype=int)
+    return indices, R_red[indices]
+
+def fold_vectors(v, point_group, order="xyz"):
+    r"""
+    Return the symmetry equivalents :math:`g \vec{v}` of the given vectors in the asymmetric unit of a point group, i.e. the equivalents that are closest to the direction ``REFERENCE_DIRECTION``
+
+    Args:
+      :v (array): Vectors with the components along the last dimension
+
+      :point_group (str): Name of the point group (see :func:`get_point_group`)
+
+    Kwargs:
+      :order (str): Order of the components, either ``'xyz'`` or ``'zyx'`` (default ``'xyz'``)
+    """
+    G = get_point_group(point_group)
+    d = REFERENCE_DIRECTION
+    if order == "zyx":
+        G = G[:, ::-1, ::-1]
+        d = d[::-1]
+    elif order != "xyz":
+        log_and_raise_error(logger, "Order %s is invalid." % order)
+        return
+    v = numpy.asarray(v, dtype=numpy.float64)
+    # (g v) . d = v . (g^T d)
+    A = numpy.einsum("nij,i->nj", G, d)
+    g = G[numpy.argmax(v.dot(A.T), axis=-1)]
+    return numpy.einsum("...ij,...j->...i", g, v)
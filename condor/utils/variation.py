@@ -208,6 +208,60 @@ class Variation:
         self._i += 1        
         return v1
         
+    def get_quadrature(self, v0, order):
+        """
+        Return nodes and weights of a quadrature rule for the expectation value of a function of the varied variable (only for one-dimensional variations)
+
+        For ``mode='normal'`` the Gauss-Hermite rule and for ``mode='uniform'`` the Gauss-Legendre rule of the given order is returned. These rules are exact for polynomials of degree up to ``2*order-1``. For ``mode='range'`` the nodes are the values of the sequence with equal weights. Without variation the only node is ``v0``.
+
+        Args:
+          :v0 (float): Value without variational deviation
+
+          :order (int): Number of quadrature nodes
+        """
+        if self._number_of_dimensions != 1:
+            log_and_raise_error(logger, "Quadrature rules are only implemented for one-dimensional variations.")
+            return
+        if self._mode is None or (self._mode in ["normal","uniform"] and self._spread[0] <= 0):
+            x = numpy.array([v0], dtype=numpy.float64)
+            w = numpy.array([1.])
+        elif self._mode == "normal":
+            x, w = numpy.polynomial.hermite_e.hermegauss(order)
+            # Discard nodes far out in the tails that have no numerical weight
+            relevant = w > 1E-16 * w.max()
+            x = v0 + self._spread[0] * x[relevant]
+            w = w[relevant] / w[relevant].sum()
+        elif self._mode == "uniform":
+            x, w = numpy.polynomial.legendre.leggauss(order)
+            x = v0 + self._spread[0]/2. * x
+            w = w / 2.
+        elif self._mode == "range":
+            x = v0 + numpy.linspace(-self._spread[0]/2., self._spread[0]/2., self.n)
+            w = numpy.ones(self.n) / float(self.n)
+        else:
+            log_and_raise_error(logger, "Quadrature rules are not implemented for variation mode %s." % self._mode)
+            return
+        return x, w
+        
+    def get_quadrature_order(self, frequency):
+        """
+        Return the number of quadrature nodes (see :meth:`condor.utils.variation.Variation.get_quadrature`) that suffices to average a function that oscillates with the given maximum angular frequency with respect to the varied variable
+
+        For ``mode='normal'`` the Gauss-Hermite rule requires about :math:`k^2/2` nodes with :math:`k` the product of frequency and standard deviation, for ``mode='uniform'`` the Gauss-Legendre rule about one node per half period within the spread.
+
+        Args:
+          :frequency (float): Maximum angular frequency in units of the inverse variable
+        """
+        if self._mode == "normal":
+            k = frequency * self._spread[0]
+            return int(numpy.ceil(k**2/2. + 2*k + 8))
+        elif self._mode == "uniform":
+            return int(numpy.ceil(frequency * self._spread[0] / 2. + 8))
+        elif self._mode == "range":
+            return self.n
+        else:
+            return 1
+        
     def _get_values_for_one_dim(self,v0,dim):
         if self._mode is None:
             v1 = v0
@@ -245,6 +245,10 @@ setup(
     #    'dev': ['check-manifest'],
     #    'test': ['coverage'],
     #},
+    extras_require={
+        # Compiled kernels (see condor.utils.backend)
+        'numba': ['numba'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
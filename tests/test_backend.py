@@ -0,0 +1,64 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+from condor.utils import backend, sphere_diffraction, spheroid_diffraction, diffraction, projection, bodies
+
+def _propagate(par, polarization):
+    numpy.random.seed(0)
+    src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6, polarization=polarization)
+    det = condor.Detector(distance=0.74, pixel_size=600E-6, nx=64, ny=48, cx=30.3, cy=20.)
+    E = condor.Experiment(src, {par[0] : par[1]}, det)
+    return E.propagate()["entry_1"]["data_1"]["data_fourier"]
+
+@unittest.skipIf(backend.numba is None, "Numba is not installed")
+class TestCaseBackend(unittest.TestCase):
+    def tearDown(self):
+        backend.set_backend("auto")
+
+    def _compare(self, f, rtol=1E-12, atol=1E-15):
+        backend.set_backend("numpy")
+        self.assertEqual(backend.get_backend(), "numpy")
+        r_numpy = f()
+        backend.set_backend("numba")
+        self.assertEqual(backend.get_backend(), "numba")
+        r_numba = f()
+        numpy.testing.assert_allclose(r_numba, r_numpy, rtol=rtol, atol=atol)
+
+    def test_kernels(self):
+        x = numpy.linspace(0., 50., 101*99).reshape(101, 99)
+        self._compare(lambda: sphere_diffraction.sphere_form_factor(x))
+        q_x, q_y = numpy.meshgrid(numpy.linspace(-4E8, 4E8, 101), numpy.linspace(-3E8, 3E8, 81))
+        self._compare(lambda: spheroid_diffraction.F_spheroid_diffraction(2., q_x, q_y, 40E-9, 60E-9, 0.3, 1.2))
+        self._compare(lambda: spheroid_diffraction.F_spheroid_diffraction(2., q_x, q_y, 40E-9, 60E-9, numpy.array([0.3, 1.]), 1.2))
+        for polarization in ["vertical", "horizontal", "unpolarized"]:
+            self._compare(lambda: diffraction.polarization_factor(q_x*1E-10, q_y*1E-10, 0.05, polarization=polarization))
+        qmap = numpy.random.RandomState(0).normal(size=(20, 30, 3)) * 1E8
+        F = numpy.random.RandomState(1).normal(size=(20, 30))
+        self._compare(lambda: backend.phase_factor(F, qmap, [1E-8, -2E-8, 3E-9]))
+        # Spreading of the moments of the projection approximation
+        R = numpy.random.RandomState(2)
+        u = R.rand(500, 2) * 20. + 4.
+        i_start = numpy.int64(numpy.floor(u)) - 2
+        weights = R.rand(500, 2, 6)
+        w = R.normal(size=500) + 1j * R.normal(size=500)
+        zeta = R.normal(size=500)
+        self._compare(lambda: backend.spread_moments(w, zeta, 3, i_start, weights, 32))
+        grids = R.normal(size=(3, 16, 20)) + 1j * R.normal(size=(3, 16, 20))
+        self._compare(lambda: backend.interpolate_grids(grids, i_start, weights, numpy.zeros((3, 500), dtype=numpy.complex128)))
+        m = bodies.make_spheroid_map(24, 8., 11.)
+        rot = condor.utils.rotation.Rotation(formalism="quaternion", values=condor.utils.rotation.quat(0.7, 0.3, 0.5, 0.8))
+        qmap = condor.Detector(distance=0.1, pixel_size=600E-6, nx=32, ny=32).generate_qmap(1E-9)
+        self._compare(lambda: projection.F_projection(m, 1E-9, qmap, rotation=rot, curvature_order=3), rtol=1E-9, atol=1E-9)
+
+    def test_propagate(self):
+        for par in [("particle_sphere", condor.ParticleSphere(diameter=100E-9, position=[1E-8, 2E-8, 0.])),
+                    ("particle_spheroid", condor.ParticleSpheroid(diameter=100E-9, flattening=0.6, rotation_formalism="random"))]:
+            for polarization in ["ignore", "unpolarized"]:
+                self._compare(lambda: _propagate(par, polarization), rtol=1E-10, atol=1E-12)
+
+if __name__ == '__main__':
+    unittest.main()
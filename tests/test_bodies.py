@@ -0,0 +1,54 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+import condor.utils.bodies
+
+class TestCaseBodies(unittest.TestCase):
+    def test_slabs(self):
+        # Result must not depend on the slab size
+        rot = condor.utils.rotation.Rotation(formalism="quaternion", values=condor.utils.rotation.quat(0.7, 0.3, 0.5, 0.8))
+        for f, args in [(condor.utils.bodies.make_sphere_map, (33, 12.3)),
+                        (condor.utils.bodies.make_spheroid_map, (33, 8., 12.3, rot)),
+                        (condor.utils.bodies.make_cube_map, (33, 15.4))]:
+            m = f(*args)
+            self.assertEqual(m.shape, (33, 33, 33))
+            self.assertTrue(numpy.array_equal(m, f(*args, slab_voxels=50)))
+            m32 = f(*args, dtype="float32")
+            self.assertEqual(m32.dtype, numpy.float32)
+            self.assertTrue(numpy.allclose(m, m32))
+
+    def test_volume(self):
+        N = 48
+        nR = 15.
+        m = condor.utils.bodies.make_sphere_map(N, nR)
+        self.assertAlmostEqual(m.sum() / (4/3.*numpy.pi*nR**3), 1., delta=0.01)
+        self.assertEqual(m[N//2, N//2, N//2], 1.)
+        self.assertEqual(m[0, 0, 0], 0.)
+        nel = 20.5
+        m = condor.utils.bodies.make_cube_map(N, nel)
+        self.assertAlmostEqual(m.sum() / nel**3, 1., delta=0.01)
+
+    def test_icosahedron(self):
+        N = 40
+        nRmax = 15.3
+        rot = condor.utils.rotation.Rotation(formalism="quaternion", values=condor.utils.rotation.quat(0.7, 0.3, 0.5, 0.8))
+        m = condor.utils.bodies.make_icosahedron_map(N, nRmax, rot, n_threads=1)
+        # Threads fill disjoint slabs of the same buffer
+        out = numpy.zeros((N, N, N), dtype="float32")
+        self.assertIs(condor.utils.bodies.make_icosahedron_map(N, nRmax, rot, out=out, n_threads=3), out)
+        self.assertTrue(numpy.allclose(m, out))
+        # Partial-volume values converge to the volume of the icosahedron
+        phi = (1+numpy.sqrt(5))/2.
+        a = 2*nRmax/numpy.sqrt(phi**2+1)
+        V = 5/12.*(3+numpy.sqrt(5))*a**3
+        m4 = condor.utils.bodies.make_icosahedron_map(N, nRmax, rot, supersampling=4)
+        self.assertAlmostEqual(m4.sum() / V, 1., delta=1E-3)
+        # Values are fractions of the 4 x 4 x 4 sample points
+        self.assertTrue(numpy.allclose(m4*64, (m4*64).round()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import os
+import shutil
+import tempfile
+import weakref
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+import condor.utils.cache
+import condor.utils.fourier_volume
+from condor.utils.cache import LRUCache, DiskCache, get_nbytes, get_content_key
+
+class TestCaseCache(unittest.TestCase):
+    def test_lru(self):
+        C = LRUCache(max_entries=2, max_bytes=2000)
+        a = numpy.zeros(100)
+        C.put("a", a)
+        C.put("b", numpy.zeros(100))
+        self.assertIs(C.get("a"), a)
+        # Least recently used entry ("b") is discarded
+        C.put("c", numpy.zeros(100))
+        self.assertEqual(C.keys(), ["a", "c"])
+        self.assertIsNone(C.get("b"))
+        # Size limit
+        C.put("d", numpy.zeros(200))
+        self.assertEqual(C.keys(), ["d"])
+        self.assertEqual(C.nbytes, 1600)
+        # Too large to be cached
+        C.put("e", numpy.zeros(300))
+        self.assertNotIn("e", C)
+        S = C.get_stats()
+        self.assertEqual((S["hits"], S["misses"], S["evictions"]), (1, 1, 3))
+        self.assertEqual(C.find(lambda key: key > "c"), ("d", C.peek("d")))
+        # Views are counted with the size of their base
+        self.assertEqual(get_nbytes((numpy.broadcast_to(a, (5, 100)), {"x" : a})), 1600)
+
+    def test_particle_map(self):
+        par = condor.ParticleMap(geometry="sphere", diameter=50E-9, material_type=["water", "protein"])
+        dx = 2E-9
+        for d in [50E-9, 60E-9, 50E-9, 60E-9]:
+            m, dx_m = par.get_new_map({"geometry" : "sphere", "diameter" : d}, dx_required=dx, dx_suggested=dx)
+        S = par.get_map_cache_stats()
+        self.assertEqual((S["entries"], S["hits"], S["misses"]), (2, 2, 2))
+        # One physical copy for both materials
+        self.assertEqual(m.shape[0], 2)
+        self.assertEqual(S["nbytes"], m[0].nbytes + par.get_new_map({"geometry" : "sphere", "diameter" : 50E-9}, dx, dx)[0][0].nbytes)
+        self.assertFalse(m.flags.writeable)
+        # Cached map with insufficient resolution is not reused
+        par.get_new_map({"geometry" : "sphere", "diameter" : 60E-9}, dx_required=dx/2., dx_suggested=dx/2.)
+        self.assertEqual(par.get_map_cache_stats()["entries"], 3)
+        par.set_map_cache(max_entries=1)
+        self.assertEqual(par.get_map_cache_stats()["entries"], 1)
+
+    def test_dn_map(self):
+        par = condor.ParticleMap(geometry="sphere", diameter=50E-9, material_type=["water", "protein"])
+        O = {"geometry" : "sphere", "diameter" : 50E-9}
+        dn1, dx = par.get_new_dn_map(O, 2E-9, 2E-9, 1E-9)
+        dn2, dx = par.get_new_dn_map(O, 2E-9, 2E-9, 1E-9)
+        self.assertIs(dn1, dn2)
+        self.assertFalse(dn1.flags.writeable)
+        m, dx = par.get_new_map(O, 2E-9, 2E-9)
+        dn_ref = m[0] * sum([mat.get_dn(1E-9) for mat in par.materials])
+        self.assertTrue(numpy.allclose(dn1, dn_ref))
+        # New wavelength or changed material
+        dn3, dx = par.get_new_dn_map(O, 2E-9, 2E-9, 2E-9)
+        par.materials[1].massdensity *= 1.1
+        dn4, dx = par.get_new_dn_map(O, 2E-9, 2E-9, 1E-9)
+        self.assertFalse(numpy.allclose(dn1, dn4))
+        S = par.get_dn_map_cache_stats()
+        self.assertEqual((S["entries"], S["hits"], S["misses"]), (3, 1, 3))
+        # Refractive index maps are discarded with the map they were derived from
+        del m
+        par.set_map_cache(max_entries=1)
+        par.get_new_dn_map(O, 2E-9, 2E-9, 1E-9)
+        self.assertEqual(par.get_dn_map_cache_stats()["entries"], 1)
+        par.get_new_map({"geometry" : "sphere", "diameter" : 60E-9}, 2E-9, 2E-9)
+        self.assertEqual(par.get_dn_map_cache_stats()["entries"], 0)
+        # Multiple materials with separate maps
+        m = numpy.random.rand(2, 10, 10, 10)
+        par = condor.ParticleMap(geometry="custom", map3d=m, dx=1E-9, material_type=["water", "protein"])
+        dn, dx = par.get_new_dn_map({"geometry" : "custom", "diameter" : par.diameter_mean}, 2E-9, 2E-9, 1E-9)
+        self.assertTrue(numpy.allclose(dn, m[0]*par.materials[0].get_dn(1E-9) + m[1]*par.materials[1].get_dn(1E-9)))
+
+    def test_support_cache(self):
+        par = condor.ParticleMap(geometry="sphere", diameter=50E-9, material_type="water")
+        par.set_map_cache(max_entries=1)
+        refs = []
+        for d in [30E-9, 40E-9, 50E-9, 60E-9]:
+            m, dx = par.get_new_map({"geometry" : "sphere", "diameter" : d}, 2E-9, 2E-9)
+            m_c, shift = par._crop_map_to_support(m)
+            refs.append(weakref.ref(par._get_map_key(m)[0]))
+            del m, m_c
+        # Discarded maps are not kept alive by the derived caches
+        self.assertEqual([r() is None for r in refs], [True, True, True, False])
+        self.assertEqual(len(par._support_cache), 1)
+        par.set_map_cache(max_entries=0)
+        self.assertEqual(len(par._support_cache), 0)
+
+    def test_disk_cache(self):
+        path = tempfile.mkdtemp()
+        disk_cache = condor.utils.cache._disk_cache
+        try:
+            C = DiskCache(os.path.join(path, "cache"))
+            a = numpy.random.rand(4, 5) + 1j
+            key = get_content_key("a", a, 2.)
+            self.assertIsNone(C.get(key))
+            b = C.put(key, a)
+            self.assertTrue(numpy.array_equal(a, b))
+            self.assertFalse(b.flags.writeable)
+            self.assertTrue(numpy.array_equal(C.get(key), a))
+            self.assertEqual(os.listdir(C.path), ["%s.npy" % key])
+            S = C.get_stats()
+            self.assertEqual((S["hits"], S["misses"], S["writes"]), (1, 1, 1))
+            # Keys depend on the content of the arrays but not on their memory layout
+            self.assertEqual(get_content_key(a.T.copy().T), get_content_key(a))
+            self.assertEqual(get_content_key(numpy.broadcast_to(a[0], (3, 5))), get_content_key(numpy.array([a[0]]*3)))
+            self.assertNotEqual(get_content_key(a), get_content_key(a.astype(numpy.complex64)))
+            self.assertNotEqual(get_content_key("a", a, 2.), get_content_key("a", a, 2.0000001))
+            # Fourier volumes
+            m = numpy.random.rand(10, 10, 10)
+            V0 = condor.utils.fourier_volume.FourierVolume(m)
+            V1 = condor.utils.fourier_volume.FourierVolume(m, disk_cache=C)
+            V2 = condor.utils.fourier_volume.FourierVolume(m, disk_cache=C)
+            self.assertEqual(C.get_stats()["hits"], 2)
+            # The volume written to disk is used as read-only memory map
+            self.assertIsInstance(V1.volume, numpy.memmap)
+            self.assertFalse(V1.volume.flags.writeable)
+            self.assertTrue(numpy.array_equal(V1.volume, V0.volume))
+            self.assertTrue(numpy.array_equal(V2.volume, V0.volume))
+            self.assertTrue(numpy.allclose(V2.interpolate([[0.1, 0.2, -0.3]]), V0.interpolate([[0.1, 0.2, -0.3]])))
+            # Resampled maps of another instance are read from disk
+            condor.utils.cache.set_disk_cache_dir(C.path)
+            N = 48
+            Z, Y, X = numpy.indices((N, N, N)) - N//2
+            m = numpy.float64(numpy.sqrt(X**2 + Y**2 + Z**2) < N/3.)
+            M = []
+            for i in range(2):
+                par = condor.ParticleMap(geometry="custom", map3d=m, dx=1E-9, material_type="water")
+                M.append(par.get_new_map({"geometry" : "custom", "diameter" : par.diameter_mean}, dx_required=5E-9, dx_suggested=4E-9)[0])
+            self.assertTrue(M[0].shape[-1] < N)
+            self.assertTrue(numpy.array_equal(M[0], M[1]))
+            self.assertEqual(condor.utils.cache.get_disk_cache().get_stats()["hits"], 1)
+            C.clear()
+            self.assertEqual(os.listdir(C.path), [])
+        finally:
+            condor.utils.cache._disk_cache = disk_cache
+            shutil.rmtree(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ logger = logging.getLogger('condor')
 logger.setLevel("WARNING")
 
 import condor
+import condor.utils.bodies
 
 SAVE_OUTPUT = False
 
@@ -56,6 +57,136 @@ def test_compare_spheroid_with_map(tolerance = 0.15):
     err = abs(diff).sum() / ((I_ideal.sum()+I_map.sum())/2.)
     assert err < tolerance
 
+def test_compare_polyhedron_with_map(tolerance = 0.15):
+    """
+    Compare the diffraction patterns of an icosahedron and a cube calculated with the analytical polyhedron form factor with the ones calculated from 3D refractive index maps on a regular grid
+    """
+    src = condor.Source(wavelength=0.1E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+    det = condor.Detector(distance=0.5, pixel_size=750E-6, nx=100, ny=100, cx=45, cy=59)
+    angle = 72./360.*2*numpy.pi
+    rotation_axis = numpy.array([0.43,0.643,0.2])
+    rotation_axis = rotation_axis / condor.utils.linalg.length(rotation_axis)
+    rotation_values = numpy.array([condor.utils.rotation.quat(angle,rotation_axis[0],rotation_axis[1], rotation_axis[2])])
+    for geometry in ["icosahedron", "cube"]:
+        kwargs = dict(geometry=geometry, diameter=25E-9*12/100., material_type="water", rotation_values=rotation_values, rotation_formalism="quaternion")
+        E = condor.Experiment(src, {"particle_polyhedron" : condor.ParticlePolyhedron(**kwargs)}, det)
+        I_ideal = abs(E.propagate()["entry_1"]["data_1"]["data_fourier"])**2
+        E = condor.Experiment(src, {"particle_map" : condor.ParticleMap(**kwargs)}, det)
+        I_map = abs(E.propagate()["entry_1"]["data_1"]["data_fourier"])**2
+        err = abs(I_ideal-I_map).sum() / ((I_ideal.sum()+I_map.sum())/2.)
+        assert err < tolerance
+
+def test_compare_spheroid_3d_with_map(tolerance = 0.15):
+    """
+    Compare the 3D Fourier volume of a spheroid calculated with the direct formula with the one calculated from a 3D refractive index map on a regular grid
+    """
+    src = condor.Source(wavelength=0.1E-9, pulse_energy=1E-3, focus_diameter=1E-6, polarization="ignore")
+    det = condor.Detector(distance=0.5, pixel_size=750E-6*100/32., nx=32, ny=32, solid_angle_correction=False)
+    angle = 72./360.*2*numpy.pi
+    rotation_axis = numpy.array([0.43,0.643,0.2])
+    rotation_axis = rotation_axis / condor.utils.linalg.length(rotation_axis)
+    rotation_values = numpy.array([condor.utils.rotation.quat(angle,rotation_axis[0],rotation_axis[1], rotation_axis[2])])
+    short_diameter = 25E-9*12/100.
+    long_diameter = 2*short_diameter
+    spheroid_diameter   = condor.utils.spheroid_diffraction.to_spheroid_diameter(short_diameter/2.,long_diameter/2.)
+    spheroid_flattening = condor.utils.spheroid_diffraction.to_spheroid_flattening(short_diameter/2.,long_diameter/2.)
+    kwargs = dict(diameter=spheroid_diameter, material_type="water", flattening=spheroid_flattening, rotation_values=rotation_values, rotation_formalism="quaternion")
+    # Ideal spheroid
+    E = condor.Experiment(src, {"particle_spheroid" : condor.ParticleSpheroid(**kwargs)}, det)
+    F_ideal = E.propagate3d()["entry_1"]["data_1"]["data_fourier"]
+    # Map (spheroid)
+    E = condor.Experiment(src, {"particle_map_spheroid" : condor.ParticleMap(geometry="spheroid", **kwargs)}, det)
+    F_map = E.propagate3d()["entry_1"]["data_1"]["data_fourier"]
+    # Compare
+    # (Corners of the rotated volume lie outside the Fourier space covered by the map)
+    valid = numpy.isfinite(F_map)
+    I_ideal = abs(F_ideal[valid])**2
+    I_map = abs(F_map[valid])**2
+    err = abs(I_ideal-I_map).sum() / ((I_ideal.sum()+I_map.sum())/2.)
+    assert err < tolerance
+
+def test_map_cropping(tolerance = 1E-4):
+    """
+    Compare the diffraction patterns of an off-centre custom map with and without cropping the map to the bounding box of its non-zero voxels
+    """
+    import condor.particle.particle_map
+    src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+    det = condor.Detector(distance=0.74, pixel_size=75E-6*1024/32, nx=32, ny=32, cx=14.3, cy=17.1)
+    rotation_values = numpy.array([condor.utils.rotation.quat(0.7,0.3,0.5,0.8)])
+    N = 32
+    Z, Y, X = numpy.indices((N, N, N))
+    map3d = numpy.float64(((X-20)**2 + (Y-12)**2 + ((Z-17)*1.3)**2) < 30) + 0.5*(abs(X-16) < 3)*(abs(Y-10) < 2)*(abs(Z-19) < 4)
+    par = condor.ParticleMap(geometry="custom", map3d=map3d, dx=1E-9, material_type="water", rotation_values=rotation_values, rotation_formalism="quaternion")
+    dn, dx, shift = par.get_new_cropped_dn_map(par.get_next(), 1.5E-9, 1.5E-9, 0.2E-9)
+    assert dn.shape[0] < N and numpy.any(shift != 0)
+    F = {}
+    for crop in [False, True]:
+        condor.particle.particle_map.ENABLE_MAP_CROPPING = crop
+        try:
+            E = condor.Experiment(src, {"particle_map" : par}, det)
+            F[crop] = E.propagate()["entry_1"]["data_1"]["data_fourier"]
+        finally:
+            condor.particle.particle_map.ENABLE_MAP_CROPPING = True
+    err = numpy.sqrt((abs(F[True]-F[False])**2).sum() / (abs(F[False])**2).sum())
+    assert err < tolerance
+
+def test_fourier_volume(tolerance = 1E-2):
+    """
+    Compare the diffraction patterns of a custom map propagated with the NFFT and by interpolation from the precomputed Fourier volume
+    """
+    src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+    det = condor.Detector(distance=0.74, pixel_size=75E-6*1024/32, nx=32, ny=32, cx=14.3, cy=17.1)
+    N = 32
+    Z, Y, X = numpy.indices((N, N, N))
+    map3d = numpy.float64(((X-20)**2 + (Y-12)**2 + ((Z-17)*1.3)**2) < 30) + 0.5*(abs(X-16) < 3)*(abs(Y-10) < 2)*(abs(Z-19) < 4)
+    F = {}
+    for propagation in ["nfft", "fourier_volume"]:
+        par = condor.ParticleMap(geometry="custom", map3d=map3d, dx=1E-9, material_type="water", rotation_formalism="random", propagation=propagation)
+        E = condor.Experiment(src, {"particle_map" : par}, det)
+        numpy.random.seed(1)
+        F[propagation] = [E.propagate()["entry_1"]["data_1"]["data_fourier"] for i in range(2)]
+    # The volume is calculated only once
+    assert E.metrics.get_counter("fourier_volume_cache_miss") == 1
+    for F_nfft, F_volume in zip(F["nfft"], F["fourier_volume"]):
+        err = numpy.sqrt((abs(F_volume-F_nfft)**2).sum() / (abs(F_nfft)**2).sum())
+        assert err < tolerance
+
+def test_point_group(tolerance = 1E-2):
+    """
+    Compare the diffraction patterns of a cube propagated with the NFFT and by interpolation from the asymmetric unit of the Fourier volume with the orientations restricted to the asymmetric unit
+    """
+    src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+    det = condor.Detector(distance=0.74, pixel_size=75E-6*1024/32, nx=32, ny=32, cx=14.3, cy=17.1)
+    map3d = condor.utils.bodies.make_cube_map(32, 15.)
+    I = {}
+    for propagation, point_group in [("nfft", None), ("fourier_volume", "O")]:
+        par = condor.ParticleMap(geometry="custom", map3d=map3d, dx=1E-9, material_type="water", rotation_formalism="random", propagation=propagation, point_group=point_group)
+        E = condor.Experiment(src, {"particle_map" : par}, det)
+        numpy.random.seed(1)
+        I[propagation] = [E.propagate()["entry_1"]["data_1"]["data"] for i in range(2)]
+    for I_nfft, I_volume in zip(I["nfft"], I["fourier_volume"]):
+        err = numpy.sqrt(((I_volume-I_nfft)**2).sum() / (I_nfft**2).sum())
+        assert err < tolerance
+
+def test_projection(tolerance = 1E-2):
+    """
+    Compare the diffraction patterns of a custom map propagated with the NFFT and in the projection approximation with curvature corrections
+    """
+    src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+    det = condor.Detector(distance=0.74, pixel_size=75E-6*1024/32, nx=32, ny=32, cx=14.3, cy=17.1)
+    N = 32
+    Z, Y, X = numpy.indices((N, N, N))
+    map3d = numpy.float64(((X-20)**2 + (Y-12)**2 + ((Z-17)*1.3)**2) < 30) + 0.5*(abs(X-16) < 3)*(abs(Y-10) < 2)*(abs(Z-19) < 4)
+    F = {}
+    for propagation in ["nfft", "projection"]:
+        par = condor.ParticleMap(geometry="custom", map3d=map3d, dx=1E-9, material_type="water", rotation_formalism="random", propagation=propagation)
+        E = condor.Experiment(src, {"particle_map" : par}, det)
+        numpy.random.seed(1)
+        F[propagation] = [E.propagate()["entry_1"]["data_1"]["data_fourier"] for i in range(2)]
+    for F_nfft, F_projection in zip(F["nfft"], F["projection"]):
+        err = numpy.sqrt((abs(F_projection-F_nfft)**2).sum() / (abs(F_nfft)**2).sum())
+        assert err < tolerance
+
 def test_compare_atoms_with_map(tolerance = 0.1):
     """
     Compare the output of two diffraction patterns, one simulated with descrete atoms (spsim) and the other one from a 3D refractive index map on a regular grid.
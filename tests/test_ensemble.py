@@ -0,0 +1,69 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+
+def _make_experiment(par, n=64):
+    src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+    det = condor.Detector(distance=0.74, pixel_size=75E-6*1024/n, nx=n, ny=n)
+    return condor.Experiment(src, {par[0] : par[1]}, det)
+
+class TestCaseEnsemble(unittest.TestCase):
+    def test_quadrature(self):
+        V = condor.utils.variation.Variation("normal", 2.)
+        x, w = V.get_quadrature(10., 8)
+        self.assertAlmostEqual((w*x).sum(), 10.)
+        self.assertAlmostEqual((w*(x-10.)**2).sum(), 4.)
+        V = condor.utils.variation.Variation("uniform", 2.)
+        x, w = V.get_quadrature(10., 8)
+        self.assertAlmostEqual((w*(x-10.)**2).sum(), 1/3.)
+
+    def test_no_variation(self):
+        for par in [("particle_sphere", condor.ParticleSphere(diameter=100E-9, material_type="water")),
+                    ("particle_spheroid", condor.ParticleSpheroid(diameter=100E-9, flattening=0.6, material_type="water",
+                                                                  rotation_values=[0.3, 0.2, 0.1], rotation_formalism="euler_angles_zxz"))]:
+            E = _make_experiment(par)
+            I_shot = E.propagate()["entry_1"]["data_1"]["data"]
+            I_ens = E.propagate_ensemble()["entry_1"]["data_1"]["data"]
+            numpy.testing.assert_allclose(I_ens, I_shot, rtol=1E-10)
+
+    def test_diameter_spread(self):
+        d0, s = 100E-9, 10E-9
+        E = _make_experiment(("particle_sphere", condor.ParticleSphere(diameter=d0, diameter_variation="normal", diameter_spread=s, material_type="water")))
+        I_ens = E.propagate_ensemble()["entry_1"]["data_1"]["data"]
+        # Reference: dense sampling of the normal distribution
+        d = numpy.linspace(d0-6*s, d0+6*s, 2001)
+        w = numpy.exp(-(d-d0)**2/(2*s**2))
+        w /= w.sum()
+        I_ref = 0.
+        for d_i, w_i in zip(d, w):
+            E.particles["particle_sphere"].diameter_mean = d_i
+            E.particles["particle_sphere"].set_diameter_variation(None, None, None)
+            I_ref = I_ref + w_i * E.propagate()["entry_1"]["data_1"]["data"]
+        numpy.testing.assert_allclose(I_ens, I_ref, rtol=1E-5, atol=1E-8*I_ref.max())
+
+    def test_spheroid_orientation(self):
+        par = condor.ParticleSpheroid(diameter=100E-9, flattening=0.6, material_type="water", rotation_formalism="random")
+        E = _make_experiment(("particle_spheroid", par))
+        O = E.propagate_ensemble()
+        I = O["entry_1"]["data_1"]["data"]
+        n = len(O["particles"]["particle_spheroid"]["theta"])
+        # Converged with respect to the number of orientations
+        I_fine = E.propagate_ensemble(orientation_order=int(numpy.sqrt(n/2))+8)["entry_1"]["data_1"]["data"]
+        numpy.testing.assert_allclose(I, I_fine, rtol=1E-5, atol=1E-8*I.max())
+        # Orientation average is rotationally symmetric around the beam axis
+        numpy.testing.assert_allclose(I[1:,1:], I[1:,1:].T, rtol=1E-10)
+        # Number of orientations chosen for every model separately
+        src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        det = condor.Detector(distance=0.74, pixel_size=75E-6*1024/64, nx=64, ny=64)
+        particles = {"particle_spheroid_large" : par,
+                     "particle_spheroid_small" : condor.ParticleSpheroid(diameter=20E-9, flattening=0.6, material_type="water", rotation_formalism="random")}
+        O = condor.Experiment(src, particles, det).propagate_ensemble()
+        self.assertEqual(len(O["particles"]["particle_spheroid_large"]["theta"]), n)
+        self.assertTrue(len(O["particles"]["particle_spheroid_small"]["theta"]) < n)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+import condor.utils.backend
+import condor.utils.fourier_volume
+
+def _dft(m, c):
+    # Fourier transform of a map (origin at index N//2) at coordinates c in unit of the inverse voxel size
+    x = numpy.arange(m.shape[0]) - m.shape[0]//2
+    E = [numpy.exp(-2j*numpy.pi*numpy.outer(c[:,i], x)) for i in range(3)]
+    return numpy.einsum("ni,nj,nk,ijk->n", E[0], E[1], E[2], m)
+
+def _err(F, F_ref):
+    return numpy.sqrt((abs(F - F_ref)**2).sum() / (abs(F_ref)**2).sum())
+
+class TestCaseFourierVolume(unittest.TestCase):
+    def setUp(self):
+        N = 24
+        Z, Y, X = numpy.indices((N, N, N)) - N//2
+        self.m = numpy.float64(numpy.sqrt(X**2 + Y**2 + (1.3*Z)**2) < 9) + 0.3j*(abs(X-5) < 3)*(abs(Y+3) < 4)*(abs(Z) < 3)
+        numpy.random.seed(0)
+        self.c = numpy.random.rand(200, 3) - 0.5
+        self.F = _dft(self.m, self.c)
+
+    def test_accuracy(self):
+        errors = {}
+        for kernel, width, oversampling in [("linear", 2, 2.), ("kaiser_bessel", 4, 2.), ("kaiser_bessel", 6, 2.), ("kaiser_bessel", 6, 3.)]:
+            V = condor.utils.fourier_volume.FourierVolume(self.m, oversampling=oversampling, kernel=kernel, width=width)
+            self.assertEqual(V.volume.shape[0] % 2, 0)
+            errors[(kernel, width, oversampling)] = _err(V.interpolate(self.c), self.F)
+        self.assertTrue(errors[("linear", 2, 2.)] < 0.1)
+        self.assertTrue(errors[("kaiser_bessel", 4, 2.)] < 2E-3)
+        self.assertTrue(errors[("kaiser_bessel", 6, 2.)] < 2E-5)
+        self.assertTrue(errors[("kaiser_bessel", 6, 3.)] < errors[("kaiser_bessel", 6, 2.)])
+
+    def test_backends(self):
+        V = condor.utils.fourier_volume.FourierVolume(self.m)
+        # Shape of the coordinates is kept and the transform is periodic
+        c = numpy.array([self.c, self.c + numpy.array([1, -2, 0])])
+        F = {}
+        for backend in ["numpy", "numba"]:
+            if backend == "numba" and condor.utils.backend.numba is None:
+                continue
+            condor.utils.backend.set_backend(backend)
+            F[backend] = V.interpolate(c)
+            self.assertEqual(F[backend].shape, (2, 200))
+            self.assertTrue(numpy.allclose(F[backend][0], F[backend][1]))
+            self.assertTrue(numpy.allclose(F[backend], F["numpy"]))
+        condor.utils.backend.set_backend("auto")
+
+    def test_particle_map(self):
+        par = condor.ParticleMap(geometry="custom", map3d=self.m.real, dx=1E-9, material_type="water", propagation="fourier_volume", oversampling=2.5)
+        dn, dx = par.get_new_dn_map(par.get_next(), 1E-9, 1E-9, 1E-9)
+        V = par.get_fourier_volume(dn)
+        self.assertEqual(V.oversampling, 2.5)
+        self.assertIs(par.get_fourier_volume(par.get_new_dn_map(par.get_next(), 1E-9, 1E-9, 1E-9)[0]), V)
+        self.assertEqual(par.get_fourier_volume_cache_stats()["hits"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+from condor.utils import metrics
+
+class TestCaseMetrics(unittest.TestCase):
+    def test_timer(self):
+        T = metrics.Timer("t")
+        for s in [1E-3, 2E-3, 3E-3, 1E-1]:
+            T.add(s)
+        D = T.get()
+        self.assertEqual(D["count"], 4)
+        self.assertAlmostEqual(D["total"], 0.106)
+        self.assertEqual(D["min"], 1E-3)
+        self.assertEqual(D["max"], 1E-1)
+        self.assertEqual(sum(D["histogram"]), 4)
+        self.assertEqual(len(D["histogram"]), len(metrics.histogram_edges())+1)
+        p50 = T.get_percentile(50)
+        self.assertTrue(1E-3 <= p50 <= 3E-3)
+        self.assertTrue(T.get_percentile(100) <= 1E-1)
+
+    def test_disabled(self):
+        M = metrics.Metrics(enabled=False)
+        with M.stage("a"):
+            pass
+        M.increment("c")
+        self.assertEqual(M.get()["timers"], {})
+        self.assertEqual(M.get_counter("c"), 0)
+        
+    def test_experiment(self):
+        src = condor.Source(wavelength=0.1E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        det = condor.Detector(distance=0.5, pixel_size=750E-6, nx=32, ny=32)
+        par = condor.ParticleSphere(diameter=50E-9, material_type="water")
+        E = condor.Experiment(src, {"particle_sphere" : par}, det)
+        for i in range(3):
+            E.propagate()
+        M = E.get_metrics()
+        self.assertEqual(M["timers"]["propagate"]["count"], 3)
+        self.assertEqual(M["timers"]["noise"]["count"], 3)
+        self.assertEqual(M["counters"]["qmap_radial_cache_miss"], 1)
+        self.assertEqual(M["counters"]["qmap_radial_cache_hit"], 2)
+        # The qmap is generated only once for the cached radial map
+        self.assertEqual(M["timers"]["qmap"]["count"], 1)
+        E.reset_metrics()
+        self.assertEqual(E.get_metrics()["timers"], {})
+
+    def test_map_cache_counters(self):
+        import numpy
+        src = condor.Source(wavelength=0.1E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        det = condor.Detector(distance=0.5, pixel_size=750E-6, nx=32, ny=32)
+        N = 48
+        Z, Y, X = numpy.indices((N, N, N)) - N//2
+        m = numpy.float64(numpy.sqrt(X**2 + Y**2 + Z**2) < N/3.)
+        # Finely sampled custom map that is resampled and cached
+        par = condor.ParticleMap(geometry="custom", map3d=m, dx=0.25E-9, material_type="water")
+        E = condor.Experiment(src, {"particle_map" : par}, det)
+        for i in range(3):
+            E.propagate()
+        S = par.get_map_cache_stats()
+        self.assertEqual((S["hits"], S["misses"]), (2, 1))
+        self.assertEqual(E.metrics.get_counter("map_cache_hit"), 2)
+        self.assertEqual(E.metrics.get_counter("map_cache_miss"), 1)
+
+    def test_memory(self):
+        M = metrics.Metrics(track_memory=True)
+        if not M.track_memory:
+            return
+        import numpy
+        with M.stage("outer"):
+            a = numpy.ones(10**6)
+            with M.stage("inner"):
+                b = numpy.ones(2*10**6)
+                del b
+            del a
+        M.disable_memory_tracking()
+        D = M.get()["memory"]
+        self.assertTrue(D["inner"]["peak_max"] >= 16E6)
+        self.assertTrue(D["outer"]["peak_max"] >= 24E6)
+        self.assertTrue(D["outer"]["peak_max"] < 26E6)
+
+    def test_report(self):
+        import json
+        src = condor.Source(wavelength=0.1E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        det = condor.Detector(distance=0.5, pixel_size=750E-6, nx=32, ny=32)
+        par = condor.ParticleMap(geometry="icosahedron", diameter=50E-9, material_type="water")
+        E = condor.Experiment(src, {"particle_map" : par}, det)
+        for i in range(2):
+            E.propagate()
+        R = json.loads(json.dumps(E.get_run_report(wall_time=1.)))
+        self.assertEqual(R["shots"], 2)
+        self.assertAlmostEqual(R["shots_per_second"], 2.)
+        self.assertEqual(R["caches"]["map"]["hits"], 1)
+        self.assertEqual(R["caches"]["qmap"]["misses"], 1)
+        self.assertTrue(R["stages"]["nfft"]["p50"] > 0)
+        # Scattering vectors are generated once (cached) and scaled for every shot
+        self.assertEqual(R["stages"]["qmap"]["count"], 1)
+        self.assertEqual(R["stages"]["qmap_scale"]["count"], 2)
+        self.assertEqual(R["versions"]["condor"], condor.__version__)
+        # Number of processes only if known
+        self.assertNotIn("processes", R["workers"])
+        self.assertEqual(E.get_run_report(processes=4)["workers"]["processes"], 4)
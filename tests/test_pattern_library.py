@@ -0,0 +1,53 @@
+import unittest
+import os, shutil, tempfile
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+from condor.utils.pattern_library import build_pattern_library, PatternLibrary
+
+class TestCasePatternLibrary(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _make_experiment(self, name, particle, noise=None):
+        src = condor.Source(wavelength=1E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        det = condor.Detector(distance=0.15, pixel_size=150E-6, nx=64, ny=64, noise=noise)
+        return condor.Experiment(src, {name : particle}, det)
+
+    def test_radial(self):
+        numpy.random.seed(0)
+        par = condor.ParticleSphere(diameter=150E-9, diameter_variation="uniform", diameter_spread=200E-9, material_type="water")
+        lib = build_pattern_library(os.path.join(self.path, "spheres"), self._make_experiment("particle_sphere", par), 400)
+        self.assertEqual(len(lib), 400)
+        self.assertIsInstance(lib.features, numpy.memmap)
+        self.assertEqual(lib.features.dtype, numpy.float32)
+        # Noisy pattern with masked pixels
+        E = self._make_experiment("particle_sphere", condor.ParticleSphere(diameter=147E-9, material_type="water"), noise="poisson")
+        I = E.propagate()["entry_1"]["data_1"]["data"]
+        mask = numpy.ones(I.shape, dtype=bool)
+        mask[:,28:36] = False
+        I[~mask] = 1E9
+        res = PatternLibrary(os.path.join(self.path, "spheres")).query(I, mask=mask, k=3)
+        self.assertEqual(len(res["index"]), 3)
+        self.assertTrue((numpy.diff(res["score"]) <= 0).all())
+        self.assertAlmostEqual(res["diameter"][0], 147E-9, delta=2E-9)
+
+    def test_binned(self):
+        numpy.random.seed(0)
+        par = condor.ParticleSpheroid(diameter=100E-9, flattening=0.6, material_type="water", rotation_formalism="random_x")
+        E = self._make_experiment("particle_spheroid", par)
+        lib = build_pattern_library(self.path, E, 50, feature="binned", binning=4)
+        I = abs(E.propagate()["entry_1"]["data_1"]["data_fourier"])**2
+        res = lib.query_batch(numpy.array([I, 2*I]), k=1)
+        self.assertEqual(res["index"].shape, (2, 1))
+        self.assertEqual(res["index"][0,0], res["index"][1,0])
+        self.assertAlmostEqual(res["score"][0,0], 1., delta=0.02)
+
+if __name__ == '__main__':
+    unittest.main()
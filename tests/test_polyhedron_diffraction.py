@@ -0,0 +1,50 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+from condor.utils.polyhedron_diffraction import polyhedron_form_factor, get_cube_mesh, get_icosahedron_mesh, get_mesh_volume, orient_mesh
+import condor.utils.backend
+
+class TestCasePolyhedronDiffraction(unittest.TestCase):
+    def test_cube(self):
+        numpy.random.seed(0)
+        a = 1.7
+        q = numpy.random.randn(4000, 3) * 5.
+        # Small scattering vectors and scattering vectors in the planes of the faces
+        q[:100] *= 1E-6
+        q[100:200,2] = 0.
+        q[200:300,:2] = 1E-9
+        v, f = get_cube_mesh()
+        s = numpy.array([0.3, -0.2, 0.5])
+        A_ref = a**3 * numpy.prod(numpy.sinc(q*a/2./numpy.pi), axis=1) * numpy.exp(-1j*numpy.dot(q, s))
+        for backend in ["numpy", "numba"]:
+            if backend == "numba" and condor.utils.backend.numba is None:
+                continue
+            condor.utils.backend.set_backend(backend)
+            A = polyhedron_form_factor(q.reshape(40, 100, 3), v*a + s, f)
+            self.assertEqual(A.shape, (40, 100))
+            self.assertTrue(numpy.allclose(A.ravel(), A_ref, rtol=0., atol=1E-9))
+        condor.utils.backend.set_backend("auto")
+
+    def test_mesh(self):
+        v, f = get_icosahedron_mesh()
+        self.assertEqual(f.shape, (20, 3))
+        self.assertAlmostEqual(get_mesh_volume(v, f), 1.)
+        # Inverted orientation is corrected
+        v2, f2 = orient_mesh(v, f[:,::-1])
+        self.assertAlmostEqual(get_mesh_volume(v2, f2), 1.)
+        # Open surface is rejected
+        self.assertRaises(RuntimeError, orient_mesh, v, f[1:])
+        # Custom mesh with the size of the built-in cube
+        v, f = get_cube_mesh()
+        P0 = condor.ParticlePolyhedron(geometry="cube", diameter=50E-9)
+        P1 = condor.ParticlePolyhedron(geometry="custom", vertices=v*50E-9 + 1E-8, faces=f)
+        d = P1.diameter_mean
+        self.assertAlmostEqual(get_mesh_volume(*P1.get_mesh(d)) / get_mesh_volume(*P0.get_mesh(50E-9)), 1.)
+        self.assertTrue(numpy.allclose(P1.get_mesh(d)[0], P0.get_mesh(50E-9)[0], atol=1E-16))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+import condor.utils.projection
+from condor.utils.rotation import Rotation
+
+class TestCaseProjection(unittest.TestCase):
+    def setUp(self):
+        N = 24
+        Z, Y, X = numpy.indices((N, N, N)) - N//2
+        self.m = numpy.float64(numpy.sqrt(X**2 + Y**2 + (1.3*Z)**2) < 9) + 0.3j*(abs(X-5) < 3)*(abs(Y+3) < 4)*(abs(Z) < 3)
+        self.rot = Rotation(formalism="quaternion", values=condor.utils.rotation.quat(0.7, 0.3, 0.5, 0.8))
+        self.r = numpy.array([X.ravel(), Y.ravel(), Z.ravel()], dtype=numpy.float64).T.dot(self.rot.rotation_matrix.T)
+
+    def _dft(self, q):
+        return (self.m.ravel()[numpy.newaxis,:] * numpy.exp(-1j*q.dot(self.r.T))).sum(axis=1)
+
+    def test_accuracy(self):
+        numpy.random.seed(0)
+        q = (numpy.random.rand(200, 3) - 0.5) * numpy.pi * 0.9
+        # Projection approximation is exact for q_z = 0
+        q[:,2] = 0.
+        F = condor.utils.projection.F_projection(self.m, 1., q.reshape(10, 20, 3), rotation=self.rot, curvature_order=0)
+        self.assertEqual(F.shape, (10, 20))
+        F_ref = self._dft(q)
+        self.assertTrue(numpy.sqrt((abs(F.ravel() - F_ref)**2).sum() / (abs(F_ref)**2).sum()) < 1E-3)
+        # Curvature corrections
+        q[:,2] = 0.02 * (numpy.random.rand(200) - 0.5) * numpy.pi
+        F_ref = self._dft(q)
+        err = [numpy.sqrt((abs(condor.utils.projection.F_projection(self.m, 1., q, rotation=self.rot, curvature_order=K) - F_ref)**2).sum() / (abs(F_ref)**2).sum()) for K in [0, 1, 2]]
+        self.assertTrue(err[0] > err[1] > err[2])
+        self.assertTrue(err[2] < 2E-3)
+
+    def test_curvature_order(self):
+        self.assertEqual(condor.utils.projection.get_curvature_order(0., 100.), 0)
+        self.assertAlmostEqual(condor.utils.projection.get_curvature_error(0.1, 2., 2), 0.1**3/6.)
+        K = condor.utils.projection.get_curvature_order(0.01, 20., tolerance=1E-3)
+        self.assertTrue(condor.utils.projection.get_curvature_error(0.01, 20., K) <= 1E-3 < condor.utils.projection.get_curvature_error(0.01, 20., K-1))
+        self.assertIsNone(condor.utils.projection.get_curvature_order(10., 20.))
+
+if __name__ == '__main__':
+    unittest.main()
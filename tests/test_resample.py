@@ -0,0 +1,55 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+import condor.utils.resample
+
+def _dft(m, dx, q):
+    # Fourier transform of a map (centre at index N//2) at scattering vectors q (z, y, x)
+    x = (numpy.arange(m.shape[0]) - m.shape[0]//2) * dx
+    E = [numpy.exp(-1j*numpy.outer(q[:,i], x)) for i in range(3)]
+    return numpy.einsum("ni,nj,nk,ijk->n", E[0], E[1], E[2], m) * dx**3
+
+class TestCaseResample(unittest.TestCase):
+    def test_resample_map_fourier(self):
+        N = 40
+        Z, Y, X = numpy.indices((N, N, N)) - N//2
+        m = numpy.float64(numpy.sqrt(X**2 + Y**2 + (1.3*Z)**2) < 12) + 0.3*(abs(X-5) < 4)*(abs(Y+3) < 6)*(abs(Z) < 3)
+        q_band = numpy.pi / 3.
+        m2, dx2 = condor.utils.resample.resample_map_fourier(m, 1., q_band)
+        self.assertTrue(m2.shape[0] < N)
+        self.assertTrue(dx2 * q_band * (1 + condor.utils.resample.FOURIER_RESAMPLING_MARGIN) <= numpy.pi)
+        numpy.random.seed(0)
+        q = (numpy.random.rand(200, 3) - 0.5) * 2 * q_band
+        F = _dft(m, 1., q)
+        F2 = _dft(m2, dx2, q)
+        self.assertTrue(numpy.sqrt((abs(F - F2)**2).sum() / (abs(F)**2).sum()) < 2E-3)
+        # Complex maps
+        m2c, dx2 = condor.utils.resample.resample_map_fourier(m * (1 + 0.5j), 1., q_band)
+        self.assertTrue(numpy.allclose(m2c, m2 * (1 + 0.5j)))
+
+    def test_particle_map(self):
+        N = 48
+        Z, Y, X = numpy.indices((N, N, N)) - N//2
+        m = numpy.float64(numpy.sqrt(X**2 + Y**2 + Z**2) < N/3.)
+        par = condor.ParticleMap(geometry="custom", map3d=m, dx=1E-9, material_type="water")
+        O = {"geometry" : "custom", "diameter" : par.diameter_mean}
+        # Map sampled much finer than needed
+        m1, dx1 = par.get_new_map(O, dx_required=5E-9, dx_suggested=4E-9)
+        self.assertTrue(m1.shape[-1]**3 <= N**3 / condor.particle.particle_map.MAP_INTERPOLATION_MIN_REDUCTION)
+        self.assertTrue(dx1 < 4E-9)
+        # Second request reads from cache (also for a slightly different diameter)
+        O["diameter"] *= 1.01
+        m2, dx2 = par.get_new_map(O, dx_required=5E-9, dx_suggested=4E-9)
+        self.assertIs(m1, m2)
+        self.assertAlmostEqual(dx2 / dx1, 1.01)
+        self.assertEqual(par.get_map_cache_stats()["hits"], 1)
+        # Sampling close to the original grid spacing
+        m3, dx3 = par.get_new_map(O, dx_required=1.5E-9, dx_suggested=1.2E-9)
+        self.assertEqual(m3.shape[-1], N)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+from condor.utils import sphere_diffraction
+
+class TestCaseSphereDiffraction(unittest.TestCase):
+    def _make_experiment(self, cx, cy, analytic_tolerance=None):
+        src = condor.Source(wavelength=0.2E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        det = condor.Detector(distance=0.5, pixel_size=600E-6, nx=120, ny=100, cx=cx, cy=cy)
+        par = condor.ParticleSphere(diameter=120E-9, material_type="water")
+        return condor.Experiment(src, {"particle_sphere" : par}, det, analytic_tolerance=analytic_tolerance)
+    
+    def test_radial_symmetry(self):
+        for cx, cy in [(59.5, 49.5), (40., 49.5), (30., 20.)]:
+            E = self._make_experiment(cx, cy)
+            F_fast = E.propagate()["entry_1"]["data_1"]["data_fourier"]
+            self.assertTrue(E._qmap_radial_cache["q_unique"].size < F_fast.size / 2)
+            # Force evaluation on every pixel
+            E._qmap_radial_cache["inverse"] = None
+            F_full = E.propagate()["entry_1"]["data_1"]["data_fourier"]
+            numpy.testing.assert_allclose(F_fast, F_full, rtol=1E-10, atol=1E-10*abs(F_full).max())
+        # Centre close to but not on a half-integer position
+        E = self._make_experiment(500.004, 49.5)
+        E.propagate()
+        self.assertTrue(E._qmap_radial_cache["inverse"] is None)
+            
+    def test_interpolation(self):
+        tolerance = 1E-6
+        E = self._make_experiment(59.3, 49.7, analytic_tolerance=tolerance)
+        F_interp = E.propagate()["entry_1"]["data_1"]["data_fourier"]
+        self.assertTrue(E._qmap_radial_cache["inverse"] is None)
+        E.analytic_tolerance = None
+        F_full = E.propagate()["entry_1"]["data_1"]["data_fourier"]
+        self.assertTrue(abs(F_interp - F_full).max() <= tolerance * abs(F_full).max())
+        # Form factor
+        x = numpy.linspace(0., 200., 100001)
+        # Reference (Taylor expansion for small x where the closed form suffers from cancellation)
+        f = numpy.where(x < 0.1, 1. - x**2/10. + x**4/280. - x**6/15120. + x**8/1330560. - x**10/121080960., 3*(numpy.sin(x)-x*numpy.cos(x))/numpy.maximum(x, 0.1)**3)
+        numpy.testing.assert_allclose(sphere_diffraction.sphere_form_factor(x), f, rtol=0, atol=1E-13)
+        for tolerance in [1E-4, 1E-8, 1E-12]:
+            table = sphere_diffraction.SphereFormFactorTable(tolerance=tolerance, x_max=50.)
+            self.assertTrue(table.error_bound() <= tolerance * (1. + 1E-12))
+            f_interp = sphere_diffraction.sphere_form_factor(x, table=table)
+            self.assertTrue(abs(f - f_interp).max() <= tolerance)
+        self.assertTrue(table.x_max >= x.max())
+        # Scalar input
+        self.assertAlmostEqual(sphere_diffraction.sphere_form_factor(0.), 1.)
+        self.assertAlmostEqual(sphere_diffraction.F_sphere_diffraction(4., 1E7, 100E-9), 2.*3*(numpy.sin(1.)-numpy.cos(1.)))
+
+    def test_spheroid_table(self):
+        from condor.utils import spheroid_diffraction
+        q = numpy.linspace(-5E8, 5E8, 201)
+        qx, qy = numpy.meshgrid(q, q)
+        F = spheroid_diffraction.F_spheroid_diffraction(1., qx, qy, 40E-9, 70E-9, 0.4, 1.2)
+        table = sphere_diffraction.get_sphere_form_factor_table(1E-8)
+        self.assertTrue(table is sphere_diffraction.get_sphere_form_factor_table(1E-8))
+        F_table = spheroid_diffraction.F_spheroid_diffraction(1., qx, qy, 40E-9, 70E-9, 0.4, 1.2, table=table)
+        self.assertTrue(abs(F - F_table).max() <= 1E-8)
+        self.assertAlmostEqual(F[100,100], 1.)
+
+    def test_stack(self):
+        q = numpy.linspace(0., 5E8, 300).reshape(20, 15)
+        r = numpy.linspace(20E-9, 80E-9, 13)
+        K = numpy.linspace(1., 2., 13)
+        for table in [None, sphere_diffraction.get_sphere_form_factor_table(1E-8)]:
+            # Small chunks to test chunking
+            I = sphere_diffraction.I_sphere_diffraction_stack(K, q, r, table=table, chunk_bytes=5*2*8*q.size)
+            self.assertEqual(I.shape, (13, 20, 15))
+            for i in range(13):
+                numpy.testing.assert_allclose(I[i], sphere_diffraction.I_sphere_diffraction(K[i], q, r[i], table=table), rtol=1E-12, atol=1E-15)
+            chunks = list(sphere_diffraction.iter_I_sphere_diffraction_stack(K, q, r, table=table, chunk_bytes=5*2*8*q.size))
+            self.assertEqual([i0 for i0, I_chunk in chunks], [0, 5, 10])
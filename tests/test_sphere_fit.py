@@ -0,0 +1,36 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+from condor.utils.sphere_fit import SphereFitter
+
+class TestCaseSphereFit(unittest.TestCase):
+    def test_fit_batch(self):
+        numpy.random.seed(0)
+        src = condor.Source(wavelength=1E-9, pulse_energy=1E-3, focus_diameter=1E-6)
+        truth = [(80E-9, 63.5, 60.2), (120E-9, 66., 64.), (150E-9, 61.3, 65.7)]
+        frames = []
+        scales = []
+        for d, cx, cy in truth:
+            det = condor.Detector(distance=0.15, pixel_size=75E-6, nx=128, ny=128, cx=cx, cy=cy, hole_diameter_in_pixel=6, noise="poisson")
+            E = condor.Experiment(src, {"particle_sphere" : condor.ParticleSphere(diameter=d, material_type="water")}, det)
+            O = E.propagate()
+            frames.append(O["entry_1"]["data_1"]["data"])
+            scales.append(abs(O["entry_1"]["data_1"]["data_fourier"]).max()**2)
+        det = condor.Detector(distance=0.15, pixel_size=75E-6, nx=128, ny=128, hole_diameter_in_pixel=6)
+        fitter = SphereFitter(det, wavelength=1E-9, diameter_min=20E-9, diameter_max=300E-9)
+        res = fitter.fit_batch(numpy.array(frames))
+        for i, (d, cx, cy) in enumerate(truth):
+            self.assertAlmostEqual(res["diameter"][i] / d, 1., delta=0.005)
+            self.assertAlmostEqual(res["cx"][i], cx, delta=0.3)
+            self.assertAlmostEqual(res["cy"][i], cy, delta=0.3)
+            self.assertAlmostEqual(res["scale"][i] / scales[i], 1., delta=0.02)
+        # Single frame
+        r = fitter.fit(frames[1])
+        self.assertEqual(r["diameter"], res["diameter"][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import numpy
+
+from condor.utils import spheroid_diffraction, sphere_diffraction
+
+def _F_spheroid_reference(K, q_x, q_y, a, c, theta, phi):
+    # Direct implementation of the formula in the documentation of F_spheroid_diffraction
+    q = numpy.sqrt(q_x**2 + q_y**2)
+    g = numpy.arccos(numpy.cos(theta)*(-q_x*numpy.sin(phi) + q_y*numpy.cos(phi)) / numpy.maximum(q, 1E-300))
+    qH = q * numpy.sqrt(a**2*numpy.sin(g)**2 + c**2*numpy.cos(g)**2)
+    qHs = numpy.maximum(qH, 1E-2)
+    return numpy.sqrt(K) * numpy.where(qH < 1E-2, 1. - qH**2/10., 3 * (numpy.sin(qHs) - qHs*numpy.cos(qHs)) / qHs**3)
+
+class TestCaseSpheroidDiffraction(unittest.TestCase):
+    def setUp(self):
+        q = numpy.linspace(-4E8, 4E8, 151)
+        self.q_x, self.q_y = numpy.meshgrid(q, q[::-1]*0.8)
+    
+    def test_fused_kernel(self):
+        for a, c, theta, phi in [(40E-9, 60E-9, 0.3, 1.), (70E-9, 30E-9, 1.2, -2.), (50E-9, 50E-9, 0., 0.)]:
+            F = spheroid_diffraction.F_spheroid_diffraction(2., self.q_x, self.q_y, a, c, theta, phi)
+            F_ref = _F_spheroid_reference(2., self.q_x, self.q_y, a, c, theta, phi)
+            numpy.testing.assert_allclose(F, F_ref, rtol=0, atol=1E-9)
+            out = numpy.empty_like(self.q_x)
+            F_out = spheroid_diffraction.F_spheroid_diffraction(2., self.q_x, self.q_y, a, c, theta, phi, out=out)
+            self.assertTrue(F_out is out)
+            numpy.testing.assert_array_equal(F_out, F)
+
+    def test_orientation_stack(self):
+        theta = numpy.linspace(0., 1.5, 7)
+        phi = numpy.linspace(-3., 3., 7)
+        S = spheroid_diffraction.F_spheroid_diffraction(2., self.q_x, self.q_y, 40E-9, 60E-9, theta, phi)
+        self.assertEqual(S.shape, (7,) + self.q_x.shape)
+        for i in range(7):
+            numpy.testing.assert_array_equal(S[i], spheroid_diffraction.F_spheroid_diffraction(2., self.q_x, self.q_y, 40E-9, 60E-9, theta[i], phi[i]))
+        I = spheroid_diffraction.I_spheroid_diffraction(2., self.q_x, self.q_y, 40E-9, 60E-9, theta, phi)
+        numpy.testing.assert_allclose(I, S**2)
+
+    def test_stack(self):
+        a = numpy.linspace(30E-9, 60E-9, 5)
+        c = 50E-9
+        theta = numpy.linspace(0., 1.5, 5)
+        phi = 0.7
+        I = spheroid_diffraction.I_spheroid_diffraction_stack(3., self.q_x, self.q_y, a, c, theta, phi, chunk_bytes=2*2*8*self.q_x.size)
+        self.assertEqual(I.shape, (5,) + self.q_x.shape)
+        for i in range(5):
+            numpy.testing.assert_allclose(I[i], spheroid_diffraction.I_spheroid_diffraction(3., self.q_x, self.q_y, a[i], c, theta[i], phi))
+
+    def test_3d(self):
+        a, c = 30E-9, 50E-9
+        theta, phi = 0.4, 1.1
+        n = numpy.array([-numpy.cos(theta)*numpy.sin(phi), numpy.cos(theta)*numpy.cos(phi), numpy.sin(theta)])
+        # In the plane q_z = 0 identical to the 2D evaluation
+        qmap = numpy.zeros(self.q_x.shape + (3,))
+        qmap[...,0] = self.q_x
+        qmap[...,1] = self.q_y
+        F_3d = spheroid_diffraction.F_spheroid_diffraction_3d(2., qmap, a, c, n)
+        F_2d = spheroid_diffraction.F_spheroid_diffraction(2., self.q_x, self.q_y, a, c, theta, phi)
+        numpy.testing.assert_allclose(F_3d, F_2d, rtol=1E-10, atol=1E-14)
+        # Symmetric under rotation around the axis
+        q = numpy.random.RandomState(0).normal(size=(4, 5, 6, 3)) * 1E8
+        F = spheroid_diffraction.F_spheroid_diffraction_3d(1., q, a, c, n)
+        q_par = numpy.dot(q, n)
+        q_perp = numpy.sqrt((q**2).sum(axis=-1) - q_par**2)
+        F_ref = sphere_diffraction.sphere_form_factor(numpy.sqrt(a**2*q_perp**2 + c**2*q_par**2))
+        numpy.testing.assert_allclose(F, F_ref, rtol=1E-9, atol=1E-14)
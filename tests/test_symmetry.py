@@ -0,0 +1,88 @@
+import unittest
+import numpy
+import logging
+logger = logging.getLogger('condor')
+logger.setLevel("WARNING")
+
+import condor
+import condor.utils.symmetry
+import condor.utils.rotation
+import condor.utils.bodies
+import condor.utils.fourier_volume
+import condor.utils.polyhedron_diffraction
+
+class TestCaseSymmetry(unittest.TestCase):
+    def test_point_groups(self):
+        for name, order in [("C1", 1), ("C3", 3), ("D2", 4), ("D5", 10), ("T", 12), ("O", 24), ("I", 60)]:
+            G = condor.utils.symmetry.get_point_group(name)
+            self.assertEqual(len(G), order)
+            self.assertTrue(numpy.allclose(G[0], numpy.identity(3)))
+            # Rotations and closed under multiplication
+            self.assertTrue(numpy.allclose(numpy.linalg.det(G), 1.))
+            for g in G[:5]:
+                P = numpy.einsum("ij,njk->nik", g, G)
+                self.assertTrue(all([numpy.abs(G - p).max(axis=(1,2)).min() < 1E-9 for p in P]))
+        # Icosahedron of the maps is invariant under I
+        v, faces = condor.utils.polyhedron_diffraction.get_icosahedron_mesh()
+        for g in condor.utils.symmetry.get_point_group("I"):
+            d = ((v.dot(g.T)[:,numpy.newaxis,:] - v[numpy.newaxis,:,:])**2).sum(axis=-1)
+            self.assertTrue(d.min(axis=1).max() < 1E-12)
+        with self.assertRaises(Exception):
+            condor.utils.symmetry.get_point_group("X")
+
+    def test_rotations(self):
+        numpy.random.seed(0)
+        G = condor.utils.symmetry.get_point_group("I")
+        R0 = numpy.array([condor.utils.rotation.rotmx_from_quat(condor.utils.rotation.rand_quat()) for i in range(5)])
+        # All symmetry equivalents of 5 orientations
+        R = numpy.einsum("mij,njk->mnik", R0, G).reshape(-1, 3, 3)
+        indices, R_red = condor.utils.symmetry.get_unique_rotation_matrices(R, "I")
+        self.assertEqual(list(indices), [0, 60, 120, 180, 240])
+        for R_i, R_red_i in zip(R0, R_red):
+            self.assertTrue(numpy.allclose(condor.utils.symmetry.reduce_rotation_matrices(R_i, "I"), R_red_i))
+        # Sequence of rotations reduced to the asymmetric unit
+        rotations = condor.utils.rotation.Rotations(values=R, formalism="rotation_matrix", point_group="I")
+        self.assertEqual(rotations.get_number_of_rotations(), 5)
+        self.assertEqual(rotations.get_point_group(), "I")
+        # Random rotations in the asymmetric unit
+        rotations = condor.utils.rotation.Rotations(formalism="random", point_group="O")
+        for i in range(10):
+            R_i = rotations.get_next_rotation().get_as_rotation_matrix()
+            traces = numpy.einsum("ij,nji->n", R_i, condor.utils.symmetry.get_point_group("O"))
+            self.assertTrue(traces[0] >= traces.max() - 1E-9)
+
+    def test_fold_vectors(self):
+        numpy.random.seed(0)
+        v = numpy.random.randn(100, 3)
+        for name in ["D2", "O", "I"]:
+            for order in ["xyz", "zyx"]:
+                f = condor.utils.symmetry.fold_vectors(v, name, order=order)
+                self.assertTrue(numpy.allclose((f**2).sum(axis=1), (v**2).sum(axis=1)))
+                self.assertTrue(numpy.allclose(condor.utils.symmetry.fold_vectors(f, name, order=order), f))
+
+    def test_fourier_volume(self):
+        numpy.random.seed(0)
+        c = numpy.random.rand(500, 3) - 0.5
+        c *= 0.45 / numpy.sqrt((c**2).sum(axis=1)).max()
+        # Maps of even size are symmetric about the centre of the array and not about the origin at index N//2
+        for name, m in [("O", condor.utils.bodies.make_cube_map(32, 15.)), ("D2", condor.utils.bodies.make_spheroid_map(32, 10., 13.))]:
+            V0 = condor.utils.fourier_volume.FourierVolume(m)
+            V1 = condor.utils.fourier_volume.FourierVolume(m, point_group=name)
+            self.assertTrue(V1.get_nbytes() < V0.get_nbytes() / 1.5)
+            F0 = V0.interpolate(c)
+            F1 = V1.interpolate(c)
+            self.assertTrue(numpy.sqrt((abs(F1 - F0)**2).sum() / (abs(F0)**2).sum()) < 1E-3)
+        # The voxelisation of the icosahedron is symmetric only approximately
+        m = condor.utils.bodies.make_icosahedron_map(48, 19.)
+        F0 = condor.utils.fourier_volume.FourierVolume(m).interpolate(c)
+        F1 = condor.utils.fourier_volume.FourierVolume(m, point_group="I").interpolate(c)
+        self.assertTrue(numpy.sqrt((abs(F1 - F0)**2).sum() / (abs(F0)**2).sum()) < 3E-2)
+
+    def test_particle_map(self):
+        # Point group without rotation
+        par = condor.ParticleMap(geometry="icosahedron", diameter=50E-9, material_type="water", point_group="I")
+        self.assertTrue(numpy.allclose(par.get_next()["extrinsic_quaternion"], [1., 0., 0., 0.]))
+        self.assertEqual(par._rotations.get_number_of_rotations(), 1)
+
+if __name__ == '__main__':
+    unittest.main()